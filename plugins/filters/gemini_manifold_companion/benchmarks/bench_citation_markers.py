@@ -0,0 +1,135 @@
+"""
+Benchmarks `Filter._get_text_w_citation_markers` and checks it against the previous algorithm.
+
+The previous algorithm inserted the markers of each support into a `bytearray`, walking the
+supports in reverse so that earlier byte offsets stay valid. The current one collects the
+insertion points and joins the slices in a single pass. Both must produce the same text for
+the supports the API returns (ordered by segment end).
+
+Needs the packages the companion filter imports (Open WebUI, google-genai, aiohttp, loguru).
+
+Usage:
+    python bench_citation_markers.py [--size 100000] [--supports 500] [--repeat 200]
+"""
+
+import argparse
+import importlib.util
+import pathlib
+import random
+import sys
+import timeit
+
+from google.genai import types
+from loguru import logger
+
+COMPANION_PATH = (
+    pathlib.Path(__file__).resolve().parents[1] / "gemini_manifold_companion.py"
+)
+# Mixes in multi-byte characters, because support offsets are UTF-8 byte offsets.
+WORDS = ["grounding", "response", "source", "café", "naïve", "日本語", "данные", "🙂", "a"]
+
+
+def load_companion():
+    spec = importlib.util.spec_from_file_location(
+        "gemini_manifold_companion", COMPANION_PATH
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_response(rng: random.Random, size: int, n_supports: int, n_chunks: int = 20):
+    """Returns a text of about `size` UTF-8 bytes and `n_supports` supports ordered by end."""
+    words: list[str] = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word.encode("utf-8")) + 1
+    text = " ".join(words)
+
+    # Byte offsets of the character boundaries, supports never split a character.
+    boundaries = [0]
+    for char in text:
+        boundaries.append(boundaries[-1] + len(char.encode("utf-8")))
+    # Some supports share an end, as they do in real responses.
+    ends = sorted(rng.choices(boundaries, k=n_supports))
+    supports = [
+        types.GroundingSupport(
+            segment=types.Segment(end_index=end),
+            grounding_chunk_indices=rng.sample(range(n_chunks), rng.randint(1, 3)),
+        )
+        for end in ends
+    ]
+    chunks = [
+        types.GroundingChunk(web=types.GroundingChunkWeb(uri=f"https://example.com/{i}"))
+        for i in range(n_chunks)
+    ]
+    return text, types.GroundingMetadata(grounding_supports=supports, grounding_chunks=chunks)
+
+
+def reverse_slice_markers(content: str, supports: list[types.GroundingSupport]) -> str:
+    """The previous algorithm, without the thought handling and logging."""
+    modified_content_bytes = bytearray(content.encode("utf-8"))
+    for support in reversed(supports):
+        segment = support.segment
+        indices = support.grounding_chunk_indices
+        if not (indices is not None and segment and segment.end_index is not None):
+            continue
+        end_pos = segment.end_index
+        if not (0 <= end_pos <= len(modified_content_bytes)):
+            continue
+        citation_markers = "".join(f"[{index + 1}]" for index in indices)
+        modified_content_bytes[end_pos:end_pos] = citation_markers.encode("utf-8")
+    return modified_content_bytes.decode("utf-8")
+
+
+def check_equivalence(companion_filter, rounds: int = 50) -> None:
+    rng = random.Random(0)
+    for _ in range(rounds):
+        text, metadata = make_response(
+            rng, rng.randint(0, 5_000), rng.randint(1, 200)
+        )
+        expected = reverse_slice_markers(text, metadata.grounding_supports)
+        actual = companion_filter._get_text_w_citation_markers(metadata, text)
+        assert actual == expected, "Citation markers differ from the previous algorithm."
+        # Thoughts are passed through in front of the cited content.
+        thought = '<details type="reasoning">\n日本語 thoughts\n</details>\n'
+        actual = companion_filter._get_text_w_citation_markers(metadata, thought + text)
+        assert actual == thought + expected, "Thought prefix was not preserved."
+    print(f"Equivalence check passed for {rounds} random responses.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=100_000, help="Response size in bytes.")
+    parser.add_argument("--supports", type=int, default=500, help="Number of supports.")
+    parser.add_argument("--repeat", type=int, default=200, help="Calls per measurement.")
+    args = parser.parse_args()
+
+    companion_filter = load_companion().Filter()
+    # The filter logs every call, which would dominate the measurement.
+    logger.remove()
+
+    check_equivalence(companion_filter)
+
+    text, metadata = make_response(random.Random(1), args.size, args.supports)
+    supports = metadata.grounding_supports
+    print(
+        f"Response: {len(text.encode('utf-8'))} bytes, {len(supports)} supports, "
+        f"best of 5 x {args.repeat} calls"
+    )
+    for name, call in (
+        ("reverse slice (previous)", lambda: reverse_slice_markers(text, supports)),
+        (
+            "single pass (current)",
+            lambda: companion_filter._get_text_w_citation_markers(metadata, text),
+        ),
+    ):
+        best = min(timeit.repeat(call, number=args.repeat, repeat=5)) / args.repeat
+        print(f"  {name:<26} {best * 1000:8.3f} ms/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,23 +6,31 @@ author: suurt8ll
 author_url: https://github.com/suurt8ll
 funding_url: https://github.com/suurt8ll/open_webui_functions
 license: MIT
-version: 1.7.0
+version: 1.8.0
 """
 
-VERSION = "1.7.0"
+VERSION = "1.8.0"
 
 # This filter can detect that a feature like web search or code execution is enabled in the front-end,
 # set the feature back to False so Open WebUI does not run it's own logic and then
 # pass custom values to "Gemini Manifold google_genai" that signal which feature was enabled and intercepted.
 
-import copy
+import base64
+import collections
+import concurrent.futures
 import json
 from google.genai import types
 
 import sys
 import time
 import asyncio
+import contextlib
+import enum
+import queue
+import threading
+import weakref
 import aiohttp
+from urllib.parse import urljoin
 from fastapi import Request
 from fastapi.datastructures import State
 from loguru import logger
@@ -38,6 +46,10 @@ if TYPE_CHECKING:
     from loguru._handler import Handler  # type: ignore
     from open_webui.utils.manifold_types import *  # My personal types in a separate file for more robustness.
 
+# FALLBACK ONLY. The source of truth for model capabilities is the pipe's
+# `ModelCapabilityRegistry`, see `Filter._get_model_capabilities`. These lists are only
+# used until the pipe has published it on this worker, and must be kept in sync with
+# `GROUNDING_MODELS` and `CODE_EXECUTION_MODELS` in the Manifold pipe.
 # According to https://ai.google.dev/gemini-api/docs/models
 ALLOWED_GROUNDING_MODELS = {
     "gemini-2.5-pro",
@@ -87,15 +99,542 @@ ALLOWED_CODE_EXECUTION_MODELS = {
     "gemini-2.0-flash-exp",
     "gemini-2.0-flash-001",
 }
+IMAGE_GENERATION_MODELS = {
+    "gemini-2.0-flash-preview-image-generation",
+    "gemini-2.5-flash-image-preview",
+    "gemini-2.5-flash-image",
+}
+
+
+class ModelCapability(enum.IntFlag):
+    """Features a model supports. Must match `ModelCapability` in the Manifold pipe."""
+
+    NONE = 0
+    GROUNDING = 1
+    CODE_EXECUTION = 2
+    URL_CONTEXT = 4
+    IMAGE_OUTPUT = 8
+    THINKING = 16
+    SYSTEM_PROMPT = 32
+
+
+# Used until the pipe has published its model capability registry on this worker.
+FALLBACK_MODEL_CAPABILITIES: dict[str, ModelCapability] = {
+    model_id: (
+        (
+            ModelCapability.GROUNDING
+            if model_id in ALLOWED_GROUNDING_MODELS
+            else ModelCapability.NONE
+        )
+        | (
+            ModelCapability.CODE_EXECUTION
+            if model_id in ALLOWED_CODE_EXECUTION_MODELS
+            else ModelCapability.NONE
+        )
+        | (
+            ModelCapability.IMAGE_OUTPUT
+            if model_id in IMAGE_GENERATION_MODELS
+            else ModelCapability.NONE
+        )
+    )
+    for model_id in ALLOWED_GROUNDING_MODELS
+    | ALLOWED_CODE_EXECUTION_MODELS
+    | IMAGE_GENERATION_MODELS
+}
+
+# Must match `ModelCapabilityRegistry` in the Manifold pipe.
+MODEL_CAPABILITIES_APP_STATE_ATTR = "gemini_manifold_model_capabilities"
+
+# Maximum number of inlet plans kept, see `Filter._get_inlet_plan`.
+INLET_PLAN_CACHE_SIZE = 256
 
 # Default timeout for URL resolution
 # TODO: Move to Pipe.Valves.
 DEFAULT_URL_TIMEOUT = aiohttp.ClientTimeout(total=10)  # 10 seconds total timeout
 
+# Must match `GroundingStore` in the Manifold pipe.
+GROUNDING_STORE_APP_STATE_ATTR = "gemini_manifold_grounding_store"
+GROUNDING_STORE_REDIS_KEY_PREFIX = "gemini_manifold:grounding"
+
 # Setting auditable=False avoids duplicate output for log levels that would be printed out by the main log.
 log = logger.bind(auditable=False)
 
 
+class BackgroundLogSink:
+    """
+    A loguru sink that hands formatted log messages to a daemon thread which writes them to a stream.
+    This keeps slow stdout writes (e.g. a blocked container log pipe) off the event loop.
+    Messages are dropped instead of blocking the caller if the queue is full.
+    """
+
+    def __init__(self, stream=sys.stdout, max_queue_size: int = 10_000):
+        self._stream = stream
+        self._queue: queue.Queue[str | None] = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self._thread = threading.Thread(
+            target=self._run, name="gemini-manifold-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, message: str) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self) -> None:
+        """Called by loguru when the handler is removed. Lets the thread drain the queue and exit."""
+        self._queue.put(None)
+
+    def _run(self) -> None:
+        while (message := self._queue.get()) is not None:
+            try:
+                self._stream.write(message)
+                # Flush once the backlog is written instead of after every message.
+                if self._queue.empty():
+                    self._stream.flush()
+            except Exception:
+                pass
+
+
+class PluginLogging:
+    """
+    Process-wide, idempotent setup of the loguru handler that prints this plugin's logs.
+
+    Open WebUI assigns freshly loaded valves to the plugin before every request,
+    so `configure` is called often. It returns right away if the requested
+    level and sink are already installed. Otherwise it replaces the handler
+    and increments `version`. Handlers left behind by a previous load of this
+    module (e.g. after the function was edited) are removed the first time.
+
+    The same class is used by Gemini Manifold and its companion filter.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # Incremented every time the handler is (re)installed.
+        self.version = 0
+        self._config: tuple[str, bool] | None = None
+        self._handler_id: int | None = None
+        self._lock = threading.Lock()
+
+    def configure(self, level: str, enqueue: bool = False) -> None:
+        """Installs the handler with the given level and sink unless it is already installed."""
+        config = (level, enqueue)
+        if config == self._config:
+            return
+        with self._lock:
+            if config == self._config:
+                return
+            try:
+                log.level(level)
+            except ValueError:
+                log.error(
+                    f"Invalid LOG_LEVEL '{level}' configured for plugin {self.name}. Cannot add/update handler."
+                )
+                return
+
+            if self._handler_id is None:
+                self._remove_stale_handlers()
+            else:
+                with contextlib.suppress(ValueError):
+                    log.remove(self._handler_id)
+            self._handler_id = log.add(
+                BackgroundLogSink() if enqueue else sys.stdout,
+                level=level,
+                format=self.format,
+                filter=self.filter,
+            )
+            self._config = config
+            self.version += 1
+        log.debug(
+            f"Configured the log handler for {self.name} with level {level} ({enqueue=}, version {self.version})."
+        )
+
+    def filter(self, record: "Record") -> bool:
+        """Only allows logs from this plugin (based on module name)."""
+        return record["name"] == self.name
+
+    def _remove_stale_handlers(self) -> None:
+        """Removes handlers that an earlier load of this module installed for the same module name."""
+        handlers: dict[int, "Handler"] = log._core.handlers  # type: ignore
+        for handler_id, handler in list(handlers.items()):
+            existing_filter = handler._filter  # Access internal attribute
+            owner = getattr(existing_filter, "__self__", None)
+            # Compared by name, the class object changes when the plugin is reloaded.
+            is_stale = (
+                type(owner).__name__ == type(self).__name__
+                and getattr(owner, "name", None) == self.name
+            ) or (
+                # Handlers installed by plugin versions that predate this class.
+                getattr(existing_filter, "__name__", None) == "plugin_filter"
+                and getattr(existing_filter, "__module__", None) == self.name
+            )
+            if is_stale:
+                with contextlib.suppress(ValueError):
+                    log.remove(handler_id)
+                log.debug(f"Removed stale handler {handler_id} for {self.name}.")
+
+    def _is_flat_dict(self, data: Any) -> bool:
+        """
+        Checks if a dictionary contains only non-dict/non-list values (is one level deep).
+        """
+        if not isinstance(data, dict):
+            return False
+        return not any(isinstance(value, (dict, list)) for value in data.values())
+
+    def _truncate_long_strings(
+        self, data: Any, max_len: int, truncation_marker: str
+    ) -> Any:
+        """
+        Recursively traverses a data structure and truncates long string and bytes values.
+        Runs before JSON conversion, so large blobs (e.g. inline image data) are never
+        base64 encoded in full. Pydantic models are dumped to dicts first.
+
+        The original data is never modified. Containers are only rebuilt if something
+        inside them was truncated, otherwise the original object is returned.
+
+        Args:
+            data: The data structure to process.
+            max_len: The maximum allowed length for string values.
+            truncation_marker: The string to append to truncated values.
+
+        Returns:
+            The data with long strings truncated, sharing all unchanged parts with the original.
+        """
+        if isinstance(data, str):
+            if len(data) > max_len:
+                return data[: max_len - len(truncation_marker)] + truncation_marker
+            return data
+        elif isinstance(data, (bytes, bytearray)):
+            # Bytes are shown base64 encoded, only encode the part that is kept.
+            # Every 3 bytes become 4 characters, so this is always enough.
+            encoded = base64.b64encode(data[:max_len]).decode("ascii")
+            return self._truncate_long_strings(encoded, max_len, truncation_marker)
+        elif isinstance(data, BaseModel):
+            return self._truncate_long_strings(
+                data.model_dump(), max_len, truncation_marker
+            )
+        elif isinstance(data, dict):
+            truncated_dict = None
+            for key, value in data.items():
+                new_value = self._truncate_long_strings(
+                    value, max_len, truncation_marker
+                )
+                if new_value is not value:
+                    if truncated_dict is None:
+                        truncated_dict = dict(data)
+                    truncated_dict[key] = new_value
+            return data if truncated_dict is None else truncated_dict
+        elif isinstance(data, (list, tuple)):
+            truncated_list = None
+            for index, item in enumerate(data):
+                new_item = self._truncate_long_strings(item, max_len, truncation_marker)
+                if new_item is not item:
+                    if truncated_list is None:
+                        truncated_list = list(data)
+                    truncated_list[index] = new_item
+            return data if truncated_list is None else truncated_list
+        else:
+            # Other values are left for `pydantic_core.to_jsonable_python`.
+            return data
+
+    def format(self, record: "Record") -> str:
+        """
+        Custom format function for the plugin's logs.
+        Serializes and truncates data passed under the 'payload' key in extra.
+
+        Loguru only calls this for records that pass the handler's level, so
+        the payload is never serialized for records that are not emitted.
+        If the payload is a callable, it is called here, which keeps building
+        an expensive payload (e.g. statistics snapshots) off the normal path.
+        """
+
+        # Configuration Keys
+        LOG_OPTIONS_PREFIX = "_log_"
+        TRUNCATION_ENABLED_KEY = f"{LOG_OPTIONS_PREFIX}truncation_enabled"
+        MAX_LENGTH_KEY = f"{LOG_OPTIONS_PREFIX}max_length"
+        TRUNCATION_MARKER_KEY = f"{LOG_OPTIONS_PREFIX}truncation_marker"
+        DATA_KEY = "payload"
+
+        original_extra = record["extra"]
+        # Extract the data intended for serialization using the chosen key
+        data_to_process = original_extra.get(DATA_KEY)
+
+        serialized_data_json = ""
+        if data_to_process is not None:
+            try:
+                if callable(data_to_process):
+                    data_to_process = data_to_process()
+
+                # Determine truncation settings
+                truncation_enabled = original_extra.get(TRUNCATION_ENABLED_KEY, True)
+                max_length = original_extra.get(MAX_LENGTH_KEY, 256)
+                truncation_marker = original_extra.get(TRUNCATION_MARKER_KEY, "[...]")
+
+                # If max_length was explicitly provided, force truncation enabled
+                if MAX_LENGTH_KEY in original_extra:
+                    truncation_enabled = True
+
+                # Truncate long strings before the JSON conversion
+                if truncation_enabled and max_length > len(truncation_marker):
+                    data_to_process = self._truncate_long_strings(
+                        data_to_process, max_length, truncation_marker
+                    )
+
+                truncated_data = pydantic_core.to_jsonable_python(
+                    data_to_process, serialize_unknown=True
+                )
+
+                # Serialize the (potentially truncated) data
+                if self._is_flat_dict(truncated_data) and not isinstance(
+                    truncated_data, list
+                ):
+                    json_string = json.dumps(
+                        truncated_data, separators=(",", ":"), default=str
+                    )
+                    # Add a simple prefix if it's compact
+                    serialized_data_json = " - " + json_string
+                else:
+                    json_string = json.dumps(truncated_data, indent=2, default=str)
+                    # Prepend with newline for readability
+                    serialized_data_json = "\n" + json_string
+
+            except (TypeError, ValueError) as e:  # Catch specific serialization errors
+                serialized_data_json = f" - {{Serialization Error: {e}}}"
+            except (
+                Exception
+            ) as e:  # Catch any other unexpected errors during processing
+                serialized_data_json = f" - {{Processing Error: {e}}}"
+
+        # Add the final JSON string (or error message) back into the record
+        record["extra"]["_plugin_serialized_data"] = serialized_data_json
+
+        # Base template
+        base_template = (
+            "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
+            "<level>{level: <8}</level> | "
+            "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
+            "<level>{message}</level>"
+        )
+
+        # Append the serialized data
+        base_template += "{extra[_plugin_serialized_data]}"
+        # Append the exception part
+        base_template += "\n{exception}"
+        # Return the format string template
+        return base_template.rstrip()
+
+
+PLUGIN_LOGGING = PluginLogging(__name__)
+
+
+class InletPlan:
+    """
+    What `Filter.inlet` does to the requests of one model with the current valves.
+
+    Plans are computed once and shared between requests, so nothing in them may be
+    mutated. Values are copied into the request body when the plan is applied.
+    """
+
+    def __init__(
+        self,
+        canonical_model_name: str,
+        is_manifold: bool,
+        grounding_features: dict[str, Any] | None,
+        set_temp_to_zero: bool,
+        code_execution: bool,
+        safety_settings: tuple[types.SafetySetting, ...] | None,
+        force_non_stream: bool,
+    ):
+        self.canonical_model_name = canonical_model_name
+        self.is_manifold = is_manifold
+        # Custom features that replace web search, None if the model has no grounding.
+        self.grounding_features = grounding_features
+        self.set_temp_to_zero = set_temp_to_zero
+        # Whether code interpreter is replaced by Google's code execution.
+        self.code_execution = code_execution
+        self.safety_settings = safety_settings
+        self.force_non_stream = force_non_stream
+
+
+class RedirectResolver:
+    """
+    Resolves Google's grounding redirect URLs to the URLs of the sources.
+
+    All requests go through one pooled `aiohttp.ClientSession` (keep-alive, DNS cache,
+    per-host connection limit) that lives as long as the event loop. The session is
+    closed on its own loop when the loop changes or the resolver is garbage collected,
+    e.g. after the filter was reloaded. A URL is resolved
+    by reading the `Location` header of a `HEAD` request without following the redirect,
+    so neither the redirect target nor any response body is downloaded. Servers that do
+    not answer `HEAD` with a redirect are resolved with a `GET` that follows all redirects.
+
+    Resolved URLs are kept in an LRU cache for `ttl` seconds, and concurrent lookups of
+    the same URL share one request, because the same sources are cited over and over.
+    """
+
+    MAX_CONNECTIONS = 100
+    MAX_CONNECTIONS_PER_HOST = 16
+    DNS_CACHE_TTL = 300
+    KEEPALIVE_TIMEOUT = 30
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # URL -> (expires_at, resolved URL), ordered from least to most recently used.
+        self._cache: collections.OrderedDict[str, tuple[float, str]] = (
+            collections.OrderedDict()
+        )
+        # URL -> lookup task, owned by the resolver so that it is shared by all callers
+        # and one caller's cancellation (e.g. its deadline) does not cancel the others.
+        self._in_flight: dict[str, asyncio.Task[tuple[str, bool]]] = {}
+        self._session: aiohttp.ClientSession | None = None
+        self._session_loop: asyncio.AbstractEventLoop | None = None
+        # Closes the current session, also when the resolver is garbage collected.
+        self._session_finalizer: weakref.finalize | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    async def resolve(self, url: str) -> tuple[str, bool]:
+        """Returns the resolved URL and whether resolving succeeded (the original URL if not)."""
+        if not url:
+            return "", False
+        now = time.monotonic()
+        if entry := self._cache.get(url):
+            if entry[0] > now:
+                self._cache.move_to_end(url)
+                self.hits += 1
+                return entry[1], True
+            del self._cache[url]
+        self.misses += 1
+
+        if not (task := self._in_flight.get(url)):
+            task = asyncio.create_task(self._lookup(url))
+            self._in_flight[url] = task
+        return await asyncio.shield(task)
+
+    async def _lookup(self, url: str) -> tuple[str, bool]:
+        """Resolves `url` and caches the result, runs in a task of its own, see `resolve`."""
+        try:
+            result = await self._resolve_with_retries(url)
+        finally:
+            del self._in_flight[url]
+
+        resolved_url, success = result
+        if success:
+            self._cache[url] = (time.monotonic() + self.ttl, resolved_url)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+    async def _resolve_with_retries(
+        self,
+        url: str,
+        timeout: aiohttp.ClientTimeout = DEFAULT_URL_TIMEOUT,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+    ) -> tuple[str, bool]:
+        session = self._get_session()
+        for attempt in range(max_retries + 1):
+            try:
+                async with session.head(
+                    url, allow_redirects=False, timeout=timeout
+                ) as response:
+                    location = response.headers.get("Location")
+                if location and 300 <= response.status < 400:
+                    final_url = urljoin(str(response.url), location)
+                else:
+                    # No redirect for HEAD, fall back to following the redirects with GET.
+                    async with session.get(
+                        url, allow_redirects=True, timeout=timeout
+                    ) as response:
+                        final_url = str(response.url)
+                log.debug(
+                    f"Resolved URL '{url}' to '{final_url}' after {attempt} retries"
+                )
+                return final_url, True
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                if attempt == max_retries:
+                    log.error(
+                        f"Failed to resolve URL '{url}' after {max_retries + 1} attempts: {e}"
+                    )
+                    return url, False
+                else:
+                    delay = min(base_delay * (2**attempt), 10.0)
+                    log.warning(
+                        f"Retry {attempt + 1}/{max_retries + 1} for URL '{url}': {e}. Waiting {delay:.1f}s..."
+                    )
+                    await asyncio.sleep(delay)
+            except Exception as e:
+                log.error(f"Unexpected error resolving URL '{url}': {e}")
+                return url, False
+        return url, False
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Returns the shared session, creating it on first use and for a new event loop."""
+        loop = asyncio.get_running_loop()
+        if (
+            self._session is None
+            or self._session.closed
+            or self._session_loop is not loop
+        ):
+            if self._session_finalizer:
+                # Closes the previous session and its pooled connections.
+                self._session_finalizer()
+            connector = aiohttp.TCPConnector(
+                limit=self.MAX_CONNECTIONS,
+                limit_per_host=self.MAX_CONNECTIONS_PER_HOST,
+                ttl_dns_cache=self.DNS_CACHE_TTL,
+                keepalive_timeout=self.KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+            self._session_finalizer = weakref.finalize(
+                self, RedirectResolver._close_session, self._session, loop
+            )
+        return self._session
+
+    # Close tasks of replaced sessions, referenced until they are done.
+    _closing: set["asyncio.Future | concurrent.futures.Future"] = set()
+
+    @staticmethod
+    def _close_session(
+        session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop
+    ) -> None:
+        """Closes `session` on the event loop it was created on, from any thread or loop."""
+        if session.closed:
+            return
+        if loop.is_closed():
+            # The loop's transports, and with them the connections, are already gone.
+            log.debug("Dropping the URL resolver session of a closed event loop.")
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            closing = loop.create_task(session.close())
+        else:
+            closing = asyncio.run_coroutine_threadsafe(session.close(), loop)
+        RedirectResolver._closing.add(closing)
+        closing.add_done_callback(RedirectResolver._closing.discard)
+
+    def snapshot(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
 class Filter:
 
     class Valves(BaseModel):
@@ -125,12 +664,41 @@ class Filter:
             description="""Decide if you want ot bypass Open WebUI's RAG and send your documents directly to Google API.
             Default value is True.""",
         )
+        GROUNDING_STORE_REDIS_URL: str | None = Field(
+            default=None,
+            description="""Redis URL to read grounding metadata from when the outlet runs on a different worker than the pipe.
+            Must match GROUNDING_STORE_REDIS_URL of the Manifold pipe (requires the `redis` package).
+            Default value is None.""",
+        )
+        URL_CACHE_TTL: int = Field(
+            default=86400,
+            ge=0,
+            description="""How long (in seconds) resolved grounding source URLs are cached.
+            Default value is 86400.""",
+        )
+        URL_CACHE_MAX_ENTRIES: int = Field(
+            default=10000,
+            ge=1,
+            description="""Maximum number of resolved grounding source URLs kept in the cache.
+            Default value is 10000.""",
+        )
+        URL_RESOLUTION_DEADLINE: float = Field(
+            default=15.0,
+            ge=0,
+            description="""Time limit (in seconds) for resolving the grounding source URLs in the background.
+            Sources are shown with their original URLs at once and updated with the URLs resolved within this limit.
+            0 means no limit. Default value is 15.0.""",
+        )
         LOG_LEVEL: Literal[
             "TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL"
         ] = Field(
             default="INFO",
             description="Select logging level. Use `docker logs -f open-webui` to view logs.",
         )
+        LOG_ENQUEUE: bool = Field(
+            default=False,
+            description="Write the filter's logs to stdout from a background thread so that slow log output never blocks the event loop.",
+        )
 
     # TODO: Support user settting through UserValves.
 
@@ -139,39 +707,49 @@ class Filter:
         # TODO: Get the id from the frontmatter instead of hardcoding it.
         valves = Functions.get_function_valves_by_id("gemini_manifold_companion")
         self.valves = self.Valves(**(valves if valves else {}))
-        self.log_level = self.valves.LOG_LEVEL
-        self._add_log_handler()
+        self._redis = None
+        self._redis_url: str | None = None
+        self._url_resolver: RedirectResolver | None = None
+        self._background_tasks: set[asyncio.Task] = set()
+        # Cache key -> plan, see `_get_inlet_plan`.
+        # Ordered from least to most recently used, see `_get_inlet_plan`.
+        self._inlet_plans: collections.OrderedDict[tuple, InletPlan] = (
+            collections.OrderedDict()
+        )
         log.success("Function has been initialized.")
         log.trace("Full self object:", payload=self.__dict__)
 
-    def inlet(self, body: "Body", __metadata__: dict[str, Any]) -> "Body":
-        """Modifies the incoming request payload before it's sent to the LLM. Operates on the `form_data` dictionary."""
+    @property
+    def valves(self) -> "Filter.Valves":
+        return self._valves
 
-        # Detect log level change inside self.valves
-        if self.log_level != self.valves.LOG_LEVEL:
-            log.info(
-                f"Detected log level change: {self.log_level=} and {self.valves.LOG_LEVEL=}. "
-                "Running the logging setup again."
-            )
-            self._add_log_handler()
+    @valves.setter
+    def valves(self, valves: "Filter.Valves") -> None:
+        # Open WebUI assigns freshly loaded valves before every request,
+        # this is where the logging setup picks up a changed LOG_LEVEL.
+        self._valves = valves
+        PLUGIN_LOGGING.configure(valves.LOG_LEVEL, valves.LOG_ENQUEUE)
+
+    def inlet(
+        self,
+        body: "Body",
+        __metadata__: dict[str, Any],
+        __request__: Request | None = None,
+    ) -> "Body":
+        """Modifies the incoming request payload before it's sent to the LLM. Operates on the `form_data` dictionary."""
 
         log.debug(
             f"inlet method has been called. Gemini Manifold Companion version is {VERSION}"
         )
 
-        canonical_model_name, is_manifold = self._get_model_name(body)
+        plan = self._get_inlet_plan(body, __request__)
         # Exit early if we are filtering an unsupported model.
-        if not is_manifold:
+        if not plan.is_manifold:
             log.debug(
                 "Returning the original body object because conditions for proceeding are not fulfilled."
             )
             return body
 
-        # Check if it's a relevant model (supports either feature)
-        is_grounding_model = canonical_model_name in ALLOWED_GROUNDING_MODELS
-        is_code_exec_model = canonical_model_name in ALLOWED_CODE_EXECUTION_MODELS
-        log.debug(f"{is_grounding_model=}, {is_code_exec_model=}")
-
         features = body.get("features", {})
         log.debug(f"body.features:", payload=features)
 
@@ -185,49 +763,29 @@ class Filter:
         # Add the companion version to the payload for the pipe to consume.
         metadata_features["gemini_manifold_companion_version"] = VERSION
 
-        if is_grounding_model:
-            web_search_enabled = (
-                features.get("web_search", False)
-                if isinstance(features, dict)
-                else False
-            )
-            if web_search_enabled:
+        if plan.grounding_features and isinstance(features, dict):
+            if features.get("web_search", False):
                 log.info(
                     "Search feature is enabled, disabling it and adding custom feature called grounding_w_google_search."
                 )
                 # Disable web_search
                 features["web_search"] = False
-                # Use "Google Search Retrieval" for 1.0 and 1.5 models and "Google Search as a Tool for >=2.0 models".
-                if "1.0" in canonical_model_name or "1.5" in canonical_model_name:
-                    metadata_features["google_search_retrieval"] = True
-                    metadata_features["google_search_retrieval_threshold"] = (
-                        self.valves.GROUNDING_DYNAMIC_RETRIEVAL_THRESHOLD
-                    )
-                else:
-                    metadata_features["google_search_tool"] = True
+                metadata_features.update(plan.grounding_features)
                 # Google suggest setting temperature to 0 if using grounding:
                 # https://cloud.google.com/vertex-ai/generative-ai/docs/multimodal/ground-with-google-search#:~:text=For%20ideal%20results%2C%20use%20a%20temperature%20of%200.0.
-                if self.valves.SET_TEMP_TO_ZERO:
+                if plan.set_temp_to_zero:
                     log.info("Setting temperature to 0.")
                     body["temperature"] = 0  # type: ignore
-        if is_code_exec_model:
-            code_execution_enabled = (
-                features.get("code_interpreter", False)
-                if isinstance(features, dict)
-                else False
-            )
-            if code_execution_enabled:
+        if plan.code_execution and isinstance(features, dict):
+            if features.get("code_interpreter", False):
                 log.info(
                     "Code interpreter feature is enabled, disabling it and adding custom feature called google_code_execution."
                 )
                 # Disable code_interpreter
                 features["code_interpreter"] = False
                 metadata_features["google_code_execution"] = True
-        if self.valves.USE_PERMISSIVE_SAFETY:
-            log.info("Adding permissive safety settings to body.metadata")
-            metadata["safety_settings"] = self._get_permissive_safety_settings(
-                canonical_model_name
-            )
+        if plan.safety_settings is not None:
+            metadata["safety_settings"] = list(plan.safety_settings)
         if self.valves.BYPASS_BACKEND_RAG:
             if __metadata__["chat_id"] == "local":
                 # TODO toast notification
@@ -248,7 +806,7 @@ class Filter:
                     body["files"] = []
                 metadata_features["upload_documents"] = True
         else:
-            log.info(
+            log.debug(
                 "BYPASS_BACKEND_RAG is disabled. Open WebUI's RAG will be used if applicable."
             )
             metadata_features["upload_documents"] = False
@@ -258,26 +816,13 @@ class Filter:
         # streaming intent and then force the backend into streaming mode.
 
         user_stream_intent = body.get("stream", True)
-        image_generation_models = {
-            "gemini-2.0-flash-preview-image-generation",
-            "gemini-2.5-flash-image-preview",
-            "gemini-2.5-flash-image",
-        }
 
-        # Check if the current model is an image generation model and if the
-        # user has enabled the non-streaming override for them.
-        if (
-            self.valves.FORCE_NON_STREAM_FOR_IMAGE_MODELS
-            and canonical_model_name in image_generation_models
-        ):
-            log.info(
-                f"Image generation model '{canonical_model_name}' detected. "
-                "Forcing non-streaming mode to prevent potential 'Chunk too big' errors."
-            )
-            # Override the user's intent to ensure stability.
+        # Override the user's intent for image generation models if the
+        # non-streaming override is enabled for them, to ensure stability.
+        if plan.force_non_stream:
             user_stream_intent = False
 
-        log.info(
+        log.debug(
             f"Storing user's stream intent ({user_stream_intent}) into __metadata__. "
             "Backend will be forced down the streaming path."
         )
@@ -306,15 +851,11 @@ class Filter:
 
         chat_id: str = __metadata__.get("chat_id", "")
         message_id: str = __metadata__.get("message_id", "")
-        grounding_key = f"grounding_{chat_id}_{message_id}"
-        time_key = f"pipe_start_time_{chat_id}_{message_id}"
 
-        app_state: State = __request__.app.state
-        log.debug(f"Checking for attributes for message {message_id} in request state.")
-        stored_metadata: types.GroundingMetadata | None = getattr(
-            app_state, grounding_key, None
+        log.debug(f"Checking for grounding metadata of message {message_id}.")
+        stored_metadata, pipe_start_time = await self._pop_grounding_data(
+            __request__.app.state, chat_id, message_id
         )
-        pipe_start_time: float | None = getattr(app_state, time_key, None)
 
         if stored_metadata:
             log.info("Found grounding metadata, processing citations.")
@@ -352,7 +893,7 @@ class Filter:
             gs_supports = stored_metadata.grounding_supports
             gs_chunks = stored_metadata.grounding_chunks
             if gs_supports and gs_chunks:
-                await self._resolve_and_emit_sources(
+                await self._emit_sources(
                     grounding_chunks=gs_chunks,
                     supports=gs_supports,
                     event_emitter=__event_emitter__,
@@ -366,13 +907,8 @@ class Filter:
 
             # Emit status event with search queries
             await self._emit_status_event_w_queries(stored_metadata, __event_emitter__)
-
-            # Clean up state
-            delattr(app_state, grounding_key)
-            if hasattr(app_state, time_key):
-                delattr(app_state, time_key)
         else:
-            log.info("No grounding metadata found in request state.")
+            log.info("No grounding metadata found for this response.")
 
         log.debug("outlet method has finished.")
         return body
@@ -381,6 +917,63 @@ class Filter:
 
     # region 1.1 Add citations
 
+    async def _pop_grounding_data(
+        self, app_state: State, chat_id: str, message_id: str
+    ) -> tuple[types.GroundingMetadata | None, float | None]:
+        """
+        Removes and returns the grounding metadata and pipe start time stored by the pipe.
+
+        The pipe's grounding store is used if this worker has one, otherwise the shared
+        Redis store if configured. Keys written directly into `app.state` by older pipe
+        versions are still honoured.
+        """
+        if store := getattr(app_state, GROUNDING_STORE_APP_STATE_ATTR, None):
+            if entry := await store.pop(chat_id, message_id):
+                return entry
+        elif self.valves.GROUNDING_STORE_REDIS_URL:
+            if entry := await self._pop_grounding_data_from_redis(chat_id, message_id):
+                return entry
+
+        # Fallback for pipe versions that wrote into `app.state` directly.
+        grounding_key = f"grounding_{chat_id}_{message_id}"
+        time_key = f"pipe_start_time_{chat_id}_{message_id}"
+        stored_metadata: types.GroundingMetadata | None = getattr(
+            app_state, grounding_key, None
+        )
+        pipe_start_time: float | None = getattr(app_state, time_key, None)
+        if hasattr(app_state, grounding_key):
+            delattr(app_state, grounding_key)
+        if hasattr(app_state, time_key):
+            delattr(app_state, time_key)
+        return stored_metadata, pipe_start_time
+
+    async def _pop_grounding_data_from_redis(
+        self, chat_id: str, message_id: str
+    ) -> tuple[types.GroundingMetadata, float] | None:
+        redis_url = self.valves.GROUNDING_STORE_REDIS_URL
+        try:
+            if self._redis is None or self._redis_url != redis_url:
+                # Imported lazily because `redis` is an optional dependency.
+                import redis.asyncio as aioredis
+
+                self._redis = aioredis.from_url(redis_url, decode_responses=True)
+                self._redis_url = redis_url
+            payload = await self._redis.getdel(
+                f"{GROUNDING_STORE_REDIS_KEY_PREFIX}:{chat_id}:{message_id}"
+            )
+        except Exception:
+            log.exception("Reading the grounding metadata from Redis failed.")
+            return None
+        if not payload:
+            return None
+        data = json.loads(payload)
+        # The pipe sends its start time as wall-clock time, see `GroundingStore.put`.
+        pipe_start_time = time.monotonic() - (time.time() - data["pipe_started_at"])
+        return (
+            types.GroundingMetadata.model_validate(data["grounding_metadata"]),
+            pipe_start_time,
+        )
+
     def _get_text_w_citation_markers(
         self,
         grounding_metadata: types.GroundingMetadata,
@@ -437,10 +1030,12 @@ class Filter:
 
         if content_for_citation_processing:
             try:
-                modified_content_bytes = bytearray(
-                    content_for_citation_processing.encode("utf-8")
-                )
-                for support in reversed(supports):
+                content_bytes = content_for_citation_processing.encode("utf-8")
+                # Support indices are byte offsets into the content. Collect the insertion
+                # points first and build the result in one pass, instead of inserting into
+                # the buffer once per support.
+                insertions: list[tuple[int, bytes]] = []
+                for support in supports:
                     segment = support.segment
                     indices = support.grounding_chunk_indices
                     if not (
@@ -451,17 +1046,26 @@ class Filter:
                         log.debug(f"Skipping support due to missing data: {support}")
                         continue
                     end_pos = segment.end_index
-                    if not (0 <= end_pos <= len(modified_content_bytes)):
+                    if not (0 <= end_pos <= len(content_bytes)):
                         log.warning(
                             f"Support segment end_index ({end_pos}) is out of bounds for the processable content "
-                            f"(length {len(modified_content_bytes)} bytes after potential thought stripping). "
+                            f"(length {len(content_bytes)} bytes after potential thought stripping). "
                             f"Content (first 50 chars): '{content_for_citation_processing[:50]}...'. Skipping this support. Support: {support}"
                         )
                         continue
                     citation_markers = "".join(f"[{index + 1}]" for index in indices)
-                    encoded_citation_markers = citation_markers.encode("utf-8")
-                    modified_content_bytes[end_pos:end_pos] = encoded_citation_markers
-                processed_content_part_with_markers = modified_content_bytes.decode(
+                    insertions.append((end_pos, citation_markers.encode("utf-8")))
+
+                # The sort is stable, so markers at the same position keep the order of the supports.
+                insertions.sort(key=lambda insertion: insertion[0])
+                output_parts: list[bytes] = []
+                last_pos = 0
+                for end_pos, encoded_citation_markers in insertions:
+                    output_parts.append(content_bytes[last_pos:end_pos])
+                    output_parts.append(encoded_citation_markers)
+                    last_pos = end_pos
+                output_parts.append(content_bytes[last_pos:])
+                processed_content_part_with_markers = b"".join(output_parts).decode(
                     "utf-8"
                 )
             except Exception as e:
@@ -481,50 +1085,17 @@ class Filter:
         final_result_str = thought_prefix + processed_content_part_with_markers
         return final_result_str
 
-    async def _resolve_url(
-        self,
-        session: aiohttp.ClientSession,
-        url: str,
-        timeout: aiohttp.ClientTimeout = DEFAULT_URL_TIMEOUT,
-        max_retries: int = 3,
-        base_delay: float = 0.5,
-    ) -> tuple[str, bool]:
-        """
-        Resolves a given URL using the provided aiohttp session, with multiple retries on failure.
-        Returns the final URL and a boolean indicating success.
-        """
-        if not url:
-            return "", False
-        for attempt in range(max_retries + 1):
-            try:
-                async with session.get(
-                    url,
-                    allow_redirects=True,
-                    timeout=timeout,
-                ) as response:
-                    final_url = str(response.url)
-                    log.debug(
-                        f"Resolved URL '{url}' to '{final_url}' after {attempt} retries"
-                    )
-                    return final_url, True
-            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
-                if attempt == max_retries:
-                    log.error(
-                        f"Failed to resolve URL '{url}' after {max_retries + 1} attempts: {e}"
-                    )
-                    return url, False
-                else:
-                    delay = min(base_delay * (2**attempt), 10.0)
-                    log.warning(
-                        f"Retry {attempt + 1}/{max_retries + 1} for URL '{url}': {e}. Waiting {delay:.1f}s..."
-                    )
-                    await asyncio.sleep(delay)
-            except Exception as e:
-                log.error(f"Unexpected error resolving URL '{url}': {e}")
-                return url, False
-        return url, False
+    def _get_url_resolver(self) -> RedirectResolver:
+        """Returns the redirect resolver, applying the current valves."""
+        ttl = self.valves.URL_CACHE_TTL
+        max_entries = self.valves.URL_CACHE_MAX_ENTRIES
+        if self._url_resolver:
+            self._url_resolver.configure(ttl, max_entries)
+        else:
+            self._url_resolver = RedirectResolver(ttl, max_entries)
+        return self._url_resolver
 
-    async def _resolve_and_emit_sources(
+    async def _emit_sources(
         self,
         grounding_chunks: list[types.GroundingChunk],
         supports: list[types.GroundingSupport],
@@ -532,8 +1103,8 @@ class Filter:
         pipe_start_time: float | None,
     ):
         """
-        Resolves URLs in the background and emits a chat completion event
-        containing only the source information, along with status updates.
+        Emits the sources with their original URLs right away and resolves the grounding
+        redirect URLs in a background task, which emits the sources again once resolved.
         """
         initial_metadatas: list[tuple[int, str]] = []
         for i, g_c in enumerate(grounding_chunks):
@@ -550,50 +1121,116 @@ class Filter:
             log.info("No source URIs found, skipping source emission.")
             return
 
-        urls_to_resolve = [
-            uri
-            for _, uri in initial_metadatas
-            if uri.startswith(
-                "https://vertexaisearch.cloud.google.com/grounding-api-redirect/"
+        urls_to_resolve = list(
+            dict.fromkeys(
+                uri
+                for _, uri in initial_metadatas
+                if uri.startswith(
+                    "https://vertexaisearch.cloud.google.com/grounding-api-redirect/"
+                )
             )
-        ]
-        resolved_uris_map = {}
+        )
+
+        # Provisional sources, so the front-end has them before the outlet returns.
+        await self._emit_sources_event(
+            grounding_chunks, supports, initial_metadatas, {}, event_emitter
+        )
+        if not urls_to_resolve:
+            return
 
-        if urls_to_resolve:
-            num_urls = len(urls_to_resolve)
-            self._emit_status_update(
+        # Hold a reference to the task so it is not garbage collected before it finishes.
+        task = asyncio.create_task(
+            self._resolve_and_emit_sources(
+                grounding_chunks,
+                supports,
+                initial_metadatas,
+                urls_to_resolve,
                 event_emitter,
-                f"Resolving {num_urls} source URLs...",
                 pipe_start_time,
             )
+        )
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
-            try:
-                log.info(f"Resolving {num_urls} source URLs...")
-                async with aiohttp.ClientSession() as session:
-                    tasks = [self._resolve_url(session, url) for url in urls_to_resolve]
-                    results = await asyncio.gather(*tasks)
-                log.info("URL resolution completed.")
-
-                resolved_uris = [res[0] for res in results]
-                resolved_uris_map = dict(zip(urls_to_resolve, resolved_uris))
-
-                success_count = sum(1 for _, success in results if success)
-                final_status_msg = (
-                    "URL resolution complete"
-                    if success_count == num_urls
-                    else f"Resolved {success_count}/{num_urls} URLs"
-                )
-                self._emit_status_update(
-                    event_emitter, final_status_msg, pipe_start_time, done=True
-                )
+    async def _resolve_and_emit_sources(
+        self,
+        grounding_chunks: list[types.GroundingChunk],
+        supports: list[types.GroundingSupport],
+        initial_metadatas: list[tuple[int, str]],
+        urls_to_resolve: list[str],
+        event_emitter: Callable[["Event"], Awaitable[None]],
+        pipe_start_time: float | None,
+    ):
+        """
+        Resolves the redirect URLs within `URL_RESOLUTION_DEADLINE` seconds and emits
+        the sources again with the resolved URLs. URLs that are not resolved by then keep
+        their original URL.
+        """
+        num_urls = len(urls_to_resolve)
+        deadline = self.valves.URL_RESOLUTION_DEADLINE
+        log.info(f"Resolving {num_urls} source URLs...")
+        url_resolver = self._get_url_resolver()
+        tasks = {
+            asyncio.create_task(url_resolver.resolve(url)): url
+            for url in urls_to_resolve
+        }
+        resolved_uris_map: dict[str, str] = {}
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=deadline or None)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                if task.cancelled() or task.exception():
+                    continue
+                resolved_url, success = task.result()
+                if success:
+                    resolved_uris_map[tasks[task]] = resolved_url
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        elapsed_str = (
+            f" (+{(time.monotonic() - pipe_start_time):.2f}s)"
+            if pipe_start_time is not None
+            else ""
+        )
+        if pending:
+            log.warning(
+                f"Resolved {len(resolved_uris_map)}/{num_urls} source URLs, "
+                f"{len(pending)} did not finish within {deadline}s{elapsed_str}."
+            )
+        else:
+            log.info(
+                f"Resolved {len(resolved_uris_map)}/{num_urls} source URLs{elapsed_str}."
+            )
+        log.debug("URL cache statistics:", payload=url_resolver.snapshot)
 
-            except Exception as e:
-                log.error(f"Error during URL resolution: {e}")
-                resolved_uris_map = {url: url for url in urls_to_resolve}
-                self._emit_status_update(
-                    event_emitter, "URL resolution failed", pipe_start_time, done=True
-                )
+        if not resolved_uris_map:
+            return
+        try:
+            await self._emit_sources_event(
+                grounding_chunks,
+                supports,
+                initial_metadatas,
+                resolved_uris_map,
+                event_emitter,
+            )
+        except Exception:
+            log.exception("Error emitting resolved sources.")
 
+    async def _emit_sources_event(
+        self,
+        grounding_chunks: list[types.GroundingChunk],
+        supports: list[types.GroundingSupport],
+        initial_metadatas: list[tuple[int, str]],
+        resolved_uris_map: dict[str, str],
+        event_emitter: Callable[["Event"], Awaitable[None]],
+    ):
+        """
+        Emits a chat completion event containing only the source information, using
+        the resolved URL of each source where there is one.
+        """
         source_metadatas_template: list["SourceMetadata"] = [
             {"source": None, "original_url": None, "supports": []}
             for _ in grounding_chunks
@@ -776,38 +1413,6 @@ class Filter:
 
     # region 1.4 Utility helpers
 
-    def _emit_status_update(
-        self,
-        event_emitter: Callable[["Event"], Awaitable[None]],
-        description: str,
-        pipe_start_time: float | None,
-        *,
-        done: bool = False,
-    ):
-        """Constructs and emits a status event in a non-blocking task."""
-
-        async def emit_task():
-            time_str = (
-                f" (+{(time.monotonic() - pipe_start_time):.2f}s)"
-                if pipe_start_time is not None
-                else ""
-            )
-            full_description = f"{description}{time_str}"
-
-            status_event: "StatusEvent" = {
-                "type": "status",
-                "data": {"description": full_description, "done": done},
-            }
-
-            try:
-                await event_emitter(status_event)
-                log.debug(f"Emitted status:", payload=status_event)
-            except Exception:
-                log.exception("Error emitting status.")
-
-        # Fire-and-forget the emission task.
-        asyncio.create_task(emit_task())
-
     def _get_first_candidate(
         self, candidates: list[types.Candidate] | None
     ) -> types.Candidate | None:
@@ -819,6 +1424,114 @@ class Filter:
             log.warning("Multiple candidates found, defaulting to first candidate.")
         return candidates[0]
 
+    def _get_inlet_plan(
+        self, body: "Body", request: Request | None
+    ) -> InletPlan:
+        """
+        Returns the inlet plan for the model of the request, building it on first use.
+
+        Plans are keyed on the requested model, the valves they depend on and the
+        identity and version of the pipe's model capability registry, and kept in an
+        LRU cache of `INLET_PLAN_CACHE_SIZE` entries.
+        """
+        metadata = body.get("metadata") or {}
+        base_model_id = metadata.get("model", {}).get("info", {}).get("base_model_id")
+        registry = getattr(
+            request.app.state if request else None,
+            MODEL_CAPABILITIES_APP_STATE_ATTR,
+            None,
+        )
+        valves = self.valves
+        key = (
+            body.get("model", ""),
+            base_model_id,
+            valves.FORCE_NON_STREAM_FOR_IMAGE_MODELS,
+            valves.SET_TEMP_TO_ZERO,
+            valves.GROUNDING_DYNAMIC_RETRIEVAL_THRESHOLD,
+            valves.USE_PERMISSIVE_SAFETY,
+            # The ID instead of the registry itself, so the cache does not keep a
+            # replaced registry (e.g. of a reloaded pipe) alive.
+            id(registry) if registry is not None else None,
+            getattr(registry, "version", None),
+        )
+        if plan := self._inlet_plans.get(key):
+            self._inlet_plans.move_to_end(key)
+            return plan
+
+        plan = self._build_inlet_plan(body, registry)
+        self._inlet_plans[key] = plan
+        if len(self._inlet_plans) > INLET_PLAN_CACHE_SIZE:
+            self._inlet_plans.popitem(last=False)
+        return plan
+
+    def _build_inlet_plan(self, body: "Body", registry: Any) -> InletPlan:
+        canonical_model_name, is_manifold = self._get_model_name(body)
+        if not is_manifold:
+            return InletPlan(
+                canonical_model_name, False, None, False, False, None, False
+            )
+
+        capabilities = self._get_model_capabilities(registry, canonical_model_name)
+        is_grounding_model = ModelCapability.GROUNDING in capabilities
+        is_code_exec_model = ModelCapability.CODE_EXECUTION in capabilities
+        log.debug(
+            f"Building the inlet plan for {canonical_model_name}: "
+            f"{is_grounding_model=}, {is_code_exec_model=}"
+        )
+
+        grounding_features = None
+        if is_grounding_model:
+            # Use "Google Search Retrieval" for 1.0 and 1.5 models and "Google Search as a Tool for >=2.0 models".
+            if "1.0" in canonical_model_name or "1.5" in canonical_model_name:
+                grounding_features = {
+                    "google_search_retrieval": True,
+                    "google_search_retrieval_threshold": self.valves.GROUNDING_DYNAMIC_RETRIEVAL_THRESHOLD,
+                }
+            else:
+                grounding_features = {"google_search_tool": True}
+
+        safety_settings = None
+        if self.valves.USE_PERMISSIVE_SAFETY:
+            log.info(f"Using permissive safety settings for {canonical_model_name}.")
+            safety_settings = tuple(
+                self._get_permissive_safety_settings(canonical_model_name)
+            )
+
+        force_non_stream = (
+            self.valves.FORCE_NON_STREAM_FOR_IMAGE_MODELS
+            and ModelCapability.IMAGE_OUTPUT in capabilities
+        )
+        if force_non_stream:
+            log.info(
+                f"Image generation model '{canonical_model_name}' detected. "
+                "Forcing non-streaming mode to prevent potential 'Chunk too big' errors."
+            )
+
+        return InletPlan(
+            canonical_model_name,
+            True,
+            grounding_features,
+            self.valves.SET_TEMP_TO_ZERO,
+            is_code_exec_model,
+            safety_settings,
+            force_non_stream,
+        )
+
+    @staticmethod
+    def _get_model_capabilities(registry: Any, model_name: str) -> ModelCapability:
+        """
+        Returns the capabilities of a model from the registry published by the Manifold pipe,
+        falling back to the built-in model lists if the pipe has not published it yet.
+        """
+        if registry:
+            try:
+                return ModelCapability(int(registry.get(model_name)))
+            except Exception:
+                log.exception(
+                    "Failed to read the model capability registry of the pipe, using the built-in model lists."
+                )
+        return FALLBACK_MODEL_CAPABILITIES.get(model_name, ModelCapability.NONE)
+
     def _get_model_name(self, body: "Body") -> tuple[str, bool]:
         """
         Extracts the effective and canonical model name from the request body.
@@ -872,231 +1585,6 @@ class Filter:
         # 6. Return the canonical name and the manifold flag
         return canonical_model_name, is_manifold_model
 
-    def _is_flat_dict(self, data: Any) -> bool:
-        """
-        Checks if a dictionary contains only non-dict/non-list values (is one level deep).
-        """
-        if not isinstance(data, dict):
-            return False
-        return not any(isinstance(value, (dict, list)) for value in data.values())
-
-    def _truncate_long_strings(
-        self, data: Any, max_len: int, truncation_marker: str, truncation_enabled: bool
-    ) -> Any:
-        """
-        Recursively traverses a data structure (dicts, lists) and truncates
-        long string values. Creates copies to avoid modifying original data.
-
-        Args:
-            data: The data structure (dict, list, str, int, float, bool, None) to process.
-            max_len: The maximum allowed length for string values.
-            truncation_marker: The string to append to truncated values.
-            truncation_enabled: Whether truncation is enabled.
-
-        Returns:
-            A potentially new data structure with long strings truncated.
-        """
-        if not truncation_enabled or max_len <= len(truncation_marker):
-            # If truncation is disabled or max_len is too small, return original
-            # Make a copy only if it's a mutable type we might otherwise modify
-            if isinstance(data, (dict, list)):
-                return copy.deepcopy(data)  # Ensure deep copy for nested structures
-            return data  # Primitives are immutable
-
-        if isinstance(data, str):
-            if len(data) > max_len:
-                return data[: max_len - len(truncation_marker)] + truncation_marker
-            return data  # Return original string if not truncated
-        elif isinstance(data, dict):
-            # Process dictionary items, creating a new dict
-            return {
-                k: self._truncate_long_strings(
-                    v, max_len, truncation_marker, truncation_enabled
-                )
-                for k, v in data.items()
-            }
-        elif isinstance(data, list):
-            # Process list items, creating a new list
-            return [
-                self._truncate_long_strings(
-                    item, max_len, truncation_marker, truncation_enabled
-                )
-                for item in data
-            ]
-        else:
-            # Return non-string, non-container types as is (they are immutable)
-            return data
-
-    def plugin_stdout_format(self, record: "Record") -> str:
-        """
-        Custom format function for the plugin's logs.
-        Serializes and truncates data passed under the 'payload' key in extra.
-        """
-
-        # Configuration Keys
-        LOG_OPTIONS_PREFIX = "_log_"
-        TRUNCATION_ENABLED_KEY = f"{LOG_OPTIONS_PREFIX}truncation_enabled"
-        MAX_LENGTH_KEY = f"{LOG_OPTIONS_PREFIX}max_length"
-        TRUNCATION_MARKER_KEY = f"{LOG_OPTIONS_PREFIX}truncation_marker"
-        DATA_KEY = "payload"
-
-        original_extra = record["extra"]
-        # Extract the data intended for serialization using the chosen key
-        data_to_process = original_extra.get(DATA_KEY)
-
-        serialized_data_json = ""
-        if data_to_process is not None:
-            try:
-                serializable_data = pydantic_core.to_jsonable_python(
-                    data_to_process, serialize_unknown=True
-                )
-
-                # Determine truncation settings
-                truncation_enabled = original_extra.get(TRUNCATION_ENABLED_KEY, True)
-                max_length = original_extra.get(MAX_LENGTH_KEY, 256)
-                truncation_marker = original_extra.get(TRUNCATION_MARKER_KEY, "[...]")
-
-                # If max_length was explicitly provided, force truncation enabled
-                if MAX_LENGTH_KEY in original_extra:
-                    truncation_enabled = True
-
-                # Truncate long strings
-                truncated_data = self._truncate_long_strings(
-                    serializable_data,
-                    max_length,
-                    truncation_marker,
-                    truncation_enabled,
-                )
-
-                # Serialize the (potentially truncated) data
-                if self._is_flat_dict(truncated_data) and not isinstance(
-                    truncated_data, list
-                ):
-                    json_string = json.dumps(
-                        truncated_data, separators=(",", ":"), default=str
-                    )
-                    # Add a simple prefix if it's compact
-                    serialized_data_json = " - " + json_string
-                else:
-                    json_string = json.dumps(truncated_data, indent=2, default=str)
-                    # Prepend with newline for readability
-                    serialized_data_json = "\n" + json_string
-
-            except (TypeError, ValueError) as e:  # Catch specific serialization errors
-                serialized_data_json = f" - {{Serialization Error: {e}}}"
-            except (
-                Exception
-            ) as e:  # Catch any other unexpected errors during processing
-                serialized_data_json = f" - {{Processing Error: {e}}}"
-
-        # Add the final JSON string (or error message) back into the record
-        record["extra"]["_plugin_serialized_data"] = serialized_data_json
-
-        # Base template
-        base_template = (
-            "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
-            "<level>{level: <8}</level> | "
-            "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
-            "<level>{message}</level>"
-        )
-
-        # Append the serialized data
-        base_template += "{extra[_plugin_serialized_data]}"
-        # Append the exception part
-        base_template += "\n{exception}"
-        # Return the format string template
-        return base_template.rstrip()
-
-    def _add_log_handler(self):
-        """
-        Adds or updates the loguru handler specifically for this plugin.
-        Includes logic for serializing and truncating extra data.
-        """
-
-        def plugin_filter(record: "Record"):
-            """Filter function to only allow logs from this plugin (based on module name)."""
-            return record["name"] == __name__
-
-        # Get the desired level name and number
-        desired_level_name = self.valves.LOG_LEVEL
-        try:
-            # Use the public API to get level details
-            desired_level_info = log.level(desired_level_name)
-            desired_level_no = desired_level_info.no
-        except ValueError:
-            log.error(
-                f"Invalid LOG_LEVEL '{desired_level_name}' configured for plugin {__name__}. Cannot add/update handler."
-            )
-            return  # Stop processing if the level is invalid
-
-        # Access the internal state of the log
-        handlers: dict[int, "Handler"] = log._core.handlers  # type: ignore
-        handler_id_to_remove = None
-        found_correct_handler = False
-
-        for handler_id, handler in handlers.items():
-            existing_filter = handler._filter  # Access internal attribute
-
-            # Check if the filter matches our plugin_filter
-            # Comparing function objects directly can be fragile if they are recreated.
-            # Comparing by name and module is more robust for functions defined at module level.
-            is_our_filter = (
-                existing_filter is not None  # Make sure a filter is set
-                and hasattr(existing_filter, "__name__")
-                and existing_filter.__name__ == plugin_filter.__name__
-                and hasattr(existing_filter, "__module__")
-                and existing_filter.__module__ == plugin_filter.__module__
-            )
-
-            if is_our_filter:
-                existing_level_no = handler.levelno
-                log.trace(
-                    f"Found existing handler {handler_id} for {__name__} with level number {existing_level_no}."
-                )
-
-                # Check if the level matches the desired level
-                if existing_level_no == desired_level_no:
-                    log.debug(
-                        f"Handler {handler_id} for {__name__} already exists with the correct level '{desired_level_name}'."
-                    )
-                    found_correct_handler = True
-                    break  # Found the correct handler, no action needed
-                else:
-                    # Found our handler, but the level is wrong. Mark for removal.
-                    log.info(
-                        f"Handler {handler_id} for {__name__} found, but log level differs "
-                        f"(existing: {existing_level_no}, desired: {desired_level_no}). "
-                        f"Removing it to update."
-                    )
-                    handler_id_to_remove = handler_id
-                    break  # Found the handler to replace, stop searching
-
-        # Remove the old handler if marked for removal
-        if handler_id_to_remove is not None:
-            try:
-                log.remove(handler_id_to_remove)
-                log.debug(f"Removed handler {handler_id_to_remove} for {__name__}.")
-            except ValueError:
-                # This might happen if the handler was somehow removed between the check and now
-                log.warning(
-                    f"Could not remove handler {handler_id_to_remove} for {__name__}. It might have already been removed."
-                )
-                # If removal failed but we intended to remove, we should still proceed to add
-                # unless found_correct_handler is somehow True (which it shouldn't be if handler_id_to_remove was set).
-
-        # Add a new handler if no correct one was found OR if we just removed an incorrect one
-        if not found_correct_handler:
-            self.log_level = desired_level_name
-            log.add(
-                sys.stdout,
-                level=desired_level_name,
-                format=self.plugin_stdout_format,
-                filter=plugin_filter,
-            )
-            log.debug(
-                f"Added new handler to loguru for {__name__} with level {desired_level_name}."
-            )
-
     # endregion 1.4 Utility helpers
 
     # endregion 1. Helper methods inside the Filter class
@@ -0,0 +1,94 @@
+"""
+Measures the per-chunk cost of the substring fast paths in front of the pipe's text regexes.
+
+`Pipe._disable_special_tags` runs on every streamed text chunk, `_enable_special_tags`
+and `_genai_parts_from_text` on every history message. Each is timed with its fast path
+and with the regex it skips, on chunks without tags or links (the common case) and on
+chunks that contain them (where the fast path must not change anything).
+
+Needs the packages the pipe imports (Open WebUI, google-genai, aiocache, ...).
+
+Usage:
+    python bench_text_fast_paths.py [--chunk-size 120] [--number 20000]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import pathlib
+import sys
+import timeit
+
+from loguru import logger
+
+PIPE_PATH = pathlib.Path(__file__).resolve().parents[1] / "gemini_manifold.py"
+
+
+def load_pipe():
+    spec = importlib.util.spec_from_file_location("gemini_manifold", PIPE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def report(name: str, call, number: int) -> float:
+    best = min(timeit.repeat(call, number=number, repeat=5)) / number
+    print(f"  {name:<42} {best * 1e6:8.3f} µs/chunk")
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunk-size", type=int, default=120, help="Chunk length in characters.")
+    parser.add_argument("--number", type=int, default=20_000, help="Calls per measurement.")
+    args = parser.parse_args()
+
+    gm = load_pipe()
+    logger.remove()
+    zws = gm.ZWS
+    tag_regex, reverse_tag_regex = gm._get_special_tag_regexes(
+        tuple(gm.SPECIAL_TAGS_TO_DISABLE)
+    )
+    plain = ("The quick brown fox jumps over the lazy dog. " * 10)[: args.chunk_size]
+    with_tag = plain[: args.chunk_size - 8] + "</think>"
+    disabled_tag = gm.Pipe._disable_special_tags(with_tag)[0]
+
+    for label, chunk in (("plain chunk", plain), ("chunk with a tag", with_tag)):
+        print(f"_disable_special_tags, {label}:")
+        regex = report("regex only", lambda: tag_regex.subn(rf"<{zws}\1", chunk), args.number)
+        fast = report(
+            "with fast path", lambda: gm.Pipe._disable_special_tags(chunk), args.number
+        )
+        print(f"  speed-up: {regex / fast:.1f}x")
+
+    enable = gm.GeminiContentBuilder._enable_special_tags
+    for label, chunk in (("plain message", plain), ("message with a tag", disabled_tag)):
+        print(f"_enable_special_tags, {label}:")
+        regex = report("regex only", lambda: reverse_tag_regex.sub(r"<\1", chunk), args.number)
+        fast = report("with fast path", lambda: enable(chunk), args.number)
+        print(f"  speed-up: {regex / fast:.1f}x")
+
+    # Only the text handling is measured, media links are not resolved.
+    builder = object.__new__(gm.GeminiContentBuilder)
+    builder.valves = gm.Pipe.Valves(PARSE_YOUTUBE_URLS=True)
+    loop = asyncio.new_event_loop()
+    queue = asyncio.Queue()
+
+    def parts_from_text() -> None:
+        loop.run_until_complete(builder._genai_parts_from_text(plain, queue))
+
+    print("_genai_parts_from_text, plain message (including the event loop round trip):")
+    fast = report("with fast path", parts_from_text, args.number // 10)
+    may_contain_media_link = gm._may_contain_media_link
+    gm._may_contain_media_link = lambda *args: True
+    try:
+        regex = report("regex scan", parts_from_text, args.number // 10)
+    finally:
+        gm._may_contain_media_link = may_contain_media_link
+    print(f"  speed-up: {regex / fast:.1f}x")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
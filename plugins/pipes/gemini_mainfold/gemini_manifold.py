@@ -14,7 +14,7 @@ VERSION = "1.26.0"
 # This is the recommended version for the companion filter.
 # Older versions might still work, but backward compatibility is not guaranteed
 # during the development of this personal use plugin.
-RECOMMENDED_COMPANION_VERSION = "1.7.0"
+RECOMMENDED_COMPANION_VERSION = "1.8.0"
 
 
 # Keys `title`, `id` and `description` in the frontmatter above are used for my own development purposes.
@@ -31,19 +31,25 @@ from google.cloud import storage
 from google.api_core import exceptions
 
 import time
-import copy
 import json
+import os
+import queue
+import sqlite3
+import threading
 from urllib.parse import urlparse, parse_qs
 import xxhash
+import abc
 import asyncio
 import aiofiles
-from aiocache import cached
-from aiocache.base import BaseCache
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import enum
 from aiocache.serializers import NullSerializer
 from aiocache.backends.memory import SimpleMemoryCache
 from functools import cache
 from datetime import datetime, timezone
-from fastapi.datastructures import State
 import io
 import mimetypes
 import uuid
@@ -54,22 +60,24 @@ import sys
 from loguru import logger
 from fastapi import Request
 import pydantic_core
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from collections.abc import AsyncIterator, Awaitable, Callable
 from typing import (
     Any,
     Final,
     AsyncGenerator,
     Literal,
+    NoReturn,
     TYPE_CHECKING,
     cast,
 )
 
 from open_webui.models.chats import Chats
-from open_webui.models.files import FileForm, Files
+from open_webui.models.files import FileForm, FileModel, Files
 from open_webui.storage.provider import Storage
-from open_webui.models.functions import Functions
+from open_webui.models.functions import FunctionModel, Functions
 from open_webui.utils.misc import pop_system_message
+from open_webui.env import DATA_DIR
 
 # This block is skipped at runtime.
 if TYPE_CHECKING:
@@ -81,23 +89,80 @@ if TYPE_CHECKING:
 # Setting auditable=False avoids duplicate output for log levels that would be printed out by the main log.
 log = logger.bind(auditable=False)
 
-# FIXME: remove
-COMPATIBLE_MODELS_FOR_URL_CONTEXT: Final = [
-    "gemini-2.5-pro",
-    "gemini-flash-latest",
-    "gemini-2.5-flash-preview-09-2025",
-    "gemini-2.5-flash",
-    "gemini-flash-lite-latest",
-    "gemini-2.5-flash-lite-preview-09-2025",
-    "gemini-2.5-flash-lite",
-    "gemini-2.5-flash-lite-preview-06-17",
-    "gemini-2.5-pro-preview-06-05",
-    "gemini-2.5-pro-preview-05-06",
-    "gemini-2.5-flash-preview-05-20",
-    "gemini-2.0-flash",
-    "gemini-2.0-flash-001",
-    "gemini-2.0-flash-live-001",
-]
+# Models known to support each tool, according to https://ai.google.dev/gemini-api/docs/models
+# Only read by `ModelCapabilityRegistry`, which is the single source of truth for model
+# capabilities and is published to the companion filter. The companion's `ALLOWED_*`
+# lists are a fallback for when the registry is not published yet, update them together.
+GROUNDING_MODELS: Final = frozenset(
+    {
+        "gemini-2.5-pro",
+        "gemini-flash-latest",
+        "gemini-2.5-flash-preview-09-2025",
+        "gemini-2.5-flash",
+        "gemini-flash-lite-latest",
+        "gemini-2.5-flash-lite-preview-09-2025",
+        "gemini-2.5-flash-lite",
+        "gemini-2.5-flash-lite-preview-06-17",
+        "gemini-2.5-pro-preview-06-05",
+        "gemini-2.5-flash-preview-05-20",
+        "gemini-2.5-pro-preview-05-06",
+        "gemini-2.5-flash-preview-04-17",
+        "gemini-2.5-pro-preview-03-25",
+        "gemini-2.5-pro-exp-03-25",
+        "gemini-2.0-pro-exp",
+        "gemini-2.0-pro-exp-02-05",
+        "gemini-exp-1206",
+        "gemini-2.0-flash",
+        "gemini-2.0-flash-exp",
+        "gemini-2.0-flash-001",
+        "gemini-1.5-pro",
+        "gemini-1.5-flash",
+        "gemini-1.0-pro",
+    }
+)
+CODE_EXECUTION_MODELS: Final = frozenset(
+    {
+        "gemini-2.5-pro",
+        "gemini-flash-latest",
+        "gemini-2.5-flash-preview-09-2025",
+        "gemini-2.5-flash",
+        "gemini-flash-lite-latest",
+        "gemini-2.5-flash-lite-preview-09-2025",
+        "gemini-2.5-flash-lite",
+        "gemini-2.5-flash-lite-preview-06-17",
+        "gemini-2.5-pro-preview-06-05",
+        "gemini-2.5-flash-preview-05-20",
+        "gemini-2.5-pro-preview-05-06",
+        "gemini-2.5-flash-preview-04-17",
+        "gemini-2.5-pro-preview-03-25",
+        "gemini-2.5-pro-exp-03-25",
+        "gemini-2.0-pro-exp",
+        "gemini-2.0-pro-exp-02-05",
+        "gemini-exp-1206",
+        "gemini-2.0-flash-thinking-exp-01-21",
+        "gemini-2.0-flash",
+        "gemini-2.0-flash-exp",
+        "gemini-2.0-flash-001",
+    }
+)
+URL_CONTEXT_MODELS: Final = frozenset(
+    {
+        "gemini-2.5-pro",
+        "gemini-flash-latest",
+        "gemini-2.5-flash-preview-09-2025",
+        "gemini-2.5-flash",
+        "gemini-flash-lite-latest",
+        "gemini-2.5-flash-lite-preview-09-2025",
+        "gemini-2.5-flash-lite",
+        "gemini-2.5-flash-lite-preview-06-17",
+        "gemini-2.5-pro-preview-06-05",
+        "gemini-2.5-pro-preview-05-06",
+        "gemini-2.5-flash-preview-05-20",
+        "gemini-2.0-flash",
+        "gemini-2.0-flash-001",
+        "gemini-2.0-flash-live-001",
+    }
+)
 
 # A mapping of finish reason names (str) to human-readable descriptions.
 # This allows handling of reasons that may not be defined in the current SDK version.
@@ -123,6 +188,20 @@ FINISH_REASON_DESCRIPTIONS: Final = {
     ),
 }
 
+# Front-end toggle filters that are checked by `Pipe._get_toggleable_feature_status`.
+TOGGLE_FILTER_IDS: Final = frozenset(
+    {
+        "gemini_reasoning_toggle",
+        "gemini_url_context_toggle",
+        "gemini_maps_grounding_toggle",
+    }
+)
+# How long (in seconds) the installed/active/global state of the toggle filters is cached.
+TOGGLE_FILTER_CACHE_TTL: Final = 30
+
+# Maximum number of memoized (admin valves, user valves, email) merges, see `Pipe._get_merged_valves`.
+MERGED_VALVES_CACHE_SIZE: Final = 1024
+
 # Finish reasons that are considered normal and do not require user notification.
 NORMAL_REASONS: Final = {types.FinishReason.STOP, types.FinishReason.MAX_TOKENS}
 
@@ -141,6 +220,394 @@ SPECIAL_TAGS_TO_DISABLE = [
 ]
 ZWS = "\u200b"
 
+DATA_IMAGE_URI_REGEX: Final = re.compile(r"data:(image/\w+);base64,(.+)")
+MARKDOWN_IMAGE_PATTERN: Final = r"!\[.*?\]\(([^)]+)\)"  # Group 1: Markdown URI
+YOUTUBE_URL_PATTERN: Final = r"(https?://(?:(?:www|music)\.)?youtube\.com/(?:watch\?v=|shorts/|live/)[^\s)]+|https?://youtu\.be/[^\s)]+)"  # Group 2: YouTube URL
+
+# Rough token estimates for content the API has not counted (see `GeminiContentBuilder._plan_token_budget`).
+CHARS_PER_TOKEN: Final = 4
+# Lower bound of the token count of a non-text part, Gemini bills an image or a PDF page at 258 tokens.
+NON_TEXT_PART_TOKENS: Final = 258
+# Approximate file bytes per token by MIME type prefix, for attachments that are not images.
+FILE_BYTES_PER_TOKEN: Final = {
+    "text/": 4,
+    "application/pdf": 400,
+    "audio/": 500,
+    "video/": 500,
+}
+DEFAULT_FILE_BYTES_PER_TOKEN: Final = 400
+# Maximum number of concurrent `count_tokens` requests when verifying the token budget.
+TOKEN_COUNT_MAX_CONCURRENCY: Final = 8
+
+
+@cache
+def _get_special_tag_regexes(tags: tuple[str, ...]) -> tuple[re.Pattern, re.Pattern]:
+    """
+    Compiles the regexes that disable and re-enable the special tags.
+    Cached per tag tuple, so they are only rebuilt if `SPECIAL_TAGS_TO_DISABLE` changes.
+    """
+    # The inner parentheses group the tags, so the optional '/' applies to all of them.
+    tags_group = "(/?(" + "|".join(re.escape(tag) for tag in tags) + "))"
+    # Finds '<' followed by an optional '/' and then one of the special tags.
+    tag_regex = re.compile("<" + tags_group)
+    # Finds '<ZWS' followed by an optional '/' and then one of the special tags.
+    reverse_tag_regex = re.compile("<" + ZWS + tags_group)
+    return tag_regex, reverse_tag_regex
+
+
+@cache
+def _parse_auth_whitelist(auth_whitelist: str | None) -> frozenset[str]:
+    """Parses the comma-separated `AUTH_WHITELIST` valve into a set of emails."""
+    if not auth_whitelist:
+        return frozenset()
+    return frozenset(email.strip() for email in auth_whitelist.split(",") if email.strip())
+
+
+@cache
+def _get_media_link_regex(parse_youtube_urls: bool) -> re.Pattern:
+    """
+    Compiles the regex that finds media links in message text.
+    If YouTube parsing is disabled, it only finds markdown image links,
+    leaving YouTube URLs to be treated as plain text.
+    """
+    if parse_youtube_urls:
+        return re.compile(f"{MARKDOWN_IMAGE_PATTERN}|{YOUTUBE_URL_PATTERN}")
+    return re.compile(MARKDOWN_IMAGE_PATTERN)
+
+
+def _may_contain_media_link(text: str, parse_youtube_urls: bool) -> bool:
+    """
+    Cheap pre-check for `_get_media_link_regex`: False only if the regex cannot match,
+    because every match contains one of the checked substrings.
+    """
+    return "![" in text or (
+        parse_youtube_urls and ("youtube.com/" in text or "youtu.be/" in text)
+    )
+
+
+def _estimate_text_tokens(text: str) -> int:
+    """Roughly estimates the token count of a message text. Inline data URI images count as images."""
+    characters = len(text)
+    tokens = 0
+    if "data:image" in text:
+        for match in DATA_IMAGE_URI_REGEX.finditer(text):
+            characters -= len(match.group(0))
+            tokens += NON_TEXT_PART_TOKENS
+    return tokens + characters // CHARS_PER_TOKEN
+
+
+def _estimate_contents_tokens(
+    contents: list[types.Content],
+    system_instruction: types.ContentUnion | None = None,
+) -> tuple[int, bool]:
+    """
+    Roughly estimates the token count of converted contents.
+    Also returns whether there are non-text parts, whose real size is unknown.
+    """
+    tokens = (
+        _estimate_text_tokens(system_instruction)
+        if isinstance(system_instruction, str)
+        else 0
+    )
+    has_non_text_parts = False
+    for content in contents:
+        for part in content.parts or []:
+            if part.text:
+                tokens += len(part.text) // CHARS_PER_TOKEN
+            elif part.inline_data or part.file_data:
+                has_non_text_parts = True
+                tokens += NON_TEXT_PART_TOKENS
+    return tokens, has_non_text_parts
+
+
+def _content_digest(content: types.Content) -> str:
+    """
+    Returns the xxHash64 of a converted content, see `ContextCacheManager`.
+    Inline data is hashed as raw bytes instead of its base64 encoding.
+    """
+    hasher = xxhash.xxh64()
+    hasher.update((content.role or "").encode())
+    for part in content.parts or []:
+        hasher.update(b"\x01")
+        if part.inline_data and part.inline_data.data:
+            hasher.update(part.inline_data.data)
+            part_json = part.model_dump_json(
+                exclude={"inline_data": {"data"}}, exclude_none=True
+            )
+        else:
+            part_json = part.model_dump_json(exclude_none=True)
+        hasher.update(part_json.encode())
+    return hasher.hexdigest()
+
+
+class BackgroundLogSink:
+    """
+    A loguru sink that hands formatted log messages to a daemon thread which writes them to a stream.
+    This keeps slow stdout writes (e.g. a blocked container log pipe) off the event loop.
+    Messages are dropped instead of blocking the caller if the queue is full.
+    """
+
+    def __init__(self, stream=sys.stdout, max_queue_size: int = 10_000):
+        self._stream = stream
+        self._queue: queue.Queue[str | None] = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self._thread = threading.Thread(
+            target=self._run, name="gemini-manifold-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, message: str) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self) -> None:
+        """Called by loguru when the handler is removed. Lets the thread drain the queue and exit."""
+        self._queue.put(None)
+
+    def _run(self) -> None:
+        while (message := self._queue.get()) is not None:
+            try:
+                self._stream.write(message)
+                # Flush once the backlog is written instead of after every message.
+                if self._queue.empty():
+                    self._stream.flush()
+            except Exception:
+                pass
+
+
+class PluginLogging:
+    """
+    Process-wide, idempotent setup of the loguru handler that prints this plugin's logs.
+
+    Open WebUI assigns freshly loaded valves to the plugin before every request,
+    so `configure` is called often. It returns right away if the requested
+    level and sink are already installed. Otherwise it replaces the handler
+    and increments `version`. Handlers left behind by a previous load of this
+    module (e.g. after the function was edited) are removed the first time.
+
+    The same class is used by Gemini Manifold and its companion filter.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # Incremented every time the handler is (re)installed.
+        self.version = 0
+        self._config: tuple[str, bool] | None = None
+        self._handler_id: int | None = None
+        self._lock = threading.Lock()
+
+    def configure(self, level: str, enqueue: bool = False) -> None:
+        """Installs the handler with the given level and sink unless it is already installed."""
+        config = (level, enqueue)
+        if config == self._config:
+            return
+        with self._lock:
+            if config == self._config:
+                return
+            try:
+                log.level(level)
+            except ValueError:
+                log.error(
+                    f"Invalid LOG_LEVEL '{level}' configured for plugin {self.name}. Cannot add/update handler."
+                )
+                return
+
+            if self._handler_id is None:
+                self._remove_stale_handlers()
+            else:
+                with contextlib.suppress(ValueError):
+                    log.remove(self._handler_id)
+            self._handler_id = log.add(
+                BackgroundLogSink() if enqueue else sys.stdout,
+                level=level,
+                format=self.format,
+                filter=self.filter,
+            )
+            self._config = config
+            self.version += 1
+        log.debug(
+            f"Configured the log handler for {self.name} with level {level} ({enqueue=}, version {self.version})."
+        )
+
+    def filter(self, record: "Record") -> bool:
+        """Only allows logs from this plugin (based on module name)."""
+        return record["name"] == self.name
+
+    def _remove_stale_handlers(self) -> None:
+        """Removes handlers that an earlier load of this module installed for the same module name."""
+        handlers: dict[int, "Handler"] = log._core.handlers  # type: ignore
+        for handler_id, handler in list(handlers.items()):
+            existing_filter = handler._filter  # Access internal attribute
+            owner = getattr(existing_filter, "__self__", None)
+            # Compared by name, the class object changes when the plugin is reloaded.
+            is_stale = (
+                type(owner).__name__ == type(self).__name__
+                and getattr(owner, "name", None) == self.name
+            ) or (
+                # Handlers installed by plugin versions that predate this class.
+                getattr(existing_filter, "__name__", None) == "plugin_filter"
+                and getattr(existing_filter, "__module__", None) == self.name
+            )
+            if is_stale:
+                with contextlib.suppress(ValueError):
+                    log.remove(handler_id)
+                log.debug(f"Removed stale handler {handler_id} for {self.name}.")
+
+    def _is_flat_dict(self, data: Any) -> bool:
+        """
+        Checks if a dictionary contains only non-dict/non-list values (is one level deep).
+        """
+        if not isinstance(data, dict):
+            return False
+        return not any(isinstance(value, (dict, list)) for value in data.values())
+
+    def _truncate_long_strings(
+        self, data: Any, max_len: int, truncation_marker: str
+    ) -> Any:
+        """
+        Recursively traverses a data structure and truncates long string and bytes values.
+        Runs before JSON conversion, so large blobs (e.g. inline image data) are never
+        base64 encoded in full. Pydantic models are dumped to dicts first.
+
+        The original data is never modified. Containers are only rebuilt if something
+        inside them was truncated, otherwise the original object is returned.
+
+        Args:
+            data: The data structure to process.
+            max_len: The maximum allowed length for string values.
+            truncation_marker: The string to append to truncated values.
+
+        Returns:
+            The data with long strings truncated, sharing all unchanged parts with the original.
+        """
+        if isinstance(data, str):
+            if len(data) > max_len:
+                return data[: max_len - len(truncation_marker)] + truncation_marker
+            return data
+        elif isinstance(data, (bytes, bytearray)):
+            # Bytes are shown base64 encoded, only encode the part that is kept.
+            # Every 3 bytes become 4 characters, so this is always enough.
+            encoded = base64.b64encode(data[:max_len]).decode("ascii")
+            return self._truncate_long_strings(encoded, max_len, truncation_marker)
+        elif isinstance(data, BaseModel):
+            return self._truncate_long_strings(
+                data.model_dump(), max_len, truncation_marker
+            )
+        elif isinstance(data, dict):
+            truncated_dict = None
+            for key, value in data.items():
+                new_value = self._truncate_long_strings(
+                    value, max_len, truncation_marker
+                )
+                if new_value is not value:
+                    if truncated_dict is None:
+                        truncated_dict = dict(data)
+                    truncated_dict[key] = new_value
+            return data if truncated_dict is None else truncated_dict
+        elif isinstance(data, (list, tuple)):
+            truncated_list = None
+            for index, item in enumerate(data):
+                new_item = self._truncate_long_strings(item, max_len, truncation_marker)
+                if new_item is not item:
+                    if truncated_list is None:
+                        truncated_list = list(data)
+                    truncated_list[index] = new_item
+            return data if truncated_list is None else truncated_list
+        else:
+            # Other values are left for `pydantic_core.to_jsonable_python`.
+            return data
+
+    def format(self, record: "Record") -> str:
+        """
+        Custom format function for the plugin's logs.
+        Serializes and truncates data passed under the 'payload' key in extra.
+
+        Loguru only calls this for records that pass the handler's level, so
+        the payload is never serialized for records that are not emitted.
+        If the payload is a callable, it is called here, which keeps building
+        an expensive payload (e.g. statistics snapshots) off the normal path.
+        """
+
+        # Configuration Keys
+        LOG_OPTIONS_PREFIX = "_log_"
+        TRUNCATION_ENABLED_KEY = f"{LOG_OPTIONS_PREFIX}truncation_enabled"
+        MAX_LENGTH_KEY = f"{LOG_OPTIONS_PREFIX}max_length"
+        TRUNCATION_MARKER_KEY = f"{LOG_OPTIONS_PREFIX}truncation_marker"
+        DATA_KEY = "payload"
+
+        original_extra = record["extra"]
+        # Extract the data intended for serialization using the chosen key
+        data_to_process = original_extra.get(DATA_KEY)
+
+        serialized_data_json = ""
+        if data_to_process is not None:
+            try:
+                if callable(data_to_process):
+                    data_to_process = data_to_process()
+
+                # Determine truncation settings
+                truncation_enabled = original_extra.get(TRUNCATION_ENABLED_KEY, True)
+                max_length = original_extra.get(MAX_LENGTH_KEY, 256)
+                truncation_marker = original_extra.get(TRUNCATION_MARKER_KEY, "[...]")
+
+                # If max_length was explicitly provided, force truncation enabled
+                if MAX_LENGTH_KEY in original_extra:
+                    truncation_enabled = True
+
+                # Truncate long strings before the JSON conversion
+                if truncation_enabled and max_length > len(truncation_marker):
+                    data_to_process = self._truncate_long_strings(
+                        data_to_process, max_length, truncation_marker
+                    )
+
+                truncated_data = pydantic_core.to_jsonable_python(
+                    data_to_process, serialize_unknown=True
+                )
+
+                # Serialize the (potentially truncated) data
+                if self._is_flat_dict(truncated_data) and not isinstance(
+                    truncated_data, list
+                ):
+                    json_string = json.dumps(
+                        truncated_data, separators=(",", ":"), default=str
+                    )
+                    # Add a simple prefix if it's compact
+                    serialized_data_json = " - " + json_string
+                else:
+                    json_string = json.dumps(truncated_data, indent=2, default=str)
+                    # Prepend with newline for readability
+                    serialized_data_json = "\n" + json_string
+
+            except (TypeError, ValueError) as e:  # Catch specific serialization errors
+                serialized_data_json = f" - {{Serialization Error: {e}}}"
+            except (
+                Exception
+            ) as e:  # Catch any other unexpected errors during processing
+                serialized_data_json = f" - {{Processing Error: {e}}}"
+
+        # Add the final JSON string (or error message) back into the record
+        record["extra"]["_plugin_serialized_data"] = serialized_data_json
+
+        # Base template
+        base_template = (
+            "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
+            "<level>{level: <8}</level> | "
+            "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
+            "<level>{message}</level>"
+        )
+
+        # Append the serialized data
+        base_template += "{extra[_plugin_serialized_data]}"
+        # Append the exception part
+        base_template += "\n{exception}"
+        # Return the format string template
+        return base_template.rstrip()
+
+
+PLUGIN_LOGGING = PluginLogging(__name__)
+
 
 class GenaiApiError(Exception):
     """Custom exception for errors during Genai API interactions."""
@@ -290,6 +757,8 @@ class UploadStatusManager:
 
     The communication protocol uses tuples sent via an asyncio.Queue:
     - ('REGISTER_UPLOAD',): Sent by a worker when it determines an upload is needed.
+      The upload counts as queued until it is started.
+    - ('START_UPLOAD',): Sent by a worker when the `UploadScheduler` lets its upload run.
     - ('COMPLETE_UPLOAD',): Sent by a worker when its upload is finished.
     - ('FINALIZE',): Sent by the orchestrator when all workers are done.
     """
@@ -303,56 +772,1373 @@ class UploadStatusManager:
         self.start_time = start_time
         self.queue = asyncio.Queue()
         self.total_uploads_expected = 0
+        self.uploads_started = 0
         self.uploads_completed = 0
         self.finalize_received = False
         self.is_active = False
 
-    async def run(self) -> None:
-        """
-        Runs the manager loop, listening for updates and emitting status to the UI.
-        This should be started as a background task using asyncio.create_task().
-        """
-        while not (
-            self.finalize_received
-            and self.total_uploads_expected == self.uploads_completed
-        ):
-            msg = await self.queue.get()
-            msg_type = msg[0]
+    async def run(self) -> None:
+        """
+        Runs the manager loop, listening for updates and emitting status to the UI.
+        This should be started as a background task using asyncio.create_task().
+        """
+        while not (
+            self.finalize_received
+            and self.total_uploads_expected == self.uploads_completed
+        ):
+            msg = await self.queue.get()
+            msg_type = msg[0]
+
+            if msg_type == "REGISTER_UPLOAD":
+                self.is_active = True
+                self.total_uploads_expected += 1
+                await self._emit_progress_update()
+            elif msg_type == "START_UPLOAD":
+                self.uploads_started += 1
+                await self._emit_progress_update()
+            elif msg_type == "COMPLETE_UPLOAD":
+                # An upload that failed before being started still completes.
+                self.uploads_started = max(self.uploads_started, self.uploads_completed + 1)
+                self.uploads_completed += 1
+                await self._emit_progress_update()
+            elif msg_type == "FINALIZE":
+                self.finalize_received = True
+
+            self.queue.task_done()
+
+        log.debug("UploadStatusManager finished its run.")
+
+    async def _emit_progress_update(self) -> None:
+        """Emits the current progress to the front-end if uploads are active."""
+        if not self.is_active:
+            return
+
+        elapsed_time = time.monotonic() - self.start_time
+        time_str = f"(+{elapsed_time:.2f}s)"
+
+        is_done = (
+            self.total_uploads_expected > 0
+            and self.uploads_completed == self.total_uploads_expected
+        )
+
+        active = self.uploads_started - self.uploads_completed
+        queued = self.total_uploads_expected - self.uploads_started
+
+        if is_done:
+            message = f"- Upload complete. {self.uploads_completed} file(s) processed. {time_str}"
+        elif queued > 0:
+            # Show "Uploading 1 of N... (A active, Q queued)"
+            message = (
+                f"- Uploading file {self.uploads_completed + 1} of {self.total_uploads_expected}... "
+                f"({active} active, {queued} queued) {time_str}"
+            )
+        else:
+            # Show "Uploading 1 of N..."
+            message = f"- Uploading file {self.uploads_completed + 1} of {self.total_uploads_expected}... {time_str}"
+
+        await self.event_emitter.emit_status(message, done=is_done)
+
+
+class GenaiClientRegistry:
+    """
+    Bounded registry of `genai.Client` instances, one per distinct auth configuration.
+
+    Clients are evicted when the registry holds more than `max_size` of them (least
+    recently used first) or when they were not used for `idle_ttl` seconds. Each client
+    keeps the SDK's own transports (aiohttp for async calls when it is installed), which
+    are closed once the client has been out of the registry for `CLOSE_GRACE_PERIOD`
+    seconds, so requests that still hold an evicted client can finish normally.
+    Besides on every lookup, idle clients are expired and retired ones closed by a timer
+    on the event loop, so they are also closed on a worker that stopped getting requests.
+    """
+
+    CLOSE_GRACE_PERIOD: Final = 600
+
+    def __init__(self, max_size: int, idle_ttl: float):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        # Ordered from least to most recently used.
+        self._clients: collections.OrderedDict[tuple, tuple[genai.Client, float]] = (
+            collections.OrderedDict()
+        )
+        # Evicted clients waiting to be closed, as (eviction time, client), oldest first.
+        self._retired: collections.deque[tuple[float, genai.Client]] = (
+            collections.deque()
+        )
+        self._closing: set[asyncio.Task] = set()
+        # Timer running `_sweep`, scheduled while there are clients to expire or close.
+        self._sweep_handle: asyncio.TimerHandle | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.closed = 0
+
+    def configure(self, max_size: int, idle_ttl: float) -> None:
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+
+    def get_or_create(
+        self, key: tuple, factory: Callable[[], genai.Client]
+    ) -> genai.Client:
+        """Returns the client registered under `key`, creating it with `factory()` on a miss."""
+        now = time.monotonic()
+        self._expire_idle(now)
+        self._close_retired(now)
+
+        if entry := self._clients.pop(key, None):
+            self.hits += 1
+            client = entry[0]
+        else:
+            self.misses += 1
+            client = factory()
+        self._clients[key] = (client, now)
+
+        while len(self._clients) > self.max_size:
+            _, (evicted, _) = self._clients.popitem(last=False)
+            self._retired.append((now, evicted))
+            self.evictions += 1
+        self._schedule_sweep(now)
+        return client
+
+    def _sweep(self) -> None:
+        self._sweep_handle = None
+        now = time.monotonic()
+        self._expire_idle(now)
+        self._close_retired(now)
+        self._schedule_sweep(now)
+
+    def _schedule_sweep(self, now: float) -> None:
+        """Schedules `_sweep` for when the next client expires or a retired one is due to be closed."""
+        if self._sweep_handle is not None or not (self._clients or self._retired):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        due = []
+        if self._clients:
+            _, last_used = next(iter(self._clients.values()))
+            due.append(last_used + self.idle_ttl)
+        if self._retired:
+            due.append(self._retired[0][0] + self.CLOSE_GRACE_PERIOD)
+        self._sweep_handle = loop.call_later(max(min(due) - now, 1), self._sweep)
+
+    def _expire_idle(self, now: float) -> None:
+        while self._clients:
+            client, last_used = next(iter(self._clients.values()))
+            if now - last_used < self.idle_ttl:
+                break
+            self._clients.popitem(last=False)
+            self._retired.append((now, client))
+            self.expirations += 1
+
+    def _close_retired(self, now: float) -> None:
+        while self._retired and now - self._retired[0][0] >= self.CLOSE_GRACE_PERIOD:
+            _, client = self._retired.popleft()
+            self.closed += 1
+            try:
+                client.close()
+                task = asyncio.get_running_loop().create_task(client.aio.aclose())
+            except RuntimeError:
+                # No running event loop, the async transports are left to the SDK's finalizers.
+                continue
+            except Exception:
+                log.exception("Failed to close an evicted genai client.")
+                continue
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def snapshot(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._clients),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reuse_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "retired": len(self._retired),
+            "closed": self.closed,
+        }
+
+
+class FilesAPIStats:
+    """
+    Hit/miss counters for each tier of the `FilesAPIManager` lookup chain.
+
+    - hot: The per-process in-memory caches.
+    - warm: The persistent index shared by all workers (`FilesIndex`).
+    - cold: The Google Files API (a hit is a successful stateless GET,
+      a miss means the file had to be uploaded).
+
+    A single instance is owned by the `Pipe` and shared by every request,
+    so the counters describe the lifetime of the worker process.
+    """
+
+    TIERS: Final = ("hot", "warm", "cold")
+
+    def __init__(self):
+        self.counters: dict[str, dict[str, int]] = {
+            tier: {"hits": 0, "misses": 0} for tier in self.TIERS
+        }
+
+    def record(self, tier: str, hit: bool) -> None:
+        self.counters[tier]["hits" if hit else "misses"] += 1
+
+    def snapshot(self) -> dict[str, dict[str, int | float]]:
+        """Returns a copy of the counters together with the hit ratio of each tier."""
+        result: dict[str, dict[str, int | float]] = {}
+        for tier, counts in self.counters.items():
+            total = counts["hits"] + counts["misses"]
+            result[tier] = {
+                **counts,
+                "hit_ratio": round(counts["hits"] / total, 4) if total else 0.0,
+            }
+        return result
+
+
+class FilesIndex(abc.ABC):
+    """
+    Interface for a persistent index shared across workers and restarts.
+
+    It stores two mappings:
+    - `owui_file_id -> content_hash` (file contents are immutable). Entries expire
+      `ID_HASH_TTL` seconds after they were last read, so the mappings of deleted
+      Open WebUI files do not accumulate.
+    - `content_hash -> types.File` (expires together with the file on Google's side). The
+      content hash is prefixed with the auth key of the files, see `FilesAPIManager`.
+
+    Implementations must be safe to share between concurrent requests.
+    """
+
+    ID_HASH_TTL: Final = 30 * 24 * 3600
+
+    @abc.abstractmethod
+    async def get_hash(self, owui_file_id: str) -> str | None:
+        """Returns the content hash of a file, extending the lifetime of the mapping."""
+
+    @abc.abstractmethod
+    async def set_hash(self, owui_file_id: str, content_hash: str) -> None: ...
+
+    @abc.abstractmethod
+    async def get_file(self, content_hash: str) -> types.File | None: ...
+
+    @abc.abstractmethod
+    async def set_file(
+        self, content_hash: str, file: types.File, ttl: float | None
+    ) -> None: ...
+
+
+class SQLiteFilesIndex(FilesIndex):
+    """
+    `FilesIndex` backed by a local SQLite database.
+
+    The database runs in WAL mode, so all uvicorn workers on the same host can
+    read and write it concurrently. Blocking calls are executed in a thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Must be called with self._lock held.
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS id_hash ("
+                "owui_file_id TEXT PRIMARY KEY, content_hash TEXT NOT NULL, expires_at REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(id_hash)")}
+            if "expires_at" not in columns:
+                # Databases created by earlier versions kept the mappings forever.
+                conn.execute("ALTER TABLE id_hash ADD COLUMN expires_at REAL")
+                conn.execute(
+                    "UPDATE id_hash SET expires_at = ?",
+                    (time.time() + self.ID_HASH_TTL,),
+                )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS id_hash_expires_at ON id_hash (expires_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "content_hash TEXT PRIMARY KEY, file_json TEXT NOT NULL, expires_at REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS files_expires_at ON files (expires_at)"
+            )
+            conn.commit()
+            self._conn = conn
+            log.info(f"Opened SQLite Files API index at {self.path}.")
+        return self._conn
+
+    def _execute(
+        self, sql: str, params: tuple = (), *, commit: bool = False
+    ) -> list[tuple]:
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(sql, params).fetchall()
+            if commit:
+                conn.commit()
+            return rows
+
+    async def get_hash(self, owui_file_id: str) -> str | None:
+        now = time.time()
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT content_hash, expires_at FROM id_hash "
+            "WHERE owui_file_id = ? AND expires_at > ?",
+            (owui_file_id, now),
+        )
+        if not rows:
+            return None
+        content_hash, expires_at = rows[0]
+        # Extended at most once per half lifetime, so reads rarely need a write.
+        if expires_at - now < self.ID_HASH_TTL / 2:
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE id_hash SET expires_at = ? WHERE owui_file_id = ?",
+                (now + self.ID_HASH_TTL, owui_file_id),
+                commit=True,
+            )
+        return content_hash
+
+    async def set_hash(self, owui_file_id: str, content_hash: str) -> None:
+        def write() -> None:
+            with self._lock:
+                conn = self._connection()
+                # Expired rows are purged opportunistically on every write.
+                conn.execute(
+                    "DELETE FROM id_hash WHERE expires_at <= ?", (time.time(),)
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO id_hash (owui_file_id, content_hash, expires_at) "
+                    "VALUES (?, ?, ?)",
+                    (owui_file_id, content_hash, time.time() + self.ID_HASH_TTL),
+                )
+                conn.commit()
+
+        await asyncio.to_thread(write)
+
+    async def get_file(self, content_hash: str) -> types.File | None:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT file_json FROM files WHERE content_hash = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (content_hash, time.time()),
+        )
+        return types.File.model_validate_json(rows[0][0]) if rows else None
+
+    async def set_file(
+        self, content_hash: str, file: types.File, ttl: float | None
+    ) -> None:
+        if ttl is not None and ttl <= 0:
+            return
+        expires_at = time.time() + ttl if ttl is not None else None
+
+        def write() -> None:
+            with self._lock:
+                conn = self._connection()
+                # Expired rows are purged opportunistically on every write.
+                conn.execute(
+                    "DELETE FROM files WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                    (time.time(),),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO files (content_hash, file_json, expires_at) "
+                    "VALUES (?, ?, ?)",
+                    (content_hash, file.model_dump_json(exclude_none=True), expires_at),
+                )
+                conn.commit()
+
+        await asyncio.to_thread(write)
+
+
+class RedisFilesIndex(FilesIndex):
+    """
+    `FilesIndex` backed by any Redis-compatible server (Redis, Valkey, KeyDB...).
+
+    Use this when workers run on different hosts. Requires the optional `redis` package.
+    Expiration is delegated to the server using key TTLs.
+    """
+
+    KEY_PREFIX: Final = "gemini_manifold:files_index"
+
+    def __init__(self, url: str):
+        # Imported lazily because `redis` is an optional dependency.
+        import redis.asyncio as aioredis
+
+        self.url = url
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        log.info("Connected Files API index to Redis.")
+
+    async def get_hash(self, owui_file_id: str) -> str | None:
+        # GETEX (Redis >= 6.2) extends the TTL of the mapping on every read.
+        return await self._redis.getex(
+            f"{self.KEY_PREFIX}:id:{owui_file_id}", ex=self.ID_HASH_TTL
+        )
+
+    async def set_hash(self, owui_file_id: str, content_hash: str) -> None:
+        await self._redis.set(
+            f"{self.KEY_PREFIX}:id:{owui_file_id}", content_hash, ex=self.ID_HASH_TTL
+        )
+
+    async def get_file(self, content_hash: str) -> types.File | None:
+        file_json = await self._redis.get(f"{self.KEY_PREFIX}:file:{content_hash}")
+        return types.File.model_validate_json(file_json) if file_json else None
+
+    async def set_file(
+        self, content_hash: str, file: types.File, ttl: float | None
+    ) -> None:
+        if ttl is not None and ttl <= 0:
+            return
+        await self._redis.set(
+            f"{self.KEY_PREFIX}:file:{content_hash}",
+            file.model_dump_json(exclude_none=True),
+            ex=max(1, int(ttl)) if ttl is not None else None,
+        )
+
+
+class ModelCapability(enum.IntFlag):
+    """Features a model supports. Must match `ModelCapability` in the companion filter."""
+
+    NONE = 0
+    GROUNDING = 1
+    CODE_EXECUTION = 2
+    URL_CONTEXT = 4
+    IMAGE_OUTPUT = 8
+    THINKING = 16
+    SYSTEM_PROMPT = 32
+
+
+class ModelCapabilityRegistry:
+    """
+    Maps model IDs to their `ModelCapability` flags, so a request looks its model up once
+    instead of scanning the model lists and running the model regexes again.
+
+    The flags of the listed models are computed whenever a model list is fetched, from the
+    known model lists, the THINKING_MODEL_PATTERN and IMAGE_MODEL_PATTERN valves and the
+    model metadata. Models that are not listed, or requests with user-specific patterns,
+    are classified on first use and remembered as well, up to `MAX_ENTRIES` flags in total
+    with the least recently used evicted first.
+
+    The registry is published on the shared `app.state` under `APP_STATE_ATTR` so the
+    companion filter's `inlet` uses the same flags.
+    """
+
+    APP_STATE_ATTR: Final = "gemini_manifold_model_capabilities"
+    MAX_ENTRIES: Final = 1024
+
+    def __init__(self, thinking_pattern: str, image_pattern: str):
+        self.thinking_pattern = thinking_pattern
+        self.image_pattern = image_pattern
+        # Model ID -> model metadata, from the fetched model lists.
+        self._models: dict[str, types.Model] = {}
+        # (model ID, thinking pattern, image pattern) -> flags, least recently used first.
+        self._capabilities: collections.OrderedDict[
+            tuple[str, str, str], ModelCapability
+        ] = collections.OrderedDict()
+        # Incremented whenever the flags are re-computed, the companion filter caches by it.
+        self.version = 0
+
+    def configure(self, thinking_pattern: str, image_pattern: str) -> None:
+        if (thinking_pattern, image_pattern) == (
+            self.thinking_pattern,
+            self.image_pattern,
+        ):
+            return
+        self.thinking_pattern = thinking_pattern
+        self.image_pattern = image_pattern
+        self._rebuild()
+
+    def update(self, models: list[types.Model]) -> None:
+        """Re-computes the flags after a model list was fetched."""
+        for model in models:
+            if model.name:
+                self._models[Pipe.strip_prefix(model.name)] = model
+        self._rebuild()
+
+    def get(
+        self,
+        model_id: str,
+        thinking_pattern: str | None = None,
+        image_pattern: str | None = None,
+    ) -> ModelCapability:
+        """Returns the flags of a model, using the configured patterns unless others are given."""
+        key = (
+            model_id,
+            thinking_pattern or self.thinking_pattern,
+            image_pattern or self.image_pattern,
+        )
+        capabilities = self._capabilities.get(key)
+        if capabilities is not None:
+            self._capabilities.move_to_end(key)
+            return capabilities
+        capabilities = self._classify(*key)
+        self._capabilities[key] = capabilities
+        if len(self._capabilities) > self.MAX_ENTRIES:
+            self._capabilities.popitem(last=False)
+        return capabilities
+
+    def _rebuild(self) -> None:
+        self.version += 1
+        self._capabilities = collections.OrderedDict(
+            (
+                (model_id, self.thinking_pattern, self.image_pattern),
+                self._classify(model_id, self.thinking_pattern, self.image_pattern),
+            )
+            for model_id in self._models
+        )
+
+    def _classify(
+        self, model_id: str, thinking_pattern: str, image_pattern: str
+    ) -> ModelCapability:
+        capabilities = ModelCapability.NONE
+        if model_id in GROUNDING_MODELS:
+            capabilities |= ModelCapability.GROUNDING
+        if model_id in CODE_EXECUTION_MODELS:
+            capabilities |= ModelCapability.CODE_EXECUTION
+        if model_id in URL_CONTEXT_MODELS:
+            capabilities |= ModelCapability.URL_CONTEXT
+        # Newer API versions report whether a model thinks, the pattern covers the others.
+        model = self._models.get(model_id)
+        if getattr(model, "thinking", None) or re.search(
+            thinking_pattern, model_id, re.IGNORECASE
+        ):
+            capabilities |= ModelCapability.THINKING
+        if re.search(image_pattern, model_id, re.IGNORECASE):
+            capabilities |= ModelCapability.IMAGE_OUTPUT
+        # Image generation and Gemma models do not accept a system prompt.
+        elif "gemma" not in model_id:
+            capabilities |= ModelCapability.SYSTEM_PROMPT
+        return capabilities
+
+    def snapshot(self) -> dict[str, int]:
+        return {"models": len(self._models), "entries": len(self._capabilities)}
+
+
+class GroundingStore:
+    """
+    Hands grounding metadata of a response over from `Pipe` to the companion filter's `outlet`.
+
+    The pipe and the outlet run in different requests, so the store is published on the
+    shared `app.state` under `APP_STATE_ATTR`. Entries expire after `ttl` seconds and
+    the oldest entries are dropped above `max_entries`, so responses whose outlet never
+    runs (client disconnect, disabled filter, errors) cannot accumulate in memory.
+
+    With a Redis URL, entries are also written to Redis under
+    `REDIS_KEY_PREFIX:{chat_id}:{message_id}`, so an outlet running on another worker
+    can pick them up. The companion filter reads that key directly in that case.
+    """
+
+    APP_STATE_ATTR: Final = "gemini_manifold_grounding_store"
+    REDIS_KEY_PREFIX: Final = "gemini_manifold:grounding"
+
+    def __init__(self, ttl: float, max_entries: int, redis_url: str | None = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis_url = redis_url
+        # (chat_id, message_id) -> (expires_at, metadata, pipe_start_time, size in bytes).
+        # Ordered from oldest to newest.
+        self._entries: collections.OrderedDict[
+            tuple[str, str], tuple[float, types.GroundingMetadata, float, int]
+        ] = collections.OrderedDict()
+        self.total_bytes = 0
+        self._redis = None
+        if redis_url:
+            # Imported lazily because `redis` is an optional dependency.
+            import redis.asyncio as aioredis
+
+            self._redis = aioredis.from_url(redis_url, decode_responses=True)
+
+    def configure(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def put(
+        self,
+        chat_id: str,
+        message_id: str,
+        grounding_metadata: types.GroundingMetadata,
+        pipe_start_time: float,
+    ) -> None:
+        """Stores the grounding metadata of a response until the outlet pops it."""
+        now = time.monotonic()
+        self._expire(now)
+        key = (chat_id, message_id)
+        metadata_json = grounding_metadata.model_dump_json(exclude_none=True)
+        if old_entry := self._entries.pop(key, None):
+            self.total_bytes -= old_entry[3]
+        self._entries[key] = (
+            now + self.ttl,
+            grounding_metadata,
+            pipe_start_time,
+            len(metadata_json),
+        )
+        self.total_bytes += len(metadata_json)
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted[3]
+            log.warning("Grounding store is full, dropped the oldest entry.")
+
+        if self._redis:
+            # Monotonic clocks are not comparable across hosts, so the start time
+            # is sent as wall-clock time.
+            pipe_started_at = time.time() - (now - pipe_start_time)
+            payload = json.dumps(
+                {
+                    "grounding_metadata": json.loads(metadata_json),
+                    "pipe_started_at": pipe_started_at,
+                }
+            )
+            try:
+                await self._redis.set(
+                    f"{self.REDIS_KEY_PREFIX}:{chat_id}:{message_id}",
+                    payload,
+                    ex=max(1, int(self.ttl)),
+                )
+            except Exception:
+                log.exception("Writing the grounding metadata to Redis failed.")
+
+    async def pop(
+        self, chat_id: str, message_id: str
+    ) -> tuple[types.GroundingMetadata, float | None] | None:
+        """
+        Removes and returns the grounding metadata and pipe start time (`time.monotonic()`)
+        of a response, or None if there is none.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._entries.pop((chat_id, message_id), None)
+        redis_payload = None
+        if self._redis:
+            try:
+                redis_payload = await self._redis.getdel(
+                    f"{self.REDIS_KEY_PREFIX}:{chat_id}:{message_id}"
+                )
+            except Exception:
+                log.exception("Reading the grounding metadata from Redis failed.")
+
+        if entry:
+            self.total_bytes -= entry[3]
+            return entry[1], entry[2]
+        if redis_payload:
+            data = json.loads(redis_payload)
+            pipe_start_time = now - (time.time() - data["pipe_started_at"])
+            return (
+                types.GroundingMetadata.model_validate(data["grounding_metadata"]),
+                pipe_start_time,
+            )
+        return None
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] > now:
+                break
+            del self._entries[key]
+            self.total_bytes -= entry[3]
+            log.debug(f"Grounding metadata of message {key[1]} expired unused.")
+
+    def snapshot(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self.total_bytes,
+        }
+
+
+class _CachedPrefix:
+    """A Gemini cached content holding the first `length` contents of a request."""
+
+    def __init__(
+        self,
+        key: str,
+        name: str,
+        length: int,
+        get_client: Callable[[], genai.Client],
+        expires_at: float,
+    ):
+        self.key = key
+        self.name = name
+        self.length = length
+        # Returns a client with the credentials the cache was created with, to extend and
+        # delete it. Looked up on every use, because the client it was created with may
+        # have been evicted from the `GenaiClientRegistry` and closed since.
+        self.get_client = get_client
+        # `time.monotonic()` based.
+        self.expires_at = expires_at
+
+
+class ContextCacheManager:
+    """
+    Creates and reuses Gemini cached contents (explicit context caching) for the stable
+    prefix of a chat, so long conversations and large files are not re-processed and
+    billed at the full input rate on every turn.
+
+    The digests of the contents of a request (see `_content_digest`) are chained prefix by
+    prefix. The chain is seeded with everything else a cached content holds: the auth
+    configuration, the model, the system instruction, the tools and the tool config.
+    `GeminiContentBuilder` stores the digest of a converted turn next to the turn in the
+    content cache, so the contents of a chat are only hashed once. If a known cache holds a prefix of the request, only the
+    remaining contents are sent together with a reference to the cache.
+
+    Alongside the request, a cache holding all of its contents is created in the background
+    if the contents not covered by a cache yet are large enough to be worth it, so the next
+    turn of the chat can use it. The cache it supersedes is shortened to `SUPERSEDED_TTL`
+    instead of being deleted, because in-flight requests may still reference it.
+
+    Caches live for `ttl` seconds and are extended when used past half of their lifetime.
+    Above `max_entries` the least recently used ones are deleted. Models that refuse
+    caching are not tried again for `ttl` seconds.
+    """
+
+    # Caches expiring sooner than this (in seconds) are not used, a request could outlive them.
+    EXPIRY_MARGIN: Final = 60
+    SUPERSEDED_TTL: Final = 300
+    # Matches how the API refers to a cached content in its errors, e.g.
+    # "CachedContent not found (or permission denied)" or "Cache content 123 is expired.".
+    CACHE_ERROR_PATTERN: Final = re.compile(r"\bcached ?content|\bcache content", re.IGNORECASE)
+
+    def __init__(self, ttl: int, max_entries: int, min_tokens: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+        # Prefix hash -> cache, ordered from least to most recently used.
+        self._entries: collections.OrderedDict[str, _CachedPrefix] = (
+            collections.OrderedDict()
+        )
+        # Prefix hashes whose cache is being created.
+        self._pending: set[str] = set()
+        # (auth key, model) -> `time.monotonic()` until which caching is not tried.
+        self._unsupported: dict[tuple[str, str], float] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.failures = 0
+
+    def configure(self, ttl: int, max_entries: int, min_tokens: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+
+    def apply(
+        self,
+        get_client: Callable[[], genai.Client],
+        auth_key: str,
+        gen_content_args: dict[str, Any],
+        content_digests: list[str] | None = None,
+    ) -> tuple[dict[str, Any], _CachedPrefix | None]:
+        """
+        Returns the arguments for `generate_content` that use the longest cached prefix
+        of `gen_content_args`, together with that cache (or the original arguments and None).
+        Starts creating a cache for the full contents in the background if worthwhile.
+        `get_client` returns a client for the credentials identified by `auth_key`.
+        `content_digests` are the `_content_digest` of the contents, computed here if not given.
+        """
+        model: str = gen_content_args["model"]
+        contents: list[types.Content] = gen_content_args["contents"]
+        config: types.GenerateContentConfig = gen_content_args["config"]
+        now = time.monotonic()
+        if not contents or self._unsupported.get((auth_key, model), 0) > now:
+            return gen_content_args, None
+
+        if content_digests is None or len(content_digests) != len(contents):
+            content_digests = [_content_digest(content) for content in contents]
+        prefix_hashes = self._hash_prefixes(auth_key, model, content_digests, config)
+        # At least the last content has to be sent with the request.
+        entry = None
+        for length in range(len(contents) - 1, 0, -1):
+            candidate = self._entries.get(prefix_hashes[length - 1])
+            if candidate is None:
+                continue
+            if candidate.expires_at - now < self.EXPIRY_MARGIN:
+                del self._entries[candidate.key]
+                continue
+            entry = candidate
+            self._entries.move_to_end(entry.key)
+            break
+
+        key = prefix_hashes[-1]
+        if key not in self._entries and key not in self._pending:
+            cached_length = entry.length if entry else 0
+            estimated_tokens, has_non_text_parts = _estimate_contents_tokens(
+                contents[cached_length:],
+                None if entry else config.system_instruction,
+            )
+            if estimated_tokens >= self.min_tokens or has_non_text_parts:
+                self._pending.add(key)
+                self._spawn(
+                    self._create(
+                        get_client,
+                        auth_key,
+                        key,
+                        gen_content_args,
+                        superseded=entry,
+                        count_tokens=estimated_tokens < self.min_tokens,
+                    )
+                )
+
+        if entry is None:
+            self.misses += 1
+            return gen_content_args, None
+
+        self.hits += 1
+        if entry.expires_at - now < self.ttl / 2:
+            entry.expires_at = now + self.ttl
+            self._spawn(self._update_ttl(entry, self.ttl))
+        log.info(
+            f"Using context cache {entry.name} for the first {entry.length} of {len(contents)} contents."
+        )
+        request_config = config.model_copy(
+            update={
+                "cached_content": entry.name,
+                # These are part of the cached content and must not be sent again.
+                "system_instruction": None,
+                "tools": None,
+                "tool_config": None,
+            }
+        )
+        request_args = gen_content_args | {
+            "contents": contents[entry.length :],
+            "config": request_config,
+        }
+        return request_args, entry
+
+    def discard(self, entry: _CachedPrefix) -> None:
+        """Forgets a cache that the API rejected (e.g. it was deleted or has expired)."""
+        self._entries.pop(entry.key, None)
+
+    def is_cache_error(
+        self, error: genai_errors.APIError, entry: _CachedPrefix
+    ) -> bool:
+        """Whether a failed request was rejected because of the cached content `entry`."""
+        if error.code not in (400, 403, 404):
+            return False
+        message = error.message or ""
+        cache_id = entry.name.rsplit("/", 1)[-1]
+        return cache_id in message or bool(self.CACHE_ERROR_PATTERN.search(message))
+
+    async def _create(
+        self,
+        get_client: Callable[[], genai.Client],
+        auth_key: str,
+        key: str,
+        gen_content_args: dict[str, Any],
+        superseded: _CachedPrefix | None,
+        count_tokens: bool,
+    ) -> None:
+        model: str = gen_content_args["model"]
+        contents: list[types.Content] = gen_content_args["contents"]
+        config: types.GenerateContentConfig = gen_content_args["config"]
+        try:
+            client = get_client()
+            if count_tokens:
+                # The text estimate was too small, but non-text parts can be large (e.g. PDFs).
+                uncached = contents[superseded.length :] if superseded else contents
+                response = await client.aio.models.count_tokens(
+                    model=model, contents=uncached
+                )
+                if (response.total_tokens or 0) < self.min_tokens:
+                    log.debug(
+                        f"Not caching the contents, only {response.total_tokens} new tokens."
+                    )
+                    return
+            cached_content = await client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    contents=contents,
+                    system_instruction=config.system_instruction,
+                    tools=config.tools or None,
+                    tool_config=config.tool_config,
+                    ttl=f"{self.ttl}s",
+                    display_name="gemini_manifold",
+                ),
+            )
+        except genai_errors.ClientError as e:
+            self.failures += 1
+            message = str(e).lower()
+            if e.code == 429 or "too small" in message or "minimum" in message:
+                log.debug(f"Context cache was not created: {e}")
+            else:
+                log.warning(
+                    f"Model {model} does not seem to support context caching, "
+                    f"not trying again for {self.ttl}s: {e}"
+                )
+                self._unsupported[(auth_key, model)] = time.monotonic() + self.ttl
+            return
+        except Exception:
+            self.failures += 1
+            log.exception("Creating the context cache failed.")
+            return
+        finally:
+            self._pending.discard(key)
+
+        if not cached_content.name:
+            return
+        self.created += 1
+        token_count = (
+            cached_content.usage_metadata.total_token_count
+            if cached_content.usage_metadata
+            else None
+        )
+        log.info(
+            f"Created context cache {cached_content.name} for {len(contents)} contents ({token_count} tokens)."
+        )
+        self._entries[key] = _CachedPrefix(
+            key,
+            cached_content.name,
+            len(contents),
+            get_client,
+            time.monotonic() + self.ttl,
+        )
+        if superseded and self._entries.pop(superseded.key, None):
+            self._spawn(self._update_ttl(superseded, self.SUPERSEDED_TTL))
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._spawn(self._delete(evicted))
+
+    async def _update_ttl(self, entry: _CachedPrefix, ttl: int) -> None:
+        try:
+            await entry.get_client().aio.caches.update(
+                name=entry.name,
+                config=types.UpdateCachedContentConfig(ttl=f"{ttl}s"),
+            )
+            log.debug(f"Set the TTL of context cache {entry.name} to {ttl}s.")
+        except Exception as e:
+            log.warning(f"Updating the TTL of context cache {entry.name} failed: {e}")
+            self.discard(entry)
+
+    async def _delete(self, entry: _CachedPrefix) -> None:
+        try:
+            await entry.get_client().aio.caches.delete(name=entry.name)
+            log.debug(f"Deleted context cache {entry.name}.")
+        except Exception as e:
+            # It expires on its own.
+            log.warning(f"Deleting context cache {entry.name} failed: {e}")
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.create_task(coro)  # type: ignore
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _hash_prefixes(
+        auth_key: str,
+        model: str,
+        content_digests: list[str],
+        config: types.GenerateContentConfig,
+    ) -> list[str]:
+        """
+        Returns the hash of every prefix of the contents, the i-th one covering `contents[: i + 1]`.
+        The hashes are prefixed with `auth_key`, so caches are never shared across credentials.
+        """
+        hasher = xxhash.xxh64()
+        hasher.update(model.encode())
+        hasher.update(
+            config.model_dump_json(
+                include={"system_instruction", "tools", "tool_config"},
+                exclude_none=True,
+            ).encode()
+        )
+        prefix_hashes = []
+        for digest in content_digests:
+            hasher.update(b"\x00" + digest.encode())
+            prefix_hashes.append(f"{auth_key}:{hasher.hexdigest()}")
+        return prefix_hashes
+
+    def snapshot(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "created": self.created,
+            "failures": self.failures,
+        }
+
+
+class FileSource:
+    """
+    A lazily read file that is held in memory, stored on the local disk or in Google Cloud Storage.
+
+    Nothing is read until the content is actually needed. Hashing and uploading
+    read the file in fixed-size chunks, so even very large attachments are never
+    fully materialized in memory when the Files API is used.
+    """
+
+    def __init__(
+        self,
+        *,
+        data: bytes | None = None,
+        path: str | None = None,
+        blob: "storage.Blob | None" = None,
+    ):
+        if sum(x is not None for x in (data, path, blob)) != 1:
+            raise ValueError("Exactly one of `data`, `path` or `blob` must be given.")
+        self.data = data
+        self.path = path
+        self.blob = blob
+
+    def __repr__(self) -> str:
+        if self.path is not None:
+            return f"FileSource(path={self.path!r})"
+        if self.blob is not None:
+            return f"FileSource(blob=gs://{self.blob.bucket.name}/{self.blob.name})"
+        return f"FileSource(data=<{len(self.data or b'')} bytes>)"
+
+    def open(self, chunk_size: int) -> io.IOBase:
+        """Opens a blocking, seekable binary stream over the content."""
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        if self.path is not None:
+            return open(self.path, "rb", buffering=chunk_size)
+        return cast("storage.Blob", self.blob).open("rb", chunk_size=chunk_size)
+
+    async def content_hash(self, chunk_size: int) -> str:
+        """
+        Computes the xxHash64 of the content incrementally over `chunk_size` chunks.
+        The work is done in a thread so that large files do not block the event loop.
+        """
+        if self.data is not None and len(self.data) <= chunk_size:
+            # Small in-memory payloads are cheaper to hash inline than to hand off to a thread.
+            return xxhash.xxh64(self.data).hexdigest()
+        return await asyncio.to_thread(self._content_hash_sync, chunk_size)
+
+    def _content_hash_sync(self, chunk_size: int) -> str:
+        hasher = xxhash.xxh64()
+        with self.open(chunk_size) as stream:
+            while chunk := stream.read(chunk_size):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    async def read_bytes(self) -> bytes:
+        """Reads the whole content into memory. Only used when raw bytes must be sent inline."""
+        if self.data is not None:
+            return self.data
+        if self.path is not None:
+            async with aiofiles.open(self.path, "rb") as file:
+                return await file.read()
+        return await asyncio.to_thread(cast("storage.Blob", self.blob).download_as_bytes)
+
+
+class GCSBlobStore:
+    """
+    Process-wide access to files that Open WebUI stores in Google Cloud Storage.
+
+    A single `storage.Client` (and its HTTP connection pool) is shared by all requests.
+    Blocking GCS calls run on a small dedicated thread pool, which also bounds the number
+    of concurrent downloads. Downloaded blobs are kept in an on-disk LRU cache keyed by
+    object generation, so an overwritten object is never served from a stale copy.
+    Blobs larger than the cache are not downloaded at all but streamed with range reads.
+    """
+
+    def __init__(self, cache_dir: str, max_cache_bytes: int, max_concurrency: int):
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.max_concurrency = max_concurrency
+        self._client: storage.Client | None = None
+        self._client_lock = threading.Lock()
+        self._executor = self._new_executor(max_concurrency)
+        # Cache file name -> size. Ordered from least to most recently used.
+        self._entries: collections.OrderedDict[str, int] | None = None
+        self._entries_lock = threading.Lock()
+        # Cache file name -> download in progress, so concurrent requests download a blob once.
+        self._downloads: dict[str, asyncio.Future[str]] = {}
+
+    @staticmethod
+    def _new_executor(max_workers: int) -> "concurrent.futures.ThreadPoolExecutor":
+        return concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="gemini_manifold_gcs"
+        )
+
+    def configure(self, max_cache_bytes: int, max_concurrency: int) -> None:
+        """Applies changed valve values. Running downloads finish on the old thread pool."""
+        if max_concurrency != self.max_concurrency:
+            log.info(
+                f"GCS download concurrency changed from {self.max_concurrency} to {max_concurrency}."
+            )
+            old_executor, self._executor = self._executor, self._new_executor(
+                max_concurrency
+            )
+            old_executor.shutdown(wait=False)
+            self.max_concurrency = max_concurrency
+        if max_cache_bytes != self.max_cache_bytes:
+            self.max_cache_bytes = max_cache_bytes
+            self._executor.submit(self._evict)
+
+    @property
+    def client(self) -> storage.Client:
+        with self._client_lock:
+            if self._client is None:
+                self._client = storage.Client()
+            return self._client
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    async def get_source(self, file_path: str) -> FileSource | None:
+        """
+        Returns a `FileSource` for a `gs://bucket-name/object-name` path.
+        Returns None if the object does not exist.
+        """
+        bucket_name, blob_name = file_path.removeprefix("gs://").split("/", 1)
+        blob: storage.Blob | None = await self._run(
+            self._get_blob, bucket_name, blob_name
+        )
+        if blob is None:
+            log.warning(f"File {file_path} not found in GCS.")
+            return None
+
+        size = blob.size or 0
+        if self.max_cache_bytes <= 0 or size > self.max_cache_bytes:
+            log.debug(
+                f"{file_path} ({size} bytes) bypasses the GCS cache, streaming it with range reads."
+            )
+            return FileSource(blob=blob)
+
+        key = f"{xxhash.xxh64(file_path.encode()).hexdigest()}-{blob.generation}"
+        if await self._run(self._touch, key):
+            log.debug(f"GCS cache HIT for {file_path} (generation {blob.generation}).")
+            return FileSource(path=os.path.join(self.cache_dir, key))
+
+        log.debug(f"GCS cache MISS for {file_path}, downloading {size} bytes.")
+        if not (download := self._downloads.get(key)):
+            download = asyncio.ensure_future(self._run(self._download, blob, key))
+            self._downloads[key] = download
+            download.add_done_callback(lambda _: self._downloads.pop(key, None))
+        try:
+            return FileSource(path=await asyncio.shield(download))
+        except exceptions.NotFound:
+            log.warning(f"File {file_path} was deleted from GCS during the download.")
+            return None
+
+    def _get_blob(self, bucket_name: str, blob_name: str) -> storage.Blob | None:
+        # Fetches the metadata only. The client is created here as it may read credentials from disk.
+        return self.client.bucket(bucket_name).get_blob(blob_name)
+
+    def _load_entries(self) -> collections.OrderedDict[str, int]:
+        """Builds the LRU index from the cache directory, oldest modification time first."""
+        if self._entries is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            files = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+            self._entries = collections.OrderedDict(
+                (name, size) for _, name, size in sorted(files)
+            )
+        return self._entries
+
+    def _touch(self, key: str) -> bool:
+        """Marks a cached blob as recently used. Returns False if it is not cached."""
+        path = os.path.join(self.cache_dir, key)
+        with self._entries_lock:
+            entries = self._load_entries()
+            try:
+                # The modification time persists the LRU order across restarts.
+                os.utime(path)
+            except FileNotFoundError:
+                entries.pop(key, None)
+                return False
+            entries[key] = entries.pop(key, None) or os.path.getsize(path)
+            return True
+
+    def _download(self, blob: storage.Blob, key: str) -> str:
+        path = os.path.join(self.cache_dir, key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.part"
+        with self._entries_lock:
+            self._load_entries()
+        try:
+            # Pinned to the generation read above by the blob's properties.
+            blob.download_to_filename(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+        with self._entries_lock:
+            cast(collections.OrderedDict, self._entries)[key] = os.path.getsize(path)
+        self._evict(keep=key)
+        return path
+
+    def _evict(self, keep: str | None = None) -> None:
+        """Removes least recently used blobs until the cache fits `max_cache_bytes`."""
+        with self._entries_lock:
+            entries = self._load_entries()
+            total = sum(entries.values())
+            for key in list(entries):
+                if total <= self.max_cache_bytes:
+                    break
+                if key == keep:
+                    continue
+                total -= entries.pop(key)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.cache_dir, key))
+                log.trace(f"Evicted {key} from the GCS cache.")
+
+
+class UploadScheduler:
+    """
+    Process-wide limiter for Files API operations (`files.get` recovery and `files.upload`)
+    that share one API key.
+
+    The status polls of `FilesAPIManager._poll_pending_files` are exempt: they are cheap
+    metadata requests, already spaced out per file by an adaptive interval, and queueing
+    them behind long uploads would delay files that are uploaded and waiting to be used.
 
-            if msg_type == "REGISTER_UPLOAD":
-                self.is_active = True
-                self.total_uploads_expected += 1
-                await self._emit_progress_update()
-            elif msg_type == "COMPLETE_UPLOAD":
-                self.uploads_completed += 1
-                await self._emit_progress_update()
-            elif msg_type == "FINALIZE":
-                self.finalize_received = True
+    At most `max_in_flight` operations run at the same time. Waiting operations are
+    served by priority first (files of the newest user turn, which the user is waiting
+    on, before files from the chat history) and then round-robin across users, so a
+    single long chat cannot starve everyone else.
+    """
 
-            self.queue.task_done()
+    PRIORITY_NEWEST_TURN: Final = 0
+    PRIORITY_HISTORY: Final = 1
 
-        log.debug("UploadStatusManager finished its run.")
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        # priority -> user_id -> FIFO of waiting futures. Dicts preserve insertion order,
+        # moving a user to the end after each grant implements the round-robin.
+        self._waiters: dict[int, dict[str, collections.deque[asyncio.Future]]] = {}
 
-    async def _emit_progress_update(self) -> None:
-        """Emits the current progress to the front-end if uploads are active."""
-        if not self.is_active:
-            return
+    @property
+    def queued(self) -> int:
+        return sum(
+            len(queue) for users in self._waiters.values() for queue in users.values()
+        )
 
-        elapsed_time = time.monotonic() - self.start_time
-        time_str = f"(+{elapsed_time:.2f}s)"
+    def set_max_in_flight(self, max_in_flight: int) -> None:
+        """Updates the limit, e.g. after a valve change, and wakes up waiters if it grew."""
+        if max_in_flight != self.max_in_flight:
+            log.info(
+                f"Files API concurrency limit changed from {self.max_in_flight} to {max_in_flight}."
+            )
+            self.max_in_flight = max_in_flight
+            self._wake_waiters()
 
-        is_done = (
-            self.total_uploads_expected > 0
-            and self.uploads_completed == self.total_uploads_expected
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        user_id: str,
+        priority: int,
+        on_start: Callable[[], Awaitable[None]] | None = None,
+    ) -> AsyncIterator[None]:
+        """
+        Waits for a free slot and holds it for the duration of the `async with` block.
+        `on_start` is awaited once the slot has been granted.
+        """
+        await self._acquire(user_id, priority)
+        try:
+            if on_start:
+                await on_start()
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, user_id: str, priority: int) -> None:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        users = self._waiters.setdefault(priority, {})
+        users.setdefault(user_id, collections.deque()).append(future)
+        log.debug(
+            f"Files API operation queued (priority {priority}). "
+            f"In flight: {self.in_flight}/{self.max_in_flight}, queued: {self.queued}."
         )
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted right before the cancellation, pass it on.
+                self._release()
+            else:
+                self._discard_waiter(priority, user_id, future)
+            raise
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        while self.in_flight < self.max_in_flight:
+            if not (future := self._pop_next_waiter()):
+                return
+            if future.done():
+                # Cancelled while queued, before its task could discard it.
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _pop_next_waiter(self) -> asyncio.Future | None:
+        for priority in sorted(self._waiters):
+            users = self._waiters[priority]
+            user_id = next(iter(users))
+            queue = users.pop(user_id)
+            future = queue.popleft()
+            if queue:
+                users[user_id] = queue  # Re-inserting moves the user to the back.
+            if not users:
+                del self._waiters[priority]
+            return future
+        return None
 
-        if is_done:
-            message = f"- Upload complete. {self.uploads_completed} file(s) processed. {time_str}"
-        else:
-            # Show "Uploading 1 of N..."
-            message = f"- Uploading file {self.uploads_completed + 1} of {self.total_uploads_expected}... {time_str}"
+    def _discard_waiter(
+        self, priority: int, user_id: str, future: asyncio.Future
+    ) -> None:
+        users = self._waiters.get(priority, {})
+        queue = users.get(user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            return
+        if not queue:
+            del users[user_id]
+        if not users:
+            self._waiters.pop(priority, None)
 
-        await self.event_emitter.emit_status(message, done=is_done)
+
+class _PendingPoll:
+    """Polling state of a single file inside `FilesAPIManager._run_poll_loop`."""
+
+    def __init__(
+        self,
+        *,
+        future: "asyncio.Future[types.File]",
+        owui_file_id: str | None,
+        interval: float,
+        max_interval: float,
+        next_poll: float,
+        deadline: float,
+        timeout: float,
+    ):
+        self.future = future
+        self.owui_file_id = owui_file_id
+        self.interval = interval
+        self.max_interval = max_interval
+        self.next_poll = next_poll
+        self.deadline = deadline
+        self.timeout = timeout
+        # Tasks awaiting `future`, polling stops once all of them are cancelled.
+        self.waiters = 0
 
 
 class FilesAPIManager:
@@ -366,10 +2152,12 @@ class FilesAPIManager:
 
     1. Hot Path (In-Memory Caches): For instantly retrieving file objects and hashes
        for recently used files.
-    2. Warm Path (Stateless GET): For quickly recovering file state after a server
-       restart by using a deterministic name (derived from the content hash) and a
-       single `get` API call.
-    3. Cold Path (Upload): As a last resort, for uploading new files or re-uploading
+    2. Warm Path (Persistent Index): For serving files known to other workers or
+       to a previous run of this worker from a shared `FilesIndex`, without any
+       Google round trip.
+    3. Cold Path (Stateless GET or Upload): For recovering file state using a
+       deterministic name (derived from the content hash) and a single `get` API
+       call, and as a last resort, for uploading new files or re-uploading
        expired ones.
     """
 
@@ -379,33 +2167,60 @@ class FilesAPIManager:
         file_cache: SimpleMemoryCache,
         id_hash_cache: SimpleMemoryCache,
         event_emitter: EventEmitter,
+        *,
+        files_index: FilesIndex | None = None,
+        stats: FilesAPIStats | None = None,
+        chunk_size: int = 8 * 1024 * 1024,
+        scheduler: UploadScheduler | None = None,
+        user_id: str = "",
+        auth_key: str = "",
     ):
         """
         Initializes the FilesAPIManager.
 
         Args:
             client: An initialized `google.genai.Client` instance.
-            file_cache: An aiocache instance for mapping `content_hash -> types.File`.
+            file_cache: An aiocache instance for mapping `auth_key:content_hash -> types.File`.
                         Must be configured with `aiocache.serializers.NullSerializer`.
             id_hash_cache: An aiocache instance for mapping `owui_file_id -> content_hash`.
                            This is an optimization to avoid re-hashing known files.
             event_emitter: An abstract class for emitting events to the front-end.
+            files_index: An optional persistent index shared across workers and restarts.
+            stats: Optional hit/miss counters, usually shared by all requests of the worker.
+            chunk_size: Size in bytes of the chunks used to hash and upload files.
+                        Bounds the memory used per file regardless of the file size.
+            scheduler: An optional process-wide limiter for Files API calls made with this client's API key.
+            user_id: The ID of the requesting user, used for fair scheduling between users.
+            auth_key: A hash of the client's auth configuration. Files are only visible to
+                      the credentials they were uploaded with, so the file tiers of the
+                      caches and the persistent index are keyed on it (see `_file_key`).
         """
         self.client = client
         self.file_cache = file_cache
         self.id_hash_cache = id_hash_cache
         self.event_emitter = event_emitter
+        self.files_index = files_index
+        self.stats = stats or FilesAPIStats()
+        self.chunk_size = chunk_size
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.auth_key = auth_key
+        # Files waiting to become ACTIVE, all polled by a single loop per request.
+        self._pending_polls: dict[str, _PendingPoll] = {}
+        self._poll_loop_task: asyncio.Task | None = None
+        self._poll_loop_wakeup = asyncio.Event()
         # A dictionary to manage locks for concurrent uploads.
         # The key is the content_hash, the value is an asyncio.Lock.
         self.upload_locks: dict[str, asyncio.Lock] = {}
 
     async def get_or_upload_file(
         self,
-        file_bytes: bytes,
+        source: FileSource,
         mime_type: str,
         *,
         owui_file_id: str | None = None,
         status_queue: asyncio.Queue | None = None,
+        priority: int = UploadScheduler.PRIORITY_HISTORY,
     ) -> types.File:
         """
         The main public method to get a file, using caching, recovery, or uploading.
@@ -415,11 +2230,12 @@ class FilesAPIManager:
         It is safe from race conditions during concurrent uploads.
 
         Args:
-            file_bytes: The raw byte content of the file. Required.
+            source: The lazily read content of the file. Required.
             mime_type: The MIME type of the file (e.g., 'image/png'). Required.
             owui_file_id: The unique ID of the file from Open WebUI, if available.
                           Used for logging and as a key for the hash cache optimization.
             status_queue: An optional asyncio.Queue to report upload lifecycle events.
+            priority: Scheduling priority of the Files API calls, see `UploadScheduler`.
 
         Returns:
             An `ACTIVE` `google.genai.types.File` object.
@@ -428,16 +2244,11 @@ class FilesAPIManager:
             FilesAPIError: If the file fails to upload or process.
         """
         # Step 1: Get the fast content hash, using the ID cache as an optimization if possible.
-        content_hash = await self._get_content_hash(file_bytes, owui_file_id)
+        content_hash = await self._get_content_hash(source, owui_file_id)
 
-        # Step 2: The Hot Path (Check Local File Cache)
+        # Step 2: The Hot and Warm Paths (Check Local File Cache, then the Persistent Index)
         # A cache hit means the file is valid and we can return immediately.
-        cached_file: types.File | None = await self.file_cache.get(content_hash)
-        if cached_file:
-            log_id = f"OWUI ID: {owui_file_id}" if owui_file_id else "anonymous file"
-            log.debug(
-                f"Cache HIT for file hash {content_hash} ({log_id}). Returning immediately."
-            )
+        if cached_file := await self._get_cached_file(content_hash, owui_file_id):
             return cached_file
 
         # On cache miss, acquire a lock specific to this file's content to prevent race conditions.
@@ -453,7 +2264,7 @@ class FilesAPIManager:
             # Step 2.5: Double-Checked Locking
             # After acquiring the lock, check the cache again. Another task might have
             # completed the upload while we were waiting for the lock.
-            cached_file = await self.file_cache.get(content_hash)
+            cached_file = await self.file_cache.get(self._file_key(content_hash))
             if cached_file:
                 log.debug(
                     f"Cache HIT for file hash {content_hash} after acquiring lock. Returning."
@@ -467,8 +2278,9 @@ class FilesAPIManager:
             )
 
             try:
-                # Attempt to get the file (Warm Path)
-                file = await self.client.aio.files.get(name=deterministic_name)
+                # Attempt to get the file (Cold Path, stateless recovery)
+                async with self._files_api_slot(priority):
+                    file = await self.client.aio.files.get(name=deterministic_name)
                 if not file.name:
                     raise FilesAPIError(
                         f"Stateless recovery for {deterministic_name} returned a file without a name."
@@ -477,10 +2289,10 @@ class FilesAPIManager:
                 log.debug(
                     f"Stateless recovery successful for {deterministic_name}. File exists on server."
                 )
-                active_file = await self._poll_for_active_state(file.name, owui_file_id)
+                active_file = await self._poll_for_active_state(file, owui_file_id)
+                self.stats.record("cold", hit=True)
 
-                ttl_seconds = self._calculate_ttl(active_file.expiration_time)
-                await self.file_cache.set(content_hash, active_file, ttl=ttl_seconds)
+                await self._cache_file(content_hash, active_file)
 
                 return active_file
             except genai_errors.ClientError as e:
@@ -488,14 +2300,16 @@ class FilesAPIManager:
                     log.info(
                         f"File {deterministic_name} not found on server (received 403). Proceeding to upload."
                     )
+                    self.stats.record("cold", hit=False)
                     # Proceed to upload (Cold Path)
                     return await self._upload_and_process_file(
                         content_hash,
-                        file_bytes,
+                        source,
                         mime_type,
                         deterministic_name,
                         owui_file_id,
                         status_queue,
+                        priority,
                     )
                 else:
                     log.exception(
@@ -526,8 +2340,41 @@ class FilesAPIManager:
                 if content_hash in self.upload_locks:
                     del self.upload_locks[content_hash]
 
+    async def get_known_file(self, owui_file_id: str) -> types.File | None:
+        """
+        Metadata-only lookup of `owui_file_id -> content hash -> ACTIVE file` in the hot
+        and warm tiers. Returns None on any miss, without reading the file content or
+        calling the Google API, so the caller can fall back to `get_or_upload_file`.
+        """
+        if not (content_hash := await self._get_known_hash(owui_file_id)):
+            return None
+        # Misses are recorded by the `get_or_upload_file` call that follows.
+        return await self._get_cached_file(
+            content_hash, owui_file_id, record_misses=False
+        )
+
+    async def _get_known_hash(self, owui_file_id: str) -> str | None:
+        """Looks up the content hash of an Open WebUI file in the ID-to-Hash cache and the persistent index."""
+        cached_hash: str | None = await self.id_hash_cache.get(owui_file_id)
+        if cached_hash:
+            log.trace(f"Hash cache HIT for OWUI ID {owui_file_id}.")
+            return cached_hash
+        # Then the persistent index, which may know files hashed by other workers.
+        if self.files_index:
+            try:
+                cached_hash = await self.files_index.get_hash(owui_file_id)
+            except Exception:
+                log.exception("Reading the hash from the persistent index failed.")
+            if cached_hash:
+                log.trace(f"Persistent hash index HIT for OWUI ID {owui_file_id}.")
+                await self.id_hash_cache.set(
+                    owui_file_id, cached_hash, ttl=FilesIndex.ID_HASH_TTL
+                )
+                return cached_hash
+        return None
+
     async def _get_content_hash(
-        self, file_bytes: bytes, owui_file_id: str | None
+        self, source: FileSource, owui_file_id: str | None
     ) -> str:
         """
         Retrieves the file's content hash, using a cache for known IDs or computing it.
@@ -536,25 +2383,90 @@ class FilesAPIManager:
         re-computation for files with a known Open WebUI ID. For anonymous files
         (owui_file_id=None), it will always compute the hash.
         """
-        if owui_file_id:
-            # First, check the ID-to-Hash cache for known files.
-            cached_hash: str | None = await self.id_hash_cache.get(owui_file_id)
-            if cached_hash:
-                log.trace(f"Hash cache HIT for OWUI ID {owui_file_id}.")
-                return cached_hash
+        # First, check the caches for known files.
+        if owui_file_id and (cached_hash := await self._get_known_hash(owui_file_id)):
+            return cached_hash
 
         # If not in cache or if file is anonymous, compute the fast hash.
         log.trace(
             f"Hash cache MISS for OWUI ID {owui_file_id if owui_file_id else 'N/A'}. Computing hash."
         )
-        content_hash = xxhash.xxh64(file_bytes).hexdigest()
+        content_hash = await source.content_hash(self.chunk_size)
 
         # If there was an ID, store the newly computed hash for next time.
         if owui_file_id:
-            await self.id_hash_cache.set(owui_file_id, content_hash)
+            await self.id_hash_cache.set(
+                owui_file_id, content_hash, ttl=FilesIndex.ID_HASH_TTL
+            )
+            if self.files_index:
+                try:
+                    await self.files_index.set_hash(owui_file_id, content_hash)
+                except Exception:
+                    log.exception("Writing the hash to the persistent index failed.")
 
         return content_hash
 
+    async def _get_cached_file(
+        self, content_hash: str, owui_file_id: str | None, *, record_misses: bool = True
+    ) -> types.File | None:
+        """
+        Looks up an ACTIVE file in the hot (in-memory) and warm (persistent index) tiers.
+        Warm hits are promoted into the hot tier for the rest of their lifetime.
+        """
+        log_id = f"OWUI ID: {owui_file_id}" if owui_file_id else "anonymous file"
+
+        file_key = self._file_key(content_hash)
+        cached_file: types.File | None = await self.file_cache.get(file_key)
+        if cached_file or record_misses:
+            self.stats.record("hot", hit=bool(cached_file))
+        if cached_file:
+            log.debug(
+                f"Cache HIT for file hash {content_hash} ({log_id}). Returning immediately."
+            )
+            return cached_file
+
+        if not self.files_index:
+            return None
+        try:
+            cached_file = await self.files_index.get_file(file_key)
+        except Exception:
+            log.exception("Reading the file from the persistent index failed.")
+            cached_file = None
+        if cached_file or record_misses:
+            self.stats.record("warm", hit=bool(cached_file))
+        if not cached_file:
+            return None
+
+        ttl_seconds = self._calculate_ttl(cached_file.expiration_time)
+        if ttl_seconds == 0:
+            return None
+        log.debug(
+            f"Persistent index HIT for file hash {content_hash} ({log_id}). Returning immediately."
+        )
+        await self.file_cache.set(file_key, cached_file, ttl=ttl_seconds)
+        return cached_file
+
+    async def _cache_file(self, content_hash: str, file: types.File) -> None:
+        """Stores an ACTIVE file in the hot and warm tiers, honouring its expiration time."""
+        ttl_seconds = self._calculate_ttl(file.expiration_time)
+        file_key = self._file_key(content_hash)
+        await self.file_cache.set(file_key, file, ttl=ttl_seconds)
+        if self.files_index:
+            try:
+                await self.files_index.set_file(file_key, file, ttl_seconds)
+            except Exception:
+                log.exception("Writing the file to the persistent index failed.")
+        log.debug(
+            f"Cached file object for hash {content_hash} with TTL: {ttl_seconds}s."
+        )
+
+    def _file_key(self, content_hash: str) -> str:
+        """
+        Returns the key of a file in the file tiers. A file uploaded with one API key or
+        project cannot be used with another, so the content hash is prefixed with `auth_key`.
+        """
+        return f"{self.auth_key}:{content_hash}" if self.auth_key else content_hash
+
     def _calculate_ttl(self, expiration_time: datetime | None) -> float | None:
         """Calculates the TTL in seconds from an expiration datetime."""
         if not expiration_time:
@@ -569,28 +2481,39 @@ class FilesAPIManager:
     async def _upload_and_process_file(
         self,
         content_hash: str,
-        file_bytes: bytes,
+        source: FileSource,
         mime_type: str,
         deterministic_name: str,
         owui_file_id: str | None,
         status_queue: asyncio.Queue | None = None,
+        priority: int = UploadScheduler.PRIORITY_HISTORY,
     ) -> types.File:
         """Handles the full upload and post-upload processing workflow."""
 
-        # Register with the manager that an actual upload is starting.
+        # Register with the manager that an actual upload is needed. It counts as
+        # queued until the scheduler lets it start.
         if status_queue:
             await status_queue.put(("REGISTER_UPLOAD",))
 
-        log.info(f"Starting upload for {deterministic_name}...")
+        async def on_start() -> None:
+            log.info(f"Starting upload for {deterministic_name}...")
+            if status_queue:
+                await status_queue.put(("START_UPLOAD",))
 
+        file_io: io.IOBase | None = None
         try:
-            file_io = io.BytesIO(file_bytes)
             upload_config = types.UploadFileConfig(
                 name=deterministic_name, mime_type=mime_type
             )
-            uploaded_file = await self.client.aio.files.upload(
-                file=file_io, config=upload_config
-            )
+            async with self._files_api_slot(priority, on_start=on_start):
+                if source.path is not None:
+                    # The SDK streams local paths from disk in chunks using async file I/O.
+                    upload_target: str | io.IOBase = source.path
+                else:
+                    file_io = upload_target = source.open(self.chunk_size)
+                uploaded_file = await self.client.aio.files.upload(
+                    file=upload_target, config=upload_config
+                )
             if not uploaded_file.name:
                 raise FilesAPIError(
                     f"File upload for {deterministic_name} did not return a file name."
@@ -611,16 +2534,12 @@ class FilesAPIManager:
                     f"{uploaded_file.name} uploaded with state {uploaded_file.state}. Polling for ACTIVE state."
                 )
                 active_file = await self._poll_for_active_state(
-                    uploaded_file.name, owui_file_id
+                    uploaded_file, owui_file_id
                 )
                 log.debug(f"File {active_file.name} is now ACTIVE.")
 
-            # Calculate TTL and set in the main file cache using the content hash as the key.
-            ttl_seconds = self._calculate_ttl(active_file.expiration_time)
-            await self.file_cache.set(content_hash, active_file, ttl=ttl_seconds)
-            log.debug(
-                f"Cached new file object for hash {content_hash} with TTL: {ttl_seconds}s."
-            )
+            # Cache the file in every tier using the content hash as the key.
+            await self._cache_file(content_hash, active_file)
 
             return active_file
         except Exception as e:
@@ -631,51 +2550,249 @@ class FilesAPIManager:
             )
             raise FilesAPIError(f"Upload failed for {deterministic_name}: {e}") from e
         finally:
+            if file_io is not None:
+                file_io.close()
             # Report completion (success or failure) to the status manager.
             # This ensures the progress counter always advances.
             if status_queue:
                 await status_queue.put(("COMPLETE_UPLOAD",))
 
+    def _files_api_slot(
+        self,
+        priority: int,
+        on_start: Callable[[], Awaitable[None]] | None = None,
+    ) -> contextlib.AbstractAsyncContextManager[None]:
+        """Returns the scheduler slot guarding a Files API call, or a no-op if there is no scheduler."""
+        if self.scheduler:
+            return self.scheduler.slot(self.user_id, priority, on_start=on_start)
+
+        @contextlib.asynccontextmanager
+        async def unscheduled() -> AsyncIterator[None]:
+            if on_start:
+                await on_start()
+            yield
+
+        return unscheduled()
+
     async def _poll_for_active_state(
         self,
-        file_name: str,
+        file: types.File,
         owui_file_id: str | None,
-        timeout: int = 60,
-        poll_interval: int = 1,
+        timeout: float = 60,
     ) -> types.File:
-        """Polls the file's status until it is ACTIVE or fails."""
-        end_time = time.monotonic() + timeout
-        while time.monotonic() < end_time:
+        """
+        Waits until the file is ACTIVE or fails.
+
+        All files of a request that are still processing are polled by one shared
+        loop (see `_run_poll_loop`). Each file uses an adaptive interval: it starts
+        short so that small files are picked up as soon as they are ready, and grows
+        exponentially up to a ceiling that depends on the file's size and MIME type.
+        """
+        if file.state == types.FileState.ACTIVE:
+            return file
+        if file.state == types.FileState.FAILED:
+            self._raise_processing_failed(file, owui_file_id)
+
+        file_name = cast(str, file.name)
+        if pending := self._pending_polls.get(file_name):
+            # Another task of this request is already waiting for the same file.
+            return await self._wait_for_poll(file_name, pending)
+
+        initial_interval, max_interval = self._poll_intervals(file)
+        now = time.monotonic()
+        pending = _PendingPoll(
+            future=asyncio.get_running_loop().create_future(),
+            owui_file_id=owui_file_id,
+            interval=initial_interval,
+            max_interval=max_interval,
+            next_poll=now + initial_interval,
+            deadline=now + timeout,
+            timeout=timeout,
+        )
+        self._pending_polls[file_name] = pending
+        log.debug(
+            f"Waiting for {file_name} to become ACTIVE. "
+            f"Polling every {initial_interval}s, backing off up to {max_interval}s."
+        )
+
+        if self._poll_loop_task is None or self._poll_loop_task.done():
+            self._poll_loop_task = asyncio.create_task(self._run_poll_loop())
+        else:
+            # The new file may be due before the loop's current sleep ends.
+            self._poll_loop_wakeup.set()
+
+        return await self._wait_for_poll(file_name, pending)
+
+    async def _wait_for_poll(self, file_name: str, pending: _PendingPoll) -> types.File:
+        """
+        Waits for the result of a pending poll. The poll is shared by all waiters of
+        the file, so it is shielded from their cancellation. Once every waiter is gone
+        (e.g. the client disconnected), the file is no longer polled, and the poll loop
+        is stopped if no other file is pending.
+        """
+        pending.waiters += 1
+        try:
+            return await asyncio.shield(pending.future)
+        finally:
+            pending.waiters -= 1
+            if not pending.waiters and not pending.future.done():
+                pending.future.cancel()
+                if self._pending_polls.get(file_name) is pending:
+                    del self._pending_polls[file_name]
+                log.debug(f"Stopped polling {file_name}, no request is waiting for it.")
+                if not self._pending_polls and self._poll_loop_task:
+                    self._poll_loop_task.cancel()
+                    # A file registered before the cancellation is processed starts a new loop.
+                    self._poll_loop_task = None
+
+    @staticmethod
+    def _poll_intervals(file: types.File) -> tuple[float, float]:
+        """
+        Returns the (initial, maximum) poll interval in seconds for a processing file.
+        Video and audio need server-side processing that scales with their length,
+        other files are usually ACTIVE within a few hundred milliseconds.
+        """
+        mime_type = file.mime_type or ""
+        size_mib = (file.size_bytes or 0) / (1024 * 1024)
+        if mime_type.startswith(("video/", "audio/")):
+            initial_interval, max_interval = 1.0, 5.0
+        else:
+            initial_interval, max_interval = 0.2, 2.0
+        # Larger files take longer to process, so there is no point in polling them as often.
+        max_interval = min(max_interval + size_mib / 100, 10.0)
+        return initial_interval, max_interval
+
+    async def _run_poll_loop(self) -> None:
+        """
+        Runs `_poll_pending_files`. If it stops for any reason while files are still
+        pending (an unexpected error, cancellation), their waiters fail instead of hanging.
+        """
+        error: BaseException | None = None
+        try:
+            await self._poll_pending_files()
+        except asyncio.CancelledError as e:
+            error = e
+            raise
+        except Exception as e:
+            error = e
+            log.exception("The Files API poll loop stopped unexpectedly.")
+        finally:
+            # A loop stopped by `_wait_for_poll` may already have been replaced.
+            if self._poll_loop_task is asyncio.current_task():
+                pending_polls, self._pending_polls = self._pending_polls, {}
+            else:
+                pending_polls = {}
+            for name, pending in pending_polls.items():
+                if pending.future.done():
+                    continue
+                failure = FilesAPIError(
+                    f"Polling failed: Stopped waiting for {name} to become ACTIVE. Reason: {error!r}"
+                )
+                failure.__cause__ = error
+                pending.future.set_exception(failure)
+
+    async def _poll_pending_files(self) -> None:
+        """Polls every pending file when it is due, until none are left."""
+        POLL_BACKOFF_FACTOR = 1.5
+        while self._pending_polls:
+            now = time.monotonic()
+            due = [
+                (name, pending)
+                for name, pending in self._pending_polls.items()
+                if pending.next_poll <= now
+            ]
+            if due:
+                # Not limited by the `UploadScheduler`, see its docstring.
+                results = await asyncio.gather(
+                    *(self.client.aio.files.get(name=name) for name, _ in due),
+                    return_exceptions=True,
+                )
+                now = time.monotonic()
+                for (name, pending), result in zip(due, results):
+                    if self._pending_polls.get(name) is not pending:
+                        # Dropped while the request was in flight, see `_wait_for_poll`.
+                        continue
+                    try:
+                        if isinstance(result, BaseException):
+                            raise FilesAPIError(
+                                f"Polling failed: Could not get status for {name}. Reason: {result}"
+                            ) from result
+                        if result.state == types.FileState.ACTIVE:
+                            log.debug(f"File {name} is now ACTIVE.")
+                            pending.future.set_result(result)
+                        elif result.state == types.FileState.FAILED:
+                            self._raise_processing_failed(result, pending.owui_file_id)
+                        elif now >= pending.deadline:
+                            raise FilesAPIError(
+                                f"File {name} did not become ACTIVE within {pending.timeout} seconds."
+                            )
+                        else:
+                            state_name = result.state.name if result.state else "UNKNOWN"
+                            pending.next_poll = now + pending.interval
+                            log.trace(
+                                f"File {name} is still {state_name}. Waiting {pending.interval:.2f}s..."
+                            )
+                            pending.interval = min(
+                                pending.interval * POLL_BACKOFF_FACTOR,
+                                pending.max_interval,
+                            )
+                            continue
+                    except FilesAPIError as e:
+                        pending.future.set_exception(e)
+                    # The file reached a final state, stop polling it.
+                    del self._pending_polls[name]
+
+            if not self._pending_polls:
+                break
+            next_poll = min(p.next_poll for p in self._pending_polls.values())
+            self._poll_loop_wakeup.clear()
             try:
-                file = await self.client.aio.files.get(name=file_name)
-            except Exception as e:
-                raise FilesAPIError(
-                    f"Polling failed: Could not get status for {file_name}. Reason: {e}"
-                ) from e
+                await asyncio.wait_for(
+                    self._poll_loop_wakeup.wait(),
+                    timeout=max(next_poll - time.monotonic(), 0),
+                )
+            except asyncio.TimeoutError:
+                pass
 
-            if file.state == types.FileState.ACTIVE:
-                return file
-            if file.state == types.FileState.FAILED:
-                log_id = f"'{owui_file_id}'" if owui_file_id else "an uploaded file"
-                error_message = f"File processing failed on server for {file_name}."
-                toast_message = f"Google could not process {log_id}."
-                if file.error:
-                    reason = f"Reason: {file.error.message} (Code: {file.error.code})"
-                    error_message += f" {reason}"
-                    toast_message += f" Reason: {file.error.message}"
-
-                self.event_emitter.emit_toast(toast_message, "error")
-                raise FilesAPIError(error_message)
-
-            state_name = file.state.name if file.state else "UNKNOWN"
-            log.trace(
-                f"File {file_name} is still {state_name}. Waiting {poll_interval}s..."
-            )
-            await asyncio.sleep(poll_interval)
+    def _raise_processing_failed(
+        self, file: types.File, owui_file_id: str | None
+    ) -> NoReturn:
+        log_id = f"'{owui_file_id}'" if owui_file_id else "an uploaded file"
+        error_message = f"File processing failed on server for {file.name}."
+        toast_message = f"Google could not process {log_id}."
+        if file.error:
+            reason = f"Reason: {file.error.message} (Code: {file.error.code})"
+            error_message += f" {reason}"
+            toast_message += f" Reason: {file.error.message}"
 
-        raise FilesAPIError(
-            f"File {file_name} did not become ACTIVE within {timeout} seconds."
-        )
+        self.event_emitter.emit_toast(toast_message, "error")
+        raise FilesAPIError(error_message)
+
+
+class _TurnCacheInfo:
+    """
+    Collects what `GeminiContentBuilder` needs to know to cache a converted message turn.
+    One instance is bound to the `_TURN_CACHE_INFO` context variable per turn, so the
+    concurrently running helpers of that turn can report into it.
+    """
+
+    def __init__(self):
+        # Set to False when any part of the turn failed to convert, so it is retried next time.
+        self.cacheable = True
+        # The earliest expiration time (epoch seconds) of the Files API files referenced by the turn.
+        self.expires_at: float | None = None
+
+    def add_file_expiration(self, expiration_time: datetime | None) -> None:
+        if expiration_time is None:
+            return
+        timestamp = expiration_time.timestamp()
+        if self.expires_at is None or timestamp < self.expires_at:
+            self.expires_at = timestamp
+
+
+_TURN_CACHE_INFO: contextvars.ContextVar[_TurnCacheInfo | None] = (
+    contextvars.ContextVar("gemini_manifold_turn_cache_info", default=None)
+)
 
 
 class GeminiContentBuilder:
@@ -689,7 +2806,25 @@ class GeminiContentBuilder:
         event_emitter: EventEmitter,
         valves: "Pipe.Valves",
         files_api_manager: "FilesAPIManager",
+        gcs_blob_store: "GCSBlobStore",
+        content_cache: SimpleMemoryCache | None = None,
+        model_name: str | None = None,
+        token_budget: int | None = None,
+        digest_contents: bool = False,
     ):
+        """
+        Args:
+            gcs_blob_store: The process-wide store used to read files kept in Google Cloud Storage.
+            content_cache: An optional aiocache instance for mapping
+                           `chat_id:message_id:fingerprint -> types.Content`, used to reuse
+                           converted history turns that did not change since the last request.
+                           Must be configured with `aiocache.serializers.NullSerializer`.
+            model_name: The model the contents are built for, used to count tokens.
+            token_budget: The maximum number of input tokens. The oldest turns are left out
+                          if the chat does not fit. None disables the trimming.
+            digest_contents: Whether to provide the `_content_digest` of the built contents
+                             in `content_digests`, for context caching.
+        """
         self.messages_body = messages_body
         self.upload_documents = (metadata_body.get("features", {}) or {}).get(
             "upload_documents", False
@@ -697,7 +2832,15 @@ class GeminiContentBuilder:
         self.event_emitter = event_emitter
         self.valves = valves
         self.files_api_manager = files_api_manager
-        self.is_temp_chat = metadata_body.get("chat_id") == "local"
+        self.gcs_blob_store = gcs_blob_store
+        self.content_cache = content_cache
+        self.model_name = model_name
+        self.token_budget = token_budget
+        self.digest_contents = digest_contents
+        # The digest of each built content, see `digest_contents`.
+        self.content_digests: list[str] | None = None
+        self.chat_id = metadata_body.get("chat_id", "")
+        self.is_temp_chat = self.chat_id == "local"
         self.vertexai = self.files_api_manager.client.vertexai
 
         self.system_prompt, self.messages_body = self._extract_system_prompt(
@@ -706,6 +2849,8 @@ class GeminiContentBuilder:
         self.messages_db = self._fetch_and_validate_chat_history(
             metadata_body, user_data
         )
+        # File ID -> database row, filled in bulk by `_prefetch_file_models`.
+        self.file_models: dict[str, FileModel] = {}
 
     async def build_contents(self, start_time: float) -> list[types.Content]:
         """
@@ -720,34 +2865,90 @@ class GeminiContentBuilder:
             )
             self.event_emitter.emit_toast(warn_msg, "warning")
 
-        # 1. Set up and launch the status manager. It will activate itself if needed.
+        # 1. Reuse the turns that were already converted by a previous request.
+        cache_keys = [
+            self._get_content_cache_key(i, message)
+            for i, message in enumerate(self.messages_body)
+        ]
+        results: list[types.Content | BaseException | None] = [
+            await self._get_cached_content(key) for key in cache_keys
+        ]
+        pending_turns = [i for i, res in enumerate(results) if res is None]
+
+        # 2. Load the database rows of all files referenced by the remaining turns at once.
+        # With a token budget, the file sizes of all turns are needed for the estimate.
+        await self._prefetch_file_models(
+            list(range(len(results))) if self.token_budget else pending_turns
+        )
+
+        # 3. Leave out the oldest turns that do not fit into the token budget,
+        # before any of their files are uploaded.
+        first_kept = await self._plan_token_budget(cache_keys)
+        pending_turns = [i for i in pending_turns if i >= first_kept]
+
+        # 4. Set up and launch the status manager. It will activate itself if needed.
         status_manager = UploadStatusManager(self.event_emitter, start_time=start_time)
         manager_task = asyncio.create_task(status_manager.run())
 
-        # 2. Create and run concurrent processing tasks for each message turn.
+        # 5. Create and run concurrent processing tasks for each remaining message turn.
         tasks = [
-            self._process_message_turn(i, message, status_manager.queue)
-            for i, message in enumerate(self.messages_body)
+            self._process_and_cache_message_turn(
+                i, self.messages_body[i], cache_keys[i], status_manager.queue
+            )
+            for i in pending_turns
         ]
-        log.debug(f"Starting concurrent processing of {len(tasks)} message turns.")
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        log.debug(
+            f"Starting concurrent processing of {len(tasks)} message turns, "
+            f"{len(results) - len(tasks)} reused from the content cache."
+        )
+        processed = await asyncio.gather(*tasks, return_exceptions=True)
+        for i, res in zip(pending_turns, processed):
+            results[i] = res
 
-        # 3. Signal to the manager that no more uploads will be registered.
+        # 6. Signal to the manager that no more uploads will be registered.
         await status_manager.queue.put(("FINALIZE",))
 
-        # 4. Wait for the manager to finish processing all reported uploads.
+        # 7. Wait for the manager to finish processing all reported uploads.
         await manager_task
 
-        # 5. Filter and assemble the final contents list.
+        # 8. Check the estimate against the token count of the API, if enabled.
+        if self.token_budget and self.valves.VERIFY_TOKEN_COUNT:
+            first_kept = await self._verify_token_budget(results, cache_keys, first_kept)
+        if first_kept:
+            log.info(
+                f"Left out the {first_kept} oldest messages to fit into the token budget of {self.token_budget}."
+            )
+            self.event_emitter.emit_toast(
+                f"The {first_kept} oldest messages of this chat were left out "
+                f"because it exceeds the model's context window ({self.token_budget} tokens).",
+                "warning",
+            )
+
+        # 9. Filter and assemble the final contents list.
         contents: list[types.Content] = []
+        content_cache_keys: list[str | None] = []
         for i, res in enumerate(results):
+            if i < first_kept:
+                continue
             if isinstance(res, types.Content):
                 contents.append(res)
+                content_cache_keys.append(cache_keys[i])
             elif isinstance(res, Exception):
                 log.error(
                     f"An error occurred while processing message {i} concurrently.",
                     payload=res,
                 )
+
+        # 10. Provide the digests of the contents, mostly reused from the content cache.
+        if self.digest_contents:
+            self.content_digests = list(
+                await asyncio.gather(
+                    *(
+                        self._get_content_digest(content, key)
+                        for content, key in zip(contents, content_cache_keys)
+                    )
+                )
+            )
         return contents
 
     @staticmethod
@@ -780,21 +2981,264 @@ class GeminiContentBuilder:
             )
             return None
 
-        # 2. Validate length against the current message body
-        if len(messages_db) != len(self.messages_body):
-            warn_msg = (
-                f"Messages in the body ({len(self.messages_body)}) and "
-                f"messages in the database ({len(messages_db)}) do not match. "
-                "This is likely due to a bug in Open WebUI. "
-                "Cannot process files or filter citations."
+        # 2. Validate length against the current message body
+        if len(messages_db) != len(self.messages_body):
+            warn_msg = (
+                f"Messages in the body ({len(self.messages_body)}) and "
+                f"messages in the database ({len(messages_db)}) do not match. "
+                "This is likely due to a bug in Open WebUI. "
+                "Cannot process files or filter citations."
+            )
+
+            # TODO: Emit a toast to the user in the front-end.
+            log.warning(warn_msg)
+            # Invalidate the db messages if they don't match
+            return None
+
+        return messages_db
+
+    async def _plan_token_budget(self, cache_keys: list[str | None]) -> int:
+        """
+        Estimates the token count of every turn and returns the index of the oldest turn
+        that still fits into the token budget, counting from the newest one.
+        Turns counted by the API on an earlier request use that count.
+        """
+        if not self.token_budget:
+            return 0
+        turn_tokens = []
+        for i, message in enumerate(self.messages_body):
+            counted_tokens = await self._get_counted_tokens(cache_keys[i])
+            if counted_tokens is None:
+                counted_tokens = self._estimate_message_tokens(i, message)
+            turn_tokens.append(counted_tokens)
+        roles = [message.get("role") for message in self.messages_body]
+        budget = self.token_budget - _estimate_text_tokens(self.system_prompt or "")
+        first_kept = self._get_first_turn_within_budget(turn_tokens, roles, budget)
+        log.debug(
+            f"Estimated {sum(turn_tokens)} tokens for {len(turn_tokens)} turns "
+            f"(budget {self.token_budget}), keeping turns from index {first_kept}."
+        )
+        return first_kept
+
+    async def _verify_token_budget(
+        self,
+        results: list[types.Content | BaseException | None],
+        cache_keys: list[str | None],
+        first_kept: int,
+    ) -> int:
+        """
+        Counts the tokens of the converted turns with the API (cached per turn) and
+        returns the index of the oldest turn that fits, which is later than `first_kept`
+        if the estimate was too low. Keeps `first_kept` if counting fails.
+        """
+        kept_turns = [
+            i
+            for i in range(first_kept, len(results))
+            if isinstance(results[i], types.Content)
+        ]
+        semaphore = asyncio.Semaphore(TOKEN_COUNT_MAX_CONCURRENCY)
+
+        async def count(i: int) -> int | None:
+            async with semaphore:
+                return await self._count_turn_tokens(
+                    cast(types.Content, results[i]), cache_keys[i]
+                )
+
+        turn_tokens = await asyncio.gather(*(count(i) for i in kept_turns))
+        if not kept_turns or any(tokens is None for tokens in turn_tokens):
+            return first_kept
+        roles = [cast(types.Content, results[i]).role for i in kept_turns]
+        budget = self.token_budget - _estimate_text_tokens(self.system_prompt or "")  # type: ignore
+        first_fitting = self._get_first_turn_within_budget(
+            cast(list[int], turn_tokens), roles, budget
+        )
+        log.debug(
+            f"The API counted {sum(cast(list[int], turn_tokens))} tokens for the kept turns."
+        )
+        return kept_turns[first_fitting]
+
+    @staticmethod
+    def _get_first_turn_within_budget(
+        turn_tokens: list[int], roles: list[str | None], budget: int
+    ) -> int:
+        """
+        Returns the index of the oldest turn such that it and all newer turns fit into `budget`.
+        The newest turn is always kept, and the kept history starts with a user turn.
+        """
+        total = 0
+        first_kept = len(turn_tokens) - 1
+        for i in range(len(turn_tokens) - 1, -1, -1):
+            total += turn_tokens[i]
+            if total > budget and i < len(turn_tokens) - 1:
+                break
+            first_kept = i
+        while first_kept < len(turn_tokens) - 1 and roles[first_kept] != "user":
+            first_kept += 1
+        return max(first_kept, 0)
+
+    def _estimate_message_tokens(self, i: int, message: "Message") -> int:
+        """Roughly estimates the token count of a message turn before it is converted."""
+        content = message.get("content")
+        tokens = 0
+        if isinstance(content, str):
+            tokens += _estimate_text_tokens(content)
+        elif isinstance(content, list):
+            for item in content:
+                if item.get("type") == "text":
+                    tokens += _estimate_text_tokens(item.get("text") or "")
+                else:
+                    tokens += NON_TEXT_PART_TOKENS
+        if message.get("role") == "user" and self.messages_db and self.upload_documents:
+            for file in self.messages_db[i].get("files", []):
+                tokens += self._estimate_file_tokens(file)
+        return tokens
+
+    def _estimate_file_tokens(self, file: "FileAttachmentTD") -> int:
+        """Roughly estimates the token count of an attached file from its size and type."""
+        if file.get("type") != "file":
+            return NON_TEXT_PART_TOKENS
+        file_model = self.file_models.get(file.get("id", ""))
+        meta = (file_model.meta if file_model else None) or {}
+        size: int | None = meta.get("size")
+        content_type: str = meta.get("content_type") or ""
+        if not size or content_type.startswith("image/"):
+            return NON_TEXT_PART_TOKENS
+        bytes_per_token = next(
+            (
+                value
+                for prefix, value in FILE_BYTES_PER_TOKEN.items()
+                if content_type.startswith(prefix)
+            ),
+            DEFAULT_FILE_BYTES_PER_TOKEN,
+        )
+        return max(size // bytes_per_token, NON_TEXT_PART_TOKENS)
+
+    async def _get_counted_tokens(self, cache_key: str | None) -> int | None:
+        """Returns the token count of a turn counted by the API on an earlier request, if known."""
+        if cache_key is None:
+            return None
+        return await cast(SimpleMemoryCache, self.content_cache).get(
+            f"{cache_key}:tokens"
+        )
+
+    async def _count_turn_tokens(
+        self, content: types.Content, cache_key: str | None
+    ) -> int | None:
+        """Counts the tokens of a converted turn with the API and caches the count with the turn."""
+        if (counted_tokens := await self._get_counted_tokens(cache_key)) is not None:
+            return counted_tokens
+        try:
+            response = await self.files_api_manager.client.aio.models.count_tokens(
+                model=self.model_name, contents=[content]  # type: ignore
+            )
+        except Exception as e:
+            log.warning(f"Counting the tokens of a message turn failed: {e}")
+            return None
+        if cache_key is not None and response.total_tokens is not None:
+            await cast(SimpleMemoryCache, self.content_cache).set(
+                f"{cache_key}:tokens",
+                response.total_tokens,
+                ttl=self.valves.CONTENT_CACHE_TTL,
+            )
+        return response.total_tokens
+
+    async def _get_content_digest(
+        self, content: types.Content, cache_key: str | None
+    ) -> str:
+        """Returns the `_content_digest` of a turn, from the content cache if it was stored with the turn."""
+        if cache_key is not None and (
+            digest := await cast(SimpleMemoryCache, self.content_cache).get(
+                f"{cache_key}:digest"
+            )
+        ):
+            return digest
+        digest = await self._compute_content_digest(content)
+        if cache_key is not None:
+            await cast(SimpleMemoryCache, self.content_cache).set(
+                f"{cache_key}:digest", digest, ttl=self.valves.CONTENT_CACHE_TTL
+            )
+        return digest
+
+    @staticmethod
+    async def _compute_content_digest(content: types.Content) -> str:
+        # Inline data (e.g. PDFs) can be megabytes, it is hashed off the event loop.
+        if any(part.inline_data for part in content.parts or []):
+            return await asyncio.to_thread(_content_digest, content)
+        return _content_digest(content)
+
+    async def _get_cached_content(self, cache_key: str | None) -> types.Content | None:
+        """Returns the converted message turn from the content cache, if present."""
+        if cache_key is None:
+            return None
+        return await cast(SimpleMemoryCache, self.content_cache).get(cache_key)
+
+    async def _process_and_cache_message_turn(
+        self,
+        i: int,
+        message: "Message",
+        cache_key: str | None,
+        status_queue: asyncio.Queue,
+    ) -> types.Content | None:
+        """Processes a message turn and stores the result in the content cache if possible."""
+        if cache_key is None:
+            return await self._process_message_turn(i, message, status_queue)
+
+        # Runs inside the task created by `asyncio.gather`, so the context variable
+        # is private to this turn and inherited by the helpers it spawns.
+        cache_info = _TurnCacheInfo()
+        _TURN_CACHE_INFO.set(cache_info)
+        content = await self._process_message_turn(i, message, status_queue)
+        if content is None or not cache_info.cacheable:
+            return content
+
+        ttl = float(self.valves.CONTENT_CACHE_TTL)
+        if cache_info.expires_at is not None:
+            # Never reuse a turn that references a Files API file which has expired.
+            ttl = min(ttl, cache_info.expires_at - time.time())
+        if ttl > 0:
+            await cast(SimpleMemoryCache, self.content_cache).set(
+                cache_key, content, ttl=ttl
             )
+            if self.digest_contents:
+                # Replaces the digest of an earlier conversion of the turn.
+                await cast(SimpleMemoryCache, self.content_cache).set(
+                    f"{cache_key}:digest",
+                    await self._compute_content_digest(content),
+                    ttl=ttl,
+                )
+        return content
 
-            # TODO: Emit a toast to the user in the front-end.
-            log.warning(warn_msg)
-            # Invalidate the db messages if they don't match
+    def _get_content_cache_key(self, i: int, message: "Message") -> str | None:
+        """
+        Builds the content cache key of a message turn from the chat ID, the message ID
+        and a fingerprint of everything that affects the conversion of the turn.
+        Returns None if the turn cannot be cached.
+        """
+        if (
+            self.content_cache is None
+            or self.valves.CONTENT_CACHE_TTL <= 0
+            or self.is_temp_chat
+            or not self.messages_db
+        ):
+            return None
+        message_db = self.messages_db[i]
+        if not (message_id := message_db.get("id")):
             return None
 
-        return messages_db
+        fingerprint_data = {
+            "message": message,
+            "files": message_db.get("files") if self.upload_documents else None,
+            "sources": message_db.get("sources"),
+            # Files API URIs are only valid for the API key that uploaded them.
+            "api_key": self.valves.GEMINI_API_KEY,
+            "vertexai": self.vertexai,
+            "use_files_api": self.valves.USE_FILES_API,
+            "parse_youtube_urls": self.valves.PARSE_YOUTUBE_URLS,
+        }
+        fingerprint = xxhash.xxh64(
+            json.dumps(fingerprint_data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return f"{self.chat_id}:{message_id}:{fingerprint}"
 
     async def _process_message_turn(
         self, i: int, message: "Message", status_queue: asyncio.Queue
@@ -813,7 +3257,15 @@ class GeminiContentBuilder:
                 message_db = self.messages_db[i]
                 if self.upload_documents:
                     files = message_db.get("files", [])
-            parts = await self._process_user_message(message, files, status_queue)
+            # Files of the newest turn are what the user is waiting on, schedule them first.
+            priority = (
+                UploadScheduler.PRIORITY_NEWEST_TURN
+                if i == len(self.messages_body) - 1
+                else UploadScheduler.PRIORITY_HISTORY
+            )
+            parts = await self._process_user_message(
+                message, files, status_queue, priority
+            )
             # Case 1: User content is completely empty (no text, no files).
             if not parts:
                 log.info(
@@ -891,6 +3343,7 @@ class GeminiContentBuilder:
         message: "UserMessage",
         files: list["FileAttachmentTD"],
         status_queue: asyncio.Queue,
+        priority: int = UploadScheduler.PRIORITY_HISTORY,
     ) -> list[types.Part]:
         user_parts: list[types.Part] = []
         db_files_processed = False
@@ -903,16 +3356,11 @@ class GeminiContentBuilder:
             upload_tasks = []
             for file in files:
                 log.debug("Preparing DB file for concurrent upload:", payload=file)
-                uri = ""
-                if file.get("type") == "image":
-                    uri = file.get("url", "")
-                elif file.get("type") == "file":
-                    # Reconstruct the local API URI to be handled by our unified function
-                    uri = f"/api/v1/files/{file.get('id', '')}/content"
-
-                if uri:
+                if uri := self._get_db_file_uri(file):
                     # Create a coroutine for each file upload and add it to a list.
-                    upload_tasks.append(self._genai_part_from_uri(uri, status_queue))
+                    upload_tasks.append(
+                        self._genai_part_from_uri(uri, status_queue, priority)
+                    )
                 else:
                     log.warning("Could not determine URI for file in DB.", payload=file)
 
@@ -942,7 +3390,9 @@ class GeminiContentBuilder:
                 c = cast("TextContent", c)
                 if c_text := c.get("text"):
                     user_parts.extend(
-                        await self._genai_parts_from_text(c_text, status_queue)
+                        await self._genai_parts_from_text(
+                            c_text, status_queue, priority
+                        )
                     )
 
             # PATH 2: Temporary Chat Image Handling.
@@ -950,11 +3400,55 @@ class GeminiContentBuilder:
                 log.info("Processing image from payload (temporary chat mode).")
                 c = cast("ImageContent", c)
                 if uri := c.get("image_url", {}).get("url"):
-                    if part := await self._genai_part_from_uri(uri, status_queue):
+                    if part := await self._genai_part_from_uri(
+                        uri, status_queue, priority
+                    ):
                         user_parts.append(part)
 
         return user_parts
 
+    @staticmethod
+    def _get_db_file_uri(file: "FileAttachmentTD") -> str:
+        """Returns the URI to process for a file attached to a message in the database."""
+        if file.get("type") == "image":
+            return file.get("url", "")
+        elif file.get("type") == "file":
+            # Reconstruct the local API URI to be handled by our unified function
+            return f"/api/v1/files/{file.get('id', '')}/content"
+        return ""
+
+    async def _prefetch_file_models(self, turn_indices: list[int]) -> None:
+        """
+        Loads the database rows of every Open WebUI file attached to the given turns
+        with a single bulk query, instead of one query per file in `_get_file_source`.
+        """
+        if not (self.messages_db and self.upload_documents):
+            return
+
+        file_ids: list[str] = []
+        for i in turn_indices:
+            if self.messages_body[i].get("role") != "user":
+                continue
+            for file in self.messages_db[i].get("files", []):
+                uri = self._get_db_file_uri(file)
+                if uri.startswith("/api/v1/files/"):
+                    file_ids.append(uri.split("/")[4])
+        file_ids = [file_id for file_id in dict.fromkeys(file_ids) if file_id]
+        if not file_ids:
+            return
+
+        try:
+            file_models = await asyncio.to_thread(Files.get_files_by_ids, file_ids)
+        except Exception:
+            log.exception(
+                "Bulk loading of file metadata failed. Falling back to per-file queries."
+            )
+            return
+        self.file_models = {file_model.id: file_model for file_model in file_models}
+        log.debug(
+            f"Prefetched {len(self.file_models)}/{len(file_ids)} file rows from the database."
+        )
+
     async def _process_assistant_message(
         self,
         message: "AssistantMessage",
@@ -967,7 +3461,10 @@ class GeminiContentBuilder:
         return await self._genai_parts_from_text(assistant_text, status_queue)
 
     async def _genai_part_from_uri(
-        self, uri: str, status_queue: asyncio.Queue
+        self,
+        uri: str,
+        status_queue: asyncio.Queue,
+        priority: int = UploadScheduler.PRIORITY_HISTORY,
     ) -> types.Part | None:
         """
         Processes any resource URI and returns a genai.types.Part.
@@ -980,22 +3477,29 @@ class GeminiContentBuilder:
             return None
 
         try:
-            file_bytes: bytes | None = None
+            source: FileSource | None = None
             mime_type: str | None = None
             owui_file_id: str | None = None
+            no_files_api_reason = self._get_no_files_api_reason()
 
-            # Step 1: Extract bytes and mime_type from the URI if applicable
+            # Step 1: Locate the content and mime_type from the URI if applicable
             if uri.startswith("data:image"):
-                match = re.match(r"data:(image/\w+);base64,(.+)", uri)
+                match = DATA_IMAGE_URI_REGEX.match(uri)
                 if not match:
                     raise ValueError("Invalid data URI for image.")
                 mime_type, base64_data = match.group(1), match.group(2)
-                file_bytes = base64.b64decode(base64_data)
+                source = FileSource(data=base64.b64decode(base64_data))
             elif uri.startswith("/api/v1/files/"):
                 log.info(f"Processing local API file URI: {uri}")
                 file_id = uri.split("/")[4]
                 owui_file_id = file_id
-                file_bytes, mime_type = await self._get_file_data(file_id)
+                # Metadata-first: a file that is already known to be ACTIVE in the Files API
+                # is referenced without touching the database, disk or GCS.
+                if not no_files_api_reason and (
+                    gemini_file := await self.files_api_manager.get_known_file(file_id)
+                ):
+                    return self._genai_part_from_gemini_file(gemini_file)
+                source, mime_type = await self._get_file_source(file_id)
             elif "youtube.com/" in uri or "youtu.be/" in uri:
                 log.info(f"Found YouTube URL: {uri}")
                 return self._genai_part_from_youtube_uri(uri)
@@ -1007,59 +3511,73 @@ class GeminiContentBuilder:
                 self.event_emitter.emit_toast(warn_msg, "warning")
                 return None
 
-            # Step 2: If we have bytes, decide how to create the Part
-            if file_bytes and mime_type:
+            # Step 2: If we have a source, decide how to create the Part
+            if source and mime_type:
                 # TODO: The Files API is strict about MIME types (e.g., text/plain,
                 # application/pdf). In the future, inspect the content of files
                 # with unsupported text-like MIME types (e.g., 'application/json',
                 # 'text/markdown'). If the content is detected as plaintext,
                 # override the `mime_type` variable to 'text/plain' to allow the upload.
 
-                # Determine whether to use the Files API based on the specified conditions.
-                use_files_api = True
-                reason = ""
-
-                if not self.valves.USE_FILES_API:
-                    reason = "disabled by user setting (USE_FILES_API=False)"
-                    use_files_api = False
-                elif self.vertexai:
-                    reason = "the active client is configured for Vertex AI, which does not support the Files API"
-                    use_files_api = False
-                elif self.is_temp_chat:
-                    reason = "temporary chat mode is active"
-                    use_files_api = False
-
-                if use_files_api:
+                if not no_files_api_reason:
                     log.info(f"Using Files API for resource from URI: {uri[:64]}...")
                     gemini_file = await self.files_api_manager.get_or_upload_file(
-                        file_bytes=file_bytes,
+                        source=source,
                         mime_type=mime_type,
                         owui_file_id=owui_file_id,
                         status_queue=status_queue,
+                        priority=priority,
                     )
-                    return types.Part(
-                        file_data=types.FileData(
-                            file_uri=gemini_file.uri,
-                            mime_type=gemini_file.mime_type,
-                        )
-                    )
+                    return self._genai_part_from_gemini_file(gemini_file)
                 else:
                     log.info(
-                        f"Sending raw bytes because {reason}. Resource from URI: {uri[:64]}..."
+                        f"Sending raw bytes because {no_files_api_reason}. Resource from URI: {uri[:64]}..."
                     )
+                    file_bytes = await source.read_bytes()
                     return types.Part.from_bytes(data=file_bytes, mime_type=mime_type)
 
-            return None  # Return None if bytes/mime_type could not be determined
+            # Return None if source/mime_type could not be determined
+            self._mark_turn_uncacheable()
+            return None
 
         except FilesAPIError as e:
             error_msg = f"Files API failed for URI '{uri[:64]}...': {e}"
             log.error(error_msg)
             self.event_emitter.emit_toast(error_msg, "error")
+            self._mark_turn_uncacheable()
             return None
         except Exception:
             log.exception(f"Error processing URI: {uri[:64]}[...]")
+            self._mark_turn_uncacheable()
             return None
 
+    def _get_no_files_api_reason(self) -> str:
+        """Returns why the Files API cannot be used for this request, or an empty string if it can."""
+        if not self.valves.USE_FILES_API:
+            return "disabled by user setting (USE_FILES_API=False)"
+        elif self.vertexai:
+            return "the active client is configured for Vertex AI, which does not support the Files API"
+        elif self.is_temp_chat:
+            return "temporary chat mode is active"
+        return ""
+
+    @staticmethod
+    def _genai_part_from_gemini_file(gemini_file: types.File) -> types.Part:
+        if cache_info := _TURN_CACHE_INFO.get():
+            cache_info.add_file_expiration(gemini_file.expiration_time)
+        return types.Part(
+            file_data=types.FileData(
+                file_uri=gemini_file.uri,
+                mime_type=gemini_file.mime_type,
+            )
+        )
+
+    @staticmethod
+    def _mark_turn_uncacheable() -> None:
+        """Prevents the message turn being processed from being stored in the content cache."""
+        if cache_info := _TURN_CACHE_INFO.get():
+            cache_info.cacheable = False
+
     def _genai_part_from_youtube_uri(self, uri: str) -> types.Part | None:
         """Creates a Gemini Part from a YouTube URL, with optional video metadata.
 
@@ -1214,18 +3732,11 @@ class GeminiContentBuilder:
         """
         if not text:
             return ""
+        # Fast path: most messages contain no disabled tag at all.
+        if "<" + ZWS not in text:
+            return text
 
-        # The regex finds '<ZWS' followed by an optional '/' and then one of the special tags.
-        # The inner parentheses group the tags, so the optional '/' applies to all of them.
-        REVERSE_TAG_REGEX = re.compile(
-            r"<"
-            + ZWS
-            + r"(/?"
-            + "("
-            + "|".join(re.escape(tag) for tag in SPECIAL_TAGS_TO_DISABLE)
-            + ")"
-            + r")"
-        )
+        _, REVERSE_TAG_REGEX = _get_special_tag_regexes(tuple(SPECIAL_TAGS_TO_DISABLE))
         # The substitution restores the original tag, e.g., '<ZWS/think' becomes '</think'.
         restored_text, count = REVERSE_TAG_REGEX.subn(r"<\1", text)
         if count > 0:
@@ -1234,7 +3745,10 @@ class GeminiContentBuilder:
         return restored_text
 
     async def _genai_parts_from_text(
-        self, text: str, status_queue: asyncio.Queue
+        self,
+        text: str,
+        status_queue: asyncio.Queue,
+        priority: int = UploadScheduler.PRIORITY_HISTORY,
     ) -> list[types.Part]:
         if not text:
             return []
@@ -1243,20 +3757,16 @@ class GeminiContentBuilder:
         parts: list[types.Part] = []
         last_pos = 0
 
-        # Conditionally build a regex to find media links.
-        # If YouTube parsing is disabled, the regex will only find markdown image links,
-        # leaving YouTube URLs to be treated as plain text.
-        markdown_part = r"!\[.*?\]\(([^)]+)\)"  # Group 1: Markdown URI
-        youtube_part = r"(https?://(?:(?:www|music)\.)?youtube\.com/(?:watch\?v=|shorts/|live/)[^\s)]+|https?://youtu\.be/[^\s)]+)"  # Group 2: YouTube URL
-        if self.valves.PARSE_YOUTUBE_URLS:
-            pattern = re.compile(f"{markdown_part}|{youtube_part}")
-            process_youtube = True
-        else:
-            pattern = re.compile(markdown_part)
-            process_youtube = False
+        process_youtube = bool(self.valves.PARSE_YOUTUBE_URLS)
+        if not process_youtube:
             log.info(
                 "YouTube URL parsing is disabled. URLs will be treated as plain text."
             )
+        # Fast path: skip the regex scan if the text cannot contain any media link.
+        if not _may_contain_media_link(text, process_youtube):
+            stripped_text = text.strip()
+            return [types.Part.from_text(text=stripped_text)] if stripped_text else []
+        pattern = _get_media_link_regex(process_youtube)
 
         for match in pattern.finditer(text):
             # Add the text segment that precedes the media link
@@ -1276,7 +3786,9 @@ class GeminiContentBuilder:
                 continue
 
             # Delegate all URI processing to the unified helper
-            if media_part := await self._genai_part_from_uri(uri, status_queue):
+            if media_part := await self._genai_part_from_uri(
+                uri, status_queue, priority
+            ):
                 parts.append(media_part)
 
             last_pos = match.end()
@@ -1291,20 +3803,27 @@ class GeminiContentBuilder:
 
         return parts
 
-    @staticmethod
-    async def _get_file_data(file_id: str) -> tuple[bytes | None, str | None]:
+    async def _get_file_source(
+        self,
+        file_id: str,
+    ) -> tuple[FileSource | None, str | None]:
         """
-        Asynchronously retrieves file metadata from the database and its content from disk.
+        Asynchronously retrieves file metadata from the database and locates its content
+        on disk or in Google Cloud Storage. Local content is not read here, GCS blobs
+        that fit the GCS cache are downloaded to it first.
         """
         # TODO: Emit toasts on unexpected conditions.
         if not file_id:
             log.warning("file_id is empty. Cannot continue.")
             return None, None
 
-        # Run the synchronous, blocking database call in a separate thread
-        # to avoid blocking the main asyncio event loop.
+        # Use the row loaded by `_prefetch_file_models` if possible. Otherwise run the
+        # synchronous, blocking database call in a separate thread to avoid blocking
+        # the main asyncio event loop.
         try:
-            file_model = await asyncio.to_thread(Files.get_file_by_id, file_id)
+            file_model = self.file_models.get(file_id) or await asyncio.to_thread(
+                Files.get_file_by_id, file_id
+            )
         except Exception as e:
             log.exception(
                 f"An unexpected error occurred during database call for file_id {file_id}: {e}"
@@ -1334,43 +3853,26 @@ class GeminiContentBuilder:
             return None, None
 
         if file_path.startswith("gs://"):
-            try:
-                # Initialize the GCS client
-                storage_client = storage.Client()
-
-                # Parse the GCS path
-                # The path should be in the format "gs://bucket-name/object-name"
-                if len(file_path.split("/", 3)) < 4:
-                    raise ValueError(
-                        f"Invalid GCS path: '{file_path}'. "
-                        "Path must be in the format 'gs://bucket-name/object-name'."
-                    )
-
-                bucket_name, blob_name = file_path.removeprefix("gs://").split("/", 1)
+            # The path should be in the format "gs://bucket-name/object-name"
+            if len(file_path.split("/", 3)) < 4:
+                log.warning(
+                    f"Invalid GCS path: '{file_path}'. "
+                    "Path must be in the format 'gs://bucket-name/object-name'."
+                )
+                return None, content_type
 
-                # Get the bucket and blob (file object)
-                bucket = storage_client.bucket(bucket_name)
-                blob = bucket.blob(blob_name)
+            log.debug(f"File {file_id} is stored in GCS: {file_path}")
+            try:
+                source = await self.gcs_blob_store.get_source(file_path)
+            except Exception:
+                log.exception(f"Failed to read {file_path} from GCS.")
+                return None, content_type
+            return source, content_type
 
-                # Download the file's content as bytes
-                print(f"Reading from GCS: {file_path}")
-                return blob.download_as_bytes(), content_type
-            except exceptions.NotFound:
-                print(f"Error: GCS object not found at {file_path}")
-                raise
-            except Exception as e:
-                print(f"An error occurred while reading from GCS: {e}")
-                raise
-        try:
-            async with aiofiles.open(file_path, "rb") as file:
-                file_data = await file.read()
-            return file_data, content_type
-        except FileNotFoundError:
-            log.exception(f"File {file_path} not found on disk.")
-            return None, content_type
-        except Exception:
-            log.exception(f"Error processing file {file_path}")
+        if not await asyncio.to_thread(os.path.isfile, file_path):
+            log.warning(f"File {file_path} not found on disk.")
             return None, content_type
+        return FileSource(path=file_path), content_type
 
     @staticmethod
     def _remove_citation_markers(text: str, sources: list["Source"]) -> str:
@@ -1496,11 +3998,38 @@ class Pipe:
             Supports `fnmatch` patterns: *, ?, [seq], [!seq].
             Default value is None (no blacklist).""",
         )
+        CLIENT_CACHE_SIZE: int = Field(
+            default=256,
+            ge=1,
+            description="""Maximum number of Google API clients (one per distinct API key or Vertex AI configuration) kept in memory.
+            The least recently used clients are dropped first. Default value is 256.""",
+        )
+        CLIENT_IDLE_TTL: int = Field(
+            default=3600,
+            ge=0,
+            description="""Drop Google API clients that were not used for this many seconds.
+            Default value is 3600.""",
+        )
         CACHE_MODELS: bool = Field(
             default=True,
-            description="""Whether to request models only on first load and when white- or blacklist changes.
+            description="""Whether to cache the model lists returned by Google.
+            Cached lists older than MODELS_CACHE_TTL are still returned immediately and refreshed in the background.
+            If disabled, models are requested every time the model list is loaded.
             Default value is True.""",
         )
+        MODELS_CACHE_TTL: int = Field(
+            default=3600,
+            ge=0,
+            description="""How long (in seconds) a cached model list is considered fresh.
+            Default value is 3600.""",
+        )
+        MODELS_FETCH_TIMEOUT: float = Field(
+            default=10.0,
+            gt=0,
+            description="""When models are listed from both Gemini Developer API and Vertex AI,
+            the maximum time (in seconds) to wait for each source before returning the models of the other one.
+            Default value is 10.0.""",
+        )
         THINKING_BUDGET: int = Field(
             default=8192,
             ge=-1,
@@ -1535,6 +4064,31 @@ class Pipe:
             description="""Regex pattern to identify image generation models.
             Default value is r"image".""",
         )
+        IMAGE_UPLOAD_MAX_CONCURRENCY: int = Field(
+            default=2,
+            ge=1,
+            le=16,
+            description="""Maximum number of generated images stored in the Open WebUI backend at once by this worker.
+            Images are stored in the background while the response keeps streaming. Default value is 2.""",
+        )
+        IMAGE_RECOMPRESS_FORMAT: Literal["none", "webp", "avif"] = Field(
+            default="none",
+            description="""Re-encode generated images into this format before storing them (requires Pillow, AVIF requires Pillow with AVIF support).
+            The original image is kept if the re-encoded one is not smaller or re-encoding fails.
+            Default value is 'none'.""",
+        )
+        IMAGE_RECOMPRESS_QUALITY: int = Field(
+            default=85,
+            ge=1,
+            le=100,
+            description="""Quality used when re-encoding generated images. Default value is 85.""",
+        )
+        IMAGE_MAX_DIMENSION: int = Field(
+            default=0,
+            ge=0,
+            description="""When re-encoding, downscale generated images so that their longer side is at most this many pixels.
+            Set to 0 to keep the original dimensions. Default value is 0.""",
+        )
         # FIXME: remove
         ENABLE_URL_CONTEXT_TOOL: bool = Field(
             default=False,
@@ -1548,6 +4102,125 @@ class Pipe:
             If disabled, files are sent as raw bytes in the request.
             Default value is True.""",
         )
+        FILE_CHUNK_SIZE_MB: int = Field(
+            default=8,
+            ge=1,
+            le=256,
+            description="""Size of the chunks (in MiB) used to hash and upload attachments to the Files API.
+            Files are streamed from disk or GCS chunk by chunk, so this bounds the memory used per file.
+            Default value is 8.""",
+        )
+        CONTEXT_TOKEN_BUDGET: int = Field(
+            default=-1,
+            ge=-1,
+            description="""Maximum number of input tokens sent to the model. If a chat is larger, its oldest messages are
+            left out before their files are uploaded. The token count is estimated locally (see VERIFY_TOKEN_COUNT).
+            The estimate of audio and video files is rough and usually too high, so it can leave out messages that would fit.
+            Set to 0 to use the model's input token limit reported by the API, or -1 to never leave out messages.
+            Default value is -1.""",
+        )
+        VERIFY_TOKEN_COUNT: bool = Field(
+            default=False,
+            description="""When the token budget is enforced, also count the tokens of the kept messages with the API
+            (one cached request per message) and leave out more messages if the estimate was too low.
+            Default value is False.""",
+        )
+        CONTENT_CACHE_TTL: int = Field(
+            default=1800,
+            ge=0,
+            description="""How long (in seconds) converted chat history turns are kept in memory for reuse.
+            Only new or edited messages are converted again on the next request of the same chat.
+            Set to 0 to disable the cache. Default value is 1800.""",
+        )
+        FILES_API_MAX_CONCURRENCY: int = Field(
+            default=4,
+            ge=1,
+            le=64,
+            description="""Maximum number of Files API lookups and uploads in flight at once per API key, shared by all chats of this worker.
+            Files of the newest message are scheduled before files from the chat history, and users are served fairly.
+            Default value is 4.""",
+        )
+        GCS_MAX_CONCURRENT_DOWNLOADS: int = Field(
+            default=4,
+            ge=1,
+            le=64,
+            description="""Maximum number of files downloaded from Google Cloud Storage at once by this worker.
+            Only relevant if Open WebUI stores uploads in GCS. Default value is 4.""",
+        )
+        GCS_CACHE_SIZE_MB: int = Field(
+            default=1024,
+            ge=0,
+            description="""Size (in MiB) of the on-disk cache of files downloaded from Google Cloud Storage.
+            Least recently used files are evicted first, larger files are streamed with range reads instead.
+            Set to 0 to disable the cache. Default value is 1024.""",
+        )
+        GCS_CACHE_DIR: str | None = Field(
+            default=None,
+            description="""Directory of the on-disk GCS cache.
+            Default value is None (`DATA_DIR/cache/gemini_manifold_gcs`).""",
+        )
+        GROUNDING_STORE_TTL: int = Field(
+            default=600,
+            ge=1,
+            description="""How long (in seconds) grounding metadata of a response is kept for the companion filter's outlet.
+            Metadata that is not picked up in time (e.g. because the client disconnected) is dropped.
+            Default value is 600.""",
+        )
+        GROUNDING_STORE_MAX_ENTRIES: int = Field(
+            default=1000,
+            ge=1,
+            description="""Maximum number of responses whose grounding metadata is kept in memory at once.
+            Default value is 1000.""",
+        )
+        GROUNDING_STORE_REDIS_URL: str | None = Field(
+            default=None,
+            description="""Optional Redis URL used to hand grounding metadata over to the companion filter
+            when the outlet may run on a different worker than the pipe (requires the `redis` package).
+            Set the same URL in the companion filter. Default value is None.""",
+        )
+        ENABLE_CONTEXT_CACHING: bool = Field(
+            default=False,
+            description="""Cache the stable prefix of chats (system prompt, earlier turns and files) as Gemini cached contents
+            and reuse it on the following turns. Cached tokens are billed at a reduced rate, but storing them is billed per hour.
+            Models that do not support context caching fall back to normal requests. Default value is False.""",
+        )
+        CONTEXT_CACHE_TTL: int = Field(
+            default=3600,
+            ge=60,
+            description="""How long (in seconds) a context cache is kept after it was created or last extended.
+            Default value is 3600.""",
+        )
+        CONTEXT_CACHE_MIN_TOKENS: int = Field(
+            default=4096,
+            ge=1,
+            description="""Minimum (estimated) number of not yet cached tokens for creating a new context cache.
+            Gemini rejects caches below 1024-4096 tokens depending on the model. Default value is 4096.""",
+        )
+        CONTEXT_CACHE_MAX_ENTRIES: int = Field(
+            default=100,
+            ge=1,
+            description="""Maximum number of context caches tracked by each worker. The least recently used ones are deleted.
+            Default value is 100.""",
+        )
+        FILES_INDEX_BACKEND: Literal["memory", "sqlite", "redis"] = Field(
+            default="sqlite",
+            description="""Where to persist the Files API index (`file id -> content hash -> uploaded file`).
+            A persistent index is shared by all workers and survives restarts, so known files are served without any Google API call.
+            'memory' keeps the index only inside the worker process.
+            'sqlite' stores it in a local database file (see FILES_INDEX_SQLITE_PATH).
+            'redis' stores it in a Redis-compatible server (see FILES_INDEX_REDIS_URL), requires the `redis` package.
+            Default value is 'sqlite'.""",
+        )
+        FILES_INDEX_SQLITE_PATH: str | None = Field(
+            default=None,
+            description="""Path of the SQLite database used when FILES_INDEX_BACKEND is 'sqlite'.
+            Default value is None (`gemini_manifold_files_index.sqlite3` inside Open WebUI's data directory).""",
+        )
+        FILES_INDEX_REDIS_URL: str | None = Field(
+            default=None,
+            description="""Redis URL used when FILES_INDEX_BACKEND is 'redis' (e.g. 'redis://localhost:6379/0').
+            Default value is None.""",
+        )
         PARSE_YOUTUBE_URLS: bool = Field(
             default=True,
             description="""Whether to parse YouTube URLs from user messages and provide them as context to the model.
@@ -1571,6 +4244,21 @@ class Pipe:
             Error messages will always be shown.
             Default value is False.""",
         )
+        STREAM_COALESCE_MS: int = Field(
+            default=0,
+            ge=0,
+            le=1000,
+            description="""Batch consecutive streamed text deltas for up to this many milliseconds before sending them to Open WebUI.
+            Reduces the number of tiny deltas (and the CPU spent on them by the backend and the browser) with fast models.
+            The first delta of the response and of the thinking summary are always sent immediately.
+            Set to 0 to send every delta as soon as it arrives. Default value is 0.""",
+        )
+        STREAM_COALESCE_MAX_CHARS: int = Field(
+            default=2048,
+            ge=1,
+            description="""Send batched text deltas as soon as they reach this many characters, regardless of STREAM_COALESCE_MS.
+            Default value is 2048.""",
+        )
         LOG_LEVEL: Literal[
             "TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL"
         ] = Field(
@@ -1578,12 +4266,22 @@ class Pipe:
             description="""Select logging level. Use `docker logs -f open-webui` to view logs.
             Default value is INFO.""",
         )
+        LOG_ENQUEUE: bool = Field(
+            default=False,
+            description="""Write the plugin's logs to stdout from a background thread so that slow log output never blocks the event loop.
+            Messages are dropped if the writer falls too far behind. Default value is False.""",
+        )
 
         @field_validator("MAPS_GROUNDING_COORDINATES", mode="after")
         @classmethod
         def validate_coordinates_format(cls, v: str | None):
             return Pipe._validate_coordinates_format(v)
 
+    class MergedValves(Valves):
+        """Read-only `Valves` of a single request, see `_get_merged_valves`."""
+
+        model_config = ConfigDict(frozen=True)
+
     class UserValves(BaseModel):
         """Defines user-specific settings that can override the default `Valves`.
 
@@ -1722,21 +4420,48 @@ class Pipe:
         self.valves = self.Valves()
         self.file_content_cache = SimpleMemoryCache(serializer=NullSerializer())
         self.file_id_to_hash_cache = SimpleMemoryCache(serializer=NullSerializer())
+        self.content_cache = SimpleMemoryCache(serializer=NullSerializer())
+        self.files_api_stats = FilesAPIStats()
+        self._files_index: FilesIndex | None = None
+        self._files_index_config: tuple[str, str | None] | None = None
+        # API key hash -> scheduler shared by every request using that key.
+        self._upload_schedulers: dict[str, UploadScheduler] = {}
+        self._gcs_blob_store: GCSBlobStore | None = None
+        self.genai_clients = GenaiClientRegistry(
+            self.valves.CLIENT_CACHE_SIZE, self.valves.CLIENT_IDLE_TTL
+        )
+        # (source name, client args) -> (fetch time, raw models), see `_get_source_models`.
+        self._source_models_cache: dict[tuple, tuple[float, list[types.Model]]] = {}
+        self._source_models_refreshes: dict[tuple, asyncio.Task] = {}
+        self._grounding_store: GroundingStore | None = None
+        self._context_cache_manager: ContextCacheManager | None = None
+        self._model_capabilities: ModelCapabilityRegistry | None = None
+        self._image_upload_semaphore: asyncio.Semaphore | None = None
+        self._image_upload_limit = 0
+        # (expiry time, toggle filters by ID), see `_get_toggle_filter_functions`.
+        self._toggle_filters_cache: tuple[float, dict[str, FunctionModel]] | None = None
+        self._merged_valves_cache: collections.OrderedDict[
+            tuple, Pipe.MergedValves
+        ] = collections.OrderedDict()
         log.success("Function has been initialized.")
 
+    @property
+    def valves(self) -> "Pipe.Valves":
+        return self._valves
+
+    @valves.setter
+    def valves(self, valves: "Pipe.Valves") -> None:
+        # Open WebUI assigns freshly loaded valves before every request,
+        # this is where the logging setup picks up a changed LOG_LEVEL.
+        self._valves = valves
+        PLUGIN_LOGGING.configure(valves.LOG_LEVEL, valves.LOG_ENQUEUE)
+
     async def pipes(self) -> list["ModelData"]:
         """Register all available Google models."""
-        self._add_log_handler(self.valves.LOG_LEVEL)
         log.debug("pipes method has been called.")
 
-        # Clear cache if caching is disabled
-        if not self.valves.CACHE_MODELS:
-            log.debug("CACHE_MODELS is False, clearing model cache.")
-            cache_instance = getattr(self._get_genai_models, "cache")
-            await cast(BaseCache, cache_instance).clear()
-
         log.info("Fetching and filtering models from Google API.")
-        # Get and filter models (potentially cached based on API key, base URL, white- and blacklist)
+        # Get and filter models (raw model lists are cached per source unless CACHE_MODELS is False)
         try:
             client_args = self._prepare_client_args(self.valves)
             client_args += [self.valves.MODEL_WHITELIST, self.valves.MODEL_BLACKLIST]
@@ -1761,7 +4486,6 @@ class Pipe:
     ) -> AsyncGenerator[dict, None] | str:
 
         start_time = time.monotonic()
-        self._add_log_handler(self.valves.LOG_LEVEL)
 
         log.debug(
             f"pipe method has been called. Gemini Manifold google_genai version is {VERSION}"
@@ -1773,21 +4497,32 @@ class Pipe:
         self._check_companion_filter_version(features)
 
         # Apply settings from the user
-        valves: Pipe.Valves = self._get_merged_valves(
+        valves: Pipe.MergedValves = self._get_merged_valves(
             self.valves, __user__.get("valves"), __user__.get("email")
         )
 
         model_name = re.sub(r"^.*?[./]", "", body.get("model", ""))
-        is_image_model = self._is_image_model(model_name, valves.IMAGE_MODEL_PATTERN)
+        capabilities = self._get_model_capabilities(model_name, valves)
+        is_image_model = ModelCapability.IMAGE_OUTPUT in capabilities
+        # Published on the shared `app.state` for the companion filter's `inlet`.
+        setattr(
+            __request__.app.state,
+            ModelCapabilityRegistry.APP_STATE_ATTR,
+            self._get_model_capability_registry(),
+        )
 
         if is_image_model and valves.IMAGE_GEN_GEMINI_API_KEY:
             log.info("Using separate API key for image generation model.")
-            valves.GEMINI_API_KEY = valves.IMAGE_GEN_GEMINI_API_KEY
-
-            # When using a separate key, assume it's for Gemini API, not Vertex AI
-            # TODO: check if it would work for Vertex AI as well
-            valves.USE_VERTEX_AI = False
-            valves.VERTEX_PROJECT = None
+            # The merged valves are shared between requests, so they are copied, not mutated.
+            valves = valves.model_copy(
+                update={
+                    "GEMINI_API_KEY": valves.IMAGE_GEN_GEMINI_API_KEY,
+                    # When using a separate key, assume it's for Gemini API, not Vertex AI
+                    # TODO: check if it would work for Vertex AI as well
+                    "USE_VERTEX_AI": False,
+                    "VERTEX_PROJECT": None,
+                }
+            )
 
         log.debug(
             f"USE_VERTEX_AI: {valves.USE_VERTEX_AI}, VERTEX_PROJECT set: {bool(valves.VERTEX_PROJECT)}, API_KEY set: {bool(valves.GEMINI_API_KEY)}"
@@ -1797,7 +4532,13 @@ class Pipe:
             f"Getting genai client (potentially cached) for user {__user__['email']}."
         )
         client = self._get_user_client(valves, __user__["email"])
+        client_args = self._prepare_client_args(valves)
+        # Identifies the credentials in shared caches without keeping the API key around.
+        auth_key = xxhash.xxh64(repr(client_args)).hexdigest()
         __metadata__["is_vertex_ai"] = client.vertexai
+        log.debug(
+            "Genai client registry statistics:", payload=self.genai_clients.snapshot
+        )
 
         if __metadata__.get("task"):
             log.info(f'{__metadata__["task"]=}, disabling event emissions.') # type: ignore
@@ -1814,6 +4555,12 @@ class Pipe:
             file_cache=self.file_content_cache,
             id_hash_cache=self.file_id_to_hash_cache,
             event_emitter=event_emitter,
+            files_index=self._get_files_index(),
+            stats=self.files_api_stats,
+            chunk_size=valves.FILE_CHUNK_SIZE_MB * 1024 * 1024,
+            scheduler=self._get_upload_scheduler(valves),
+            user_id=__user__["id"],
+            auth_key=auth_key,
         )
 
         # Check if user is chatting with an error model for some reason.
@@ -1836,16 +4583,27 @@ class Pipe:
             event_emitter=event_emitter,
             valves=valves,
             files_api_manager=files_api_manager,
+            gcs_blob_store=self._get_gcs_blob_store(),
+            content_cache=self.content_cache,
+            model_name=model_name,
+            token_budget=self._get_token_budget(valves, model_name),
+            digest_contents=self.valves.ENABLE_CONTEXT_CACHING,
         )
         # This is our first timed event, marking the start of payload preparation.
         asyncio.create_task(event_emitter.emit_status("Preparing request..."))
         contents = await builder.build_contents(start_time=start_time)
+        log.debug(
+            "Files API cache statistics for this worker:",
+            payload=self.files_api_stats.snapshot,
+        )
 
-        gen_content_conf = self._build_gen_content_config(body, __metadata__, valves)
+        gen_content_conf = await self._build_gen_content_config(
+            body, __metadata__, valves
+        )
         gen_content_conf.system_instruction = builder.system_prompt
 
         # Some models (e.g., image generation, Gemma) do not support the system prompt message.
-        system_prompt_unsupported = is_image_model or "gemma" in model_name
+        system_prompt_unsupported = ModelCapability.SYSTEM_PROMPT not in capabilities
         if system_prompt_unsupported:
             # TODO: append to user message instead.
             if gen_content_conf.system_instruction:
@@ -1861,6 +4619,20 @@ class Pipe:
         }
         log.debug("Passing these args to the Google API:", payload=gen_content_args)
 
+        # With context caching, the request may only carry the contents after a cached prefix.
+        request_args, cached_prefix = gen_content_args, None
+        if context_cache := self._get_context_cache_manager():
+            request_args, cached_prefix = context_cache.apply(
+                lambda: self._get_or_create_genai_client(*client_args),
+                auth_key,
+                gen_content_args,
+                builder.content_digests,
+            )
+            log.debug(
+                "Context cache statistics for this worker:",
+                payload=context_cache.snapshot,
+            )
+
         # Both streaming and non-streaming responses are now handled by the same
         # unified processor, which returns an AsyncGenerator. For non-streaming,
         # we adapt the single response object into a one-item async generator.
@@ -1877,9 +4649,14 @@ class Pipe:
 
         if is_streaming:
             # Streaming response
-            response_stream: AsyncIterator[types.GenerateContentResponse] = (
-                await client.aio.models.generate_content_stream(**gen_content_args)  # type: ignore
-            )
+            if context_cache and cached_prefix:
+                response_stream = self._generate_content_stream_with_cache(
+                    client, request_args, gen_content_args, context_cache, cached_prefix
+                )
+            else:
+                response_stream: AsyncIterator[types.GenerateContentResponse] = (
+                    await client.aio.models.generate_content_stream(**gen_content_args)  # type: ignore
+                )
 
             log.info(
                 "Streaming enabled. Returning AsyncGenerator from unified processor."
@@ -1889,15 +4666,31 @@ class Pipe:
                 response_stream,
                 __request__,
                 model_name,
+                valves,
                 event_emitter,
                 __user__["id"],
                 chat_id,
                 message_id,
                 start_time=start_time,
+                coalesce_delay=valves.STREAM_COALESCE_MS / 1000,
+                coalesce_max_chars=valves.STREAM_COALESCE_MAX_CHARS,
             )
         else:
             # Non-streaming response.
-            res = await client.aio.models.generate_content(**gen_content_args)
+            try:
+                res = await client.aio.models.generate_content(**request_args)
+            except genai_errors.APIError as e:
+                if not (
+                    context_cache
+                    and cached_prefix
+                    and context_cache.is_cache_error(e, cached_prefix)
+                ):
+                    raise
+                log.warning(
+                    f"Context cache {cached_prefix.name} was rejected, retrying without it: {e}"
+                )
+                context_cache.discard(cached_prefix)
+                res = await client.aio.models.generate_content(**gen_content_args)
 
             # Adapter: Create a simple, one-shot async generator that yields the
             # single response object, making it behave like a stream.
@@ -1915,6 +4708,7 @@ class Pipe:
                 single_item_stream(res),
                 __request__,
                 model_name,
+                valves,
                 event_emitter,
                 __user__["id"],
                 chat_id,
@@ -1925,9 +4719,42 @@ class Pipe:
     # region 2. Helper methods inside the Pipe class
 
     # region 2.1 Client initialization
-    @staticmethod
-    @cache
     def _get_or_create_genai_client(
+        self,
+        api_key: str | None = None,
+        base_url: str | None = None,
+        use_vertex_ai: bool | None = None,
+        vertex_project: str | None = None,
+        vertex_location: str | None = None,
+    ) -> genai.Client:
+        """
+        Creates a genai.Client instance or retrieves it from the client registry.
+        Raises GenaiApiError on failure.
+        """
+        self.genai_clients.configure(
+            self.valves.CLIENT_CACHE_SIZE, self.valves.CLIENT_IDLE_TTL
+        )
+        # Only a hash of the key is kept around as part of the registry key.
+        key = (
+            xxhash.xxh64((api_key or "").encode()).hexdigest(),
+            base_url,
+            use_vertex_ai,
+            vertex_project,
+            vertex_location,
+        )
+        return self.genai_clients.get_or_create(
+            key,
+            lambda: self._create_genai_client(
+                api_key=api_key,
+                base_url=base_url,
+                use_vertex_ai=use_vertex_ai,
+                vertex_project=vertex_project,
+                vertex_location=vertex_location,
+            ),
+        )
+
+    @staticmethod
+    def _create_genai_client(
         api_key: str | None = None,
         base_url: str | None = None,
         use_vertex_ai: bool | None = None,
@@ -1935,7 +4762,7 @@ class Pipe:
         vertex_location: str | None = None,
     ) -> genai.Client:
         """
-        Creates a genai.Client instance or retrieves it from cache.
+        Creates a genai.Client instance.
         Raises GenaiApiError on failure.
         """
 
@@ -1973,9 +4800,7 @@ class Pipe:
             raise GenaiApiError(f"{api} Genai client initialization failed: {e}") from e
 
     def _get_user_client(self, valves: "Pipe.Valves", user_email: str) -> genai.Client:
-        user_whitelist = (
-            valves.AUTH_WHITELIST.split(",") if valves.AUTH_WHITELIST else []
-        )
+        user_whitelist = _parse_auth_whitelist(valves.AUTH_WHITELIST)
         log.debug(
             f"User whitelist: {user_whitelist}, user email: {user_email}, "
             f"USER_MUST_PROVIDE_AUTH_CONFIG: {valves.USER_MUST_PROVIDE_AUTH_CONFIG}"
@@ -2010,10 +4835,120 @@ class Pipe:
         ]
         return [getattr(source_valves, attr) for attr in ATTRS]
 
+    def _get_files_index(self) -> FilesIndex | None:
+        """
+        Returns the persistent Files API index configured in the admin valves.
+        The index is created once and only re-created when the configuration changes.
+        Returns None if the index is disabled or could not be opened.
+        """
+        backend = self.valves.FILES_INDEX_BACKEND
+        if backend == "sqlite":
+            location = self.valves.FILES_INDEX_SQLITE_PATH or str(
+                DATA_DIR / "gemini_manifold_files_index.sqlite3"
+            )
+        elif backend == "redis":
+            location = self.valves.FILES_INDEX_REDIS_URL
+        else:
+            location = None
+
+        config = (backend, location)
+        if config == self._files_index_config:
+            return self._files_index
+
+        self._files_index_config = config
+        self._files_index = None
+        try:
+            if backend == "sqlite" and location:
+                self._files_index = SQLiteFilesIndex(location)
+            elif backend == "redis":
+                if not location:
+                    raise ValueError("FILES_INDEX_REDIS_URL is not set.")
+                self._files_index = RedisFilesIndex(location)
+        except Exception:
+            log.exception(
+                f"Failed to open the '{backend}' Files API index. "
+                "Falling back to the in-memory caches only."
+            )
+        return self._files_index
+
+    def _get_upload_scheduler(self, valves: "Pipe.Valves") -> UploadScheduler:
+        """Returns the process-wide Files API scheduler for the API key in `valves`."""
+        # Only a hash of the key is kept around as the registry key.
+        key = xxhash.xxh64((valves.GEMINI_API_KEY or "").encode()).hexdigest()
+        max_in_flight = self.valves.FILES_API_MAX_CONCURRENCY
+        if scheduler := self._upload_schedulers.get(key):
+            scheduler.set_max_in_flight(max_in_flight)
+        else:
+            scheduler = self._upload_schedulers[key] = UploadScheduler(max_in_flight)
+        return scheduler
+
+    def _get_gcs_blob_store(self) -> GCSBlobStore:
+        """Returns the process-wide GCS blob store, applying the current admin valves."""
+        max_cache_bytes = self.valves.GCS_CACHE_SIZE_MB * 1024 * 1024
+        max_concurrency = self.valves.GCS_MAX_CONCURRENT_DOWNLOADS
+        cache_dir = self.valves.GCS_CACHE_DIR or str(
+            DATA_DIR / "cache" / "gemini_manifold_gcs"
+        )
+        if self._gcs_blob_store and self._gcs_blob_store.cache_dir == cache_dir:
+            self._gcs_blob_store.configure(max_cache_bytes, max_concurrency)
+        else:
+            self._gcs_blob_store = GCSBlobStore(
+                cache_dir, max_cache_bytes, max_concurrency
+            )
+        return self._gcs_blob_store
+
+    def _get_token_budget(self, valves: "Pipe.Valves", model_name: str) -> int | None:
+        """
+        Returns the input token budget of a request from CONTEXT_TOKEN_BUDGET, falling back
+        to the input token limit of the model from the cached model list. None if there is none.
+        """
+        if valves.CONTEXT_TOKEN_BUDGET > 0:
+            return valves.CONTEXT_TOKEN_BUDGET
+        if valves.CONTEXT_TOKEN_BUDGET < 0:
+            return None
+        for _, models in self._source_models_cache.values():
+            for model in models:
+                if model.name and self.strip_prefix(model.name) == model_name:
+                    return model.input_token_limit
+        return None
+
+    def _get_context_cache_manager(self) -> ContextCacheManager | None:
+        """Returns the context cache manager, or None if context caching is disabled."""
+        if not self.valves.ENABLE_CONTEXT_CACHING:
+            return None
+        ttl = self.valves.CONTEXT_CACHE_TTL
+        max_entries = self.valves.CONTEXT_CACHE_MAX_ENTRIES
+        min_tokens = self.valves.CONTEXT_CACHE_MIN_TOKENS
+        if self._context_cache_manager:
+            self._context_cache_manager.configure(ttl, max_entries, min_tokens)
+        else:
+            self._context_cache_manager = ContextCacheManager(
+                ttl, max_entries, min_tokens
+            )
+        return self._context_cache_manager
+
+    def _get_model_capability_registry(self) -> ModelCapabilityRegistry:
+        """Returns the model capability registry, applying the current model patterns."""
+        thinking_pattern = self.valves.THINKING_MODEL_PATTERN
+        image_pattern = self.valves.IMAGE_MODEL_PATTERN
+        if self._model_capabilities:
+            self._model_capabilities.configure(thinking_pattern, image_pattern)
+        else:
+            self._model_capabilities = ModelCapabilityRegistry(
+                thinking_pattern, image_pattern
+            )
+        return self._model_capabilities
+
+    def _get_model_capabilities(
+        self, model_name: str, valves: "Pipe.Valves"
+    ) -> ModelCapability:
+        return self._get_model_capability_registry().get(
+            model_name, valves.THINKING_MODEL_PATTERN, valves.IMAGE_MODEL_PATTERN
+        )
+
     # endregion 2.1 Client initialization
 
     # region 2.2 Model retrival from Google API
-    @cached()  # aiocache.cached for async method
     async def _get_genai_models(
         self,
         api_key: str | None,
@@ -2027,7 +4962,8 @@ class Pipe:
         """
         Gets valid Google models from API(s) and filters them.
         If use_vertex_ai, vertex_project, and api_key are all provided,
-        models are fetched from both Vertex AI and Gemini Developer API and merged.
+        models are fetched concurrently from both Vertex AI and Gemini Developer API and merged.
+        The raw model list of each source is cached separately, see `_get_source_models`.
         """
         all_raw_models: list[types.Model] = []
 
@@ -2038,55 +4974,35 @@ class Pipe:
             log.info(
                 "Attempting to fetch models from both Gemini Developer API and Vertex AI."
             )
-            gemini_models_list: list[types.Model] = []
-            vertex_models_list: list[types.Model] = []
-
-            # TODO: perf, consider parallelizing these two fetches
-            # 1. Fetch from Gemini Developer API
-            try:
-                gemini_client = self._get_or_create_genai_client(
-                    api_key=api_key,
-                    base_url=base_url,
-                    use_vertex_ai=False,  # Explicitly target Gemini API
-                    vertex_project=None,
-                    vertex_location=None,
-                )
-                gemini_models_list = await self._fetch_models_from_client_internal(
-                    gemini_client, "Gemini Developer API"
-                )
-            except GenaiApiError as e:
-                log.warning(
-                    f"Failed to initialize or retrieve models from Gemini Developer API: {e}"
-                )
-            except Exception as e:
-                log.warning(
-                    f"An unexpected error occurred with Gemini Developer API models: {e}",
-                    exc_info=True,
-                )
-
-            # 2. Fetch from Vertex AI
-            try:
-                vertex_client = self._get_or_create_genai_client(
-                    use_vertex_ai=True,  # Explicitly target Vertex AI
-                    vertex_project=vertex_project,
-                    vertex_location=vertex_location,
-                    api_key=None,  # API key is not used for Vertex AI with project auth
-                    base_url=base_url,  # Pass base_url for potential Vertex custom endpoints
-                )
-                vertex_models_list = await self._fetch_models_from_client_internal(
-                    vertex_client, "Vertex AI"
-                )
-            except GenaiApiError as e:
-                log.warning(
-                    f"Failed to initialize or retrieve models from Vertex AI: {e}"
-                )
-            except Exception as e:
-                log.warning(
-                    f"An unexpected error occurred with Vertex AI models: {e}",
-                    exc_info=True,
-                )
+            # Each source is fetched, cached and timed out on its own,
+            # so a failing or slow source does not hold back the other one.
+            timeout = self.valves.MODELS_FETCH_TIMEOUT
+            gemini_models_list, vertex_models_list = await asyncio.gather(
+                self._get_source_models(
+                    "Gemini Developer API",
+                    dict(
+                        api_key=api_key,
+                        base_url=base_url,
+                        use_vertex_ai=False,  # Explicitly target Gemini API
+                        vertex_project=None,
+                        vertex_location=None,
+                    ),
+                    timeout=timeout,
+                ),
+                self._get_source_models(
+                    "Vertex AI",
+                    dict(
+                        use_vertex_ai=True,  # Explicitly target Vertex AI
+                        vertex_project=vertex_project,
+                        vertex_location=vertex_location,
+                        api_key=None,  # API key is not used for Vertex AI with project auth
+                        base_url=base_url,  # Pass base_url for potential Vertex custom endpoints
+                    ),
+                    timeout=timeout,
+                ),
+            )
 
-            # 3. Combine and de-duplicate
+            # Combine and de-duplicate
             # Prioritize models from Gemini Developer API in case of ID collision
             combined_models_dict: dict[str, types.Model] = {}
 
@@ -2144,8 +5060,9 @@ class Pipe:
                 f"Attempting to fetch models from a single source: {client_source_name}."
             )
 
-            try:
-                client = self._get_or_create_genai_client(
+            all_raw_models = await self._get_source_models(
+                client_source_name,
+                dict(
                     api_key=api_key,
                     base_url=base_url,
                     use_vertex_ai=client_target_is_vertex,  # Pass the determined target
@@ -2153,28 +5070,12 @@ class Pipe:
                     vertex_location=(
                         vertex_location if client_target_is_vertex else None
                     ),
-                )
-                all_raw_models = await self._fetch_models_from_client_internal(
-                    client, client_source_name
-                )
-
-                if not all_raw_models:
-                    raise GenaiApiError(
-                        f"No models retrieved from {client_source_name}. This could be due to an API error, network issue, or no models being available."
-                    )
-
-            except GenaiApiError as e:
+                ),
+            )
+            if not all_raw_models:
                 raise GenaiApiError(
-                    f"Failed to get models from {client_source_name}: {e}"
-                ) from e
-            except Exception as e:
-                log.error(
-                    f"An unexpected error occurred while configuring client or fetching models from {client_source_name}: {e}",
-                    exc_info=True,
+                    f"No models retrieved from {client_source_name}. This could be due to an API error, network issue, or no models being available."
                 )
-                raise GenaiApiError(
-                    f"An unexpected error occurred while retrieving models from {client_source_name}: {e}"
-                ) from e
 
         # --- Common processing for all_raw_models ---
 
@@ -2253,7 +5154,80 @@ class Pipe:
         )
         return filtered_models_data
 
-    # TODO: Use cache for this method too?
+    async def _get_source_models(
+        self,
+        source_name: str,
+        client_kwargs: dict[str, Any],
+        timeout: float | None = None,
+    ) -> list[types.Model]:
+        """
+        Returns the raw model list of one source from the stale-while-revalidate cache.
+
+        Fresh entries are returned as is. Entries older than `MODELS_CACHE_TTL` are returned
+        immediately while a background task refreshes them. Without an entry (or with
+        `CACHE_MODELS` disabled) the list is fetched, waiting at most `timeout` seconds;
+        a fetch that times out keeps running and fills the cache for the next call.
+        A failed fetch never replaces a previously fetched list. Returns an empty list
+        if nothing is available.
+        """
+        key = (source_name, *sorted(client_kwargs.items()))
+        entry = self._source_models_cache.get(key)
+        if entry and self.valves.CACHE_MODELS:
+            fetched_at, models = entry
+            if time.monotonic() - fetched_at >= self.valves.MODELS_CACHE_TTL:
+                log.debug(f"Model list of {source_name} is stale, refreshing it in the background.")
+                self._refresh_source_models(key, source_name, client_kwargs)
+            return models
+
+        refresh = self._refresh_source_models(key, source_name, client_kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.shield(refresh), timeout)
+        except asyncio.TimeoutError:
+            log.warning(
+                f"Retrieving models from {source_name} did not finish within {timeout}s. "
+                "Continuing without them, they will be listed once the request completes."
+            )
+        return entry[1] if entry else []
+
+    def _refresh_source_models(
+        self, key: tuple, source_name: str, client_kwargs: dict[str, Any]
+    ) -> asyncio.Task[list[types.Model]]:
+        """Starts fetching the model list of a source, or returns the fetch already in progress."""
+        if task := self._source_models_refreshes.get(key):
+            return task
+
+        async def refresh() -> list[types.Model]:
+            try:
+                client = self._get_or_create_genai_client(**client_kwargs)
+                models = await self._fetch_models_from_client_internal(
+                    client, source_name
+                )
+            except GenaiApiError as e:
+                log.warning(
+                    f"Failed to initialize or retrieve models from {source_name}: {e}"
+                )
+                models = []
+            except Exception as e:
+                log.warning(
+                    f"An unexpected error occurred with {source_name} models: {e}",
+                    exc_info=True,
+                )
+                models = []
+            if models:
+                self._source_models_cache[key] = (time.monotonic(), models)
+                self._get_model_capability_registry().update(models)
+            elif entry := self._source_models_cache.get(key):
+                log.warning(
+                    f"Keeping the previously retrieved model list of {source_name}."
+                )
+                models = entry[1]
+            return models
+
+        task = asyncio.create_task(refresh())
+        self._source_models_refreshes[key] = task
+        task.add_done_callback(lambda _: self._source_models_refreshes.pop(key, None))
+        return task
+
     async def _fetch_models_from_client_internal(
         self, client: genai.Client, source_name: str
     ) -> list[types.Model]:
@@ -2300,15 +5274,11 @@ class Pipe:
         stripped = re.sub(r"^(?:.*/|[^.]*\.)", "", model_name)
         return stripped
 
-    @staticmethod
-    def _is_image_model(model_name: str, pattern: str) -> bool:
-        return bool(re.search(pattern, model_name, re.IGNORECASE))
-
     # endregion 2.2 Model retrival from Google API
 
     # region 2.3 GenerateContentConfig assembly
 
-    def _build_gen_content_config(
+    async def _build_gen_content_config(
         self,
         body: "Body",
         __metadata__: "Metadata",
@@ -2329,12 +5299,11 @@ class Pipe:
         )
 
         thinking_conf = None
-        # Use the user-configurable regex to determine if this is a thinking model.
-        is_thinking_model = re.search(
-            valves.THINKING_MODEL_PATTERN, model_name, re.IGNORECASE
-        )
+        # Classified with the user-configurable THINKING_MODEL_PATTERN regex.
+        capabilities = self._get_model_capabilities(model_name, valves)
+        is_thinking_model = ModelCapability.THINKING in capabilities
         log.debug(
-            f"Model '{model_name}' is classified as a reasoning model: {bool(is_thinking_model)}. "
+            f"Model '{model_name}' is classified as a reasoning model: {is_thinking_model}. "
             f"Pattern: '{valves.THINKING_MODEL_PATTERN}'"
         )
 
@@ -2347,7 +5316,7 @@ class Pipe:
             )
 
             # Check if reasoning can be disabled. This happens if the toggle is available but turned OFF by the user.
-            is_avail, is_on = self._get_toggleable_feature_status(
+            is_avail, is_on = await self._get_toggleable_feature_status(
                 "gemini_reasoning_toggle", __metadata__
             )
             if is_avail and not is_on:
@@ -2373,7 +5342,7 @@ class Pipe:
         )
 
         gen_content_conf.response_modalities = ["TEXT"]
-        if self._is_image_model(model_name, valves.IMAGE_MODEL_PATTERN):
+        if ModelCapability.IMAGE_OUTPUT in capabilities:
             gen_content_conf.response_modalities.append("IMAGE")
 
         gen_content_conf.tools = []
@@ -2407,7 +5376,7 @@ class Pipe:
             )
 
         # Determine if URL context tool should be enabled.
-        is_avail, is_on = self._get_toggleable_feature_status(
+        is_avail, is_on = await self._get_toggleable_feature_status(
             "gemini_url_context_toggle", __metadata__
         )
         enable_url_context = valves.ENABLE_URL_CONTEXT_TOOL  # Start with valve default.
@@ -2416,7 +5385,7 @@ class Pipe:
             enable_url_context = is_on
 
         if enable_url_context:
-            if model_name in COMPATIBLE_MODELS_FOR_URL_CONTEXT:
+            if ModelCapability.URL_CONTEXT in capabilities:
                 if is_vertex_ai and (len(gen_content_conf.tools) > 0):
                     log.warning(
                         "URL context tool is enabled, but Vertex AI is used with other tools. Skipping."
@@ -2434,7 +5403,7 @@ class Pipe:
                 )
 
         # Determine if Google Maps grounding should be enabled.
-        is_avail, is_on = self._get_toggleable_feature_status(
+        is_avail, is_on = await self._get_toggleable_feature_status(
             "gemini_maps_grounding_toggle", __metadata__
         )
         if is_avail and is_on:
@@ -2478,16 +5447,52 @@ class Pipe:
     # endregion 2.3 GenerateContentConfig assembly
 
     # region 2.4 Model response processing
+    async def _generate_content_stream_with_cache(
+        self,
+        client: genai.Client,
+        request_args: dict[str, Any],
+        gen_content_args: dict[str, Any],
+        context_cache: ContextCacheManager,
+        cached_prefix: _CachedPrefix,
+    ) -> AsyncIterator[types.GenerateContentResponse]:
+        """
+        Streams a response that uses a context cache. If the API rejects the cache
+        before the first chunk (e.g. it was deleted), the full request is streamed instead.
+        """
+        try:
+            response_stream = await client.aio.models.generate_content_stream(
+                **request_args
+            )
+            first_chunk = await anext(aiter(response_stream), None)
+        except genai_errors.APIError as e:
+            if not context_cache.is_cache_error(e, cached_prefix):
+                raise
+            log.warning(
+                f"Context cache {cached_prefix.name} was rejected, retrying without it: {e}"
+            )
+            context_cache.discard(cached_prefix)
+            response_stream = await client.aio.models.generate_content_stream(
+                **gen_content_args
+            )
+            first_chunk = None
+        if first_chunk is not None:
+            yield first_chunk
+        async for chunk in response_stream:
+            yield chunk
+
     async def _unified_response_processor(
         self,
         response_stream: AsyncIterator[types.GenerateContentResponse],
         __request__: Request,
         model: str,
+        valves: "Pipe.Valves",
         event_emitter: EventEmitter,
         user_id: str,
         chat_id: str,
         message_id: str,
         start_time: float,
+        coalesce_delay: float = 0,
+        coalesce_max_chars: int = 2048,
     ) -> AsyncGenerator[dict, None]:
         """
         Processes an async iterator of GenerateContentResponse objects, yielding
@@ -2497,14 +5502,22 @@ class Pipe:
         responses, eliminating code duplication. It processes all parts within each
         response chunk, counts tag substitutions for a final toast notification,
         and handles post-processing in a finally block.
+
+        If `coalesce_delay` (in seconds) is positive, consecutive text deltas are
+        batched by `_coalesce_payloads` before being yielded.
         """
         final_response_chunk: types.GenerateContentResponse | None = None
         error_occurred = False
         total_substitutions = 0
         first_chunk_received = False
         chunk_counter = 0
+        # Generated images are stored in the background while the response keeps streaming.
+        # Image link -> upload task.
+        image_uploads: dict[str, asyncio.Task] = {}
 
-        try:
+        async def payload_stream() -> AsyncGenerator[dict, None]:
+            nonlocal final_response_chunk, total_substitutions, first_chunk_received
+            nonlocal chunk_counter
             async for chunk in response_stream:
                 log.trace(f"Processing response chunk #{chunk_counter}:", payload=chunk)
                 chunk_counter += 1
@@ -2533,10 +5546,12 @@ class Pipe:
                         part,
                         __request__,
                         model,
+                        valves,
                         user_id,
                         chat_id,
                         message_id,
                         is_stream=True,  # We always yield chunks, so this is effectively true
+                        image_uploads=image_uploads,
                     )
 
                     if payload:
@@ -2544,8 +5559,17 @@ class Pipe:
                             total_substitutions += count
                             log.debug(f"Disabled {count} special tag(s) in a part.")
 
-                        structured_chunk = {"choices": [{"delta": payload}]}
-                        yield structured_chunk
+                        yield payload
+
+        try:
+            payloads = payload_stream()
+            if coalesce_delay > 0:
+                payloads = self._coalesce_payloads(
+                    payloads, coalesce_delay, coalesce_max_chars
+                )
+            async for payload in payloads:
+                structured_chunk = {"choices": [{"delta": payload}]}
+                yield structured_chunk
 
         except Exception as e:
             error_occurred = True
@@ -2557,6 +5581,30 @@ class Pipe:
             # The async for loop has completed, meaning we have received all data
             # from the API. Now, we perform final internal processing.
 
+            if image_uploads:
+                # The links to the images were already sent, make sure they resolve
+                # before the response is finished.
+                results = await asyncio.gather(
+                    *image_uploads.values(), return_exceptions=True
+                )
+                failed_links = [
+                    link
+                    for link, result in zip(image_uploads, results)
+                    if not isinstance(result, str)
+                ]
+                if failed_links:
+                    event_emitter.emit_toast(
+                        f"{len(failed_links)} generated image(s) could not be stored.",
+                        "error",
+                    )
+                    if not error_occurred:
+                        # The links were already sent, mark the ones that will not resolve.
+                        marker = "".join(
+                            f"\n\n*An error occurred while trying to store the model generated image `{link}`.*"
+                            for link in failed_links
+                        )
+                        yield {"choices": [{"delta": {"content": marker}}]}
+
             if total_substitutions > 0 and not error_occurred:
                 plural_s = "s" if total_substitutions > 1 else ""
                 toast_msg = (
@@ -2586,19 +5634,109 @@ class Pipe:
 
             log.debug("Unified response processor has finished.")
 
+    @staticmethod
+    async def _coalesce_payloads(
+        payloads: AsyncIterator[dict],
+        max_delay: float,
+        max_chars: int,
+    ) -> AsyncGenerator[dict, None]:
+        """
+        Batches consecutive text payloads with the same key (`content` or `reasoning`).
+
+        A batch is yielded once it is `max_delay` seconds old or `max_chars` long, when
+        the key changes, or when the stream ends. The next payload is awaited
+        concurrently with the batch timer, so a pause in the stream never holds back
+        buffered text. The first payload of each key is yielded immediately to keep
+        the time to first token unchanged.
+        """
+        loop = asyncio.get_running_loop()
+        payload_iter = aiter(payloads)
+        next_payload: asyncio.Future | None = None
+        seen_keys: set[str] = set()
+        buffer_key = ""
+        buffer: list[str] = []
+        buffered_chars = 0
+        deadline = 0.0
+
+        def take_buffer() -> dict:
+            nonlocal buffer, buffered_chars
+            batch = {buffer_key: "".join(buffer)}
+            buffer, buffered_chars = [], 0
+            return batch
+
+        try:
+            while True:
+                if next_payload is None:
+                    next_payload = asyncio.ensure_future(anext(payload_iter))
+                timeout = max(0.0, deadline - loop.time()) if buffer else None
+                done, _ = await asyncio.wait({next_payload}, timeout=timeout)
+                if not done:
+                    # The batch is due and the stream is quiet, send what we have.
+                    yield take_buffer()
+                    continue
+
+                future, next_payload = next_payload, None
+                try:
+                    payload: dict = future.result()
+                except StopAsyncIteration:
+                    break
+                except Exception:
+                    if buffer:
+                        yield take_buffer()
+                    raise
+
+                key, text = next(iter(payload.items()))
+                is_text = len(payload) == 1 and key in ("content", "reasoning")
+                if buffer and (not is_text or key != buffer_key):
+                    yield take_buffer()
+                if not is_text or key not in seen_keys:
+                    seen_keys.add(key)
+                    yield payload
+                    continue
+
+                if not buffer:
+                    buffer_key = key
+                    deadline = loop.time() + max_delay
+                buffer.append(text)
+                buffered_chars += len(text)
+                if buffered_chars >= max_chars:
+                    yield take_buffer()
+
+            if buffer:
+                yield take_buffer()
+        finally:
+            if next_payload is not None and not next_payload.done():
+                next_payload.cancel()
+                # The stream cannot be closed while the cancelled `anext` is still running.
+                await asyncio.wait({next_payload})
+            if next_payload is not None and not next_payload.cancelled():
+                # Marks a pending exception as retrieved.
+                next_payload.exception()
+            # Close the upstream (and the Google response stream behind it) right away,
+            # e.g. when the client disconnected, instead of leaving it to the garbage collector.
+            if aclose := getattr(payload_iter, "aclose", None):
+                try:
+                    await aclose()
+                except Exception:
+                    log.exception("Closing the payload stream failed.")
+
     async def _process_part(
         self,
         part: types.Part,
         __request__: Request,
         model: str,
+        valves: "Pipe.Valves",
         user_id: str,
         chat_id: str,
         message_id: str,
         is_stream: bool,
+        image_uploads: dict[str, asyncio.Task] | None = None,
     ) -> tuple[dict | None, int]:
         """
         Processes a single `types.Part` object and returns a payload dictionary
         for the Open WebUI stream, along with a count of tag substitutions.
+        If `image_uploads` is given, generated images are stored in the background
+        and their tasks are added to it, see `_process_image_part`.
         """
         # Initialize variables to ensure they always have a defined state.
         payload: dict[str, str] | None = None
@@ -2624,7 +5762,14 @@ class Pipe:
             case types.Part(inline_data=data) if data:
                 # Image parts don't need tag disabling.
                 processed_text = await self._process_image_part(
-                    data, model, user_id, chat_id, message_id, __request__
+                    data,
+                    model,
+                    valves,
+                    user_id,
+                    chat_id,
+                    message_id,
+                    __request__,
+                    image_uploads,
                 )
                 payload = {"content": processed_text}
             case types.Part(executable_code=code) if code:
@@ -2647,16 +5792,11 @@ class Pipe:
         """
         if not text:
             return "", 0
+        # Fast path: most streamed chunks contain no tag at all.
+        if "<" not in text:
+            return text, 0
 
-        # The regex finds '<' followed by an optional '/' and then one of the special tags.
-        # The inner parentheses group the tags, so the optional '/' applies to all of them.
-        TAG_REGEX = re.compile(
-            r"<(/?"
-            + "("
-            + "|".join(re.escape(tag) for tag in SPECIAL_TAGS_TO_DISABLE)
-            + ")"
-            + r")"
-        )
+        TAG_REGEX, _ = _get_special_tag_regexes(tuple(SPECIAL_TAGS_TO_DISABLE))
         # The substitution injects a ZWS, e.g., '</think>' becomes '<ZWS/think'.
         modified_text, num_substitutions = TAG_REGEX.subn(rf"<{ZWS}\1", text)
         return modified_text, num_substitutions
@@ -2665,27 +5805,44 @@ class Pipe:
         self,
         inline_data: types.Blob,
         model: str,
+        valves: "Pipe.Valves",
         user_id: str,
         chat_id: str,
         message_id: str,
         request: Request,
+        image_uploads: dict[str, asyncio.Task] | None = None,
     ) -> str:
         """
         Handles image data by saving it to the Open WebUI backend and returning a markdown link.
+
+        The file ID is reserved up front, so the link is known before the image is stored.
+        If `image_uploads` is given, the image is stored in a background task that is
+        added to it under the link, and the link is returned immediately. The caller must
+        await the tasks before the response is finished and mark the links of failed ones.
         """
         mime_type = inline_data.mime_type
         image_data = inline_data.data
 
         if mime_type and image_data:
-            image_url = await self._upload_image(
+            file_id = str(uuid.uuid4())
+            upload = self._upload_image(
                 image_data=image_data,
                 mime_type=mime_type,
                 model=model,
+                valves=valves,
                 user_id=user_id,
                 chat_id=chat_id,
                 message_id=message_id,
                 __request__=request,
+                file_id=file_id,
             )
+            if image_uploads is None:
+                image_url = await upload
+            else:
+                image_url = request.app.url_path_for(
+                    "get_file_content_by_id", id=file_id
+                )
+                image_uploads[image_url] = asyncio.create_task(upload)
         else:
             log.warning(
                 "Image part has no mime_type or data, cannot upload image. "
@@ -2704,17 +5861,58 @@ class Pipe:
         image_data: bytes,
         mime_type: str,
         model: str,
+        valves: "Pipe.Valves",
         user_id: str,
         chat_id: str,
         message_id: str,
         __request__: Request,
+        file_id: str | None = None,
     ) -> str | None:
         """
         Helper method that uploads a generated image to the configured Open WebUI storage provider.
         Returns the url to the uploaded image.
         """
+        async with self._get_image_upload_semaphore(valves):
+            return await self._store_image(
+                image_data,
+                mime_type,
+                model,
+                valves,
+                user_id,
+                chat_id,
+                message_id,
+                __request__,
+                file_id or str(uuid.uuid4()),
+            )
+
+    async def _store_image(
+        self,
+        image_data: bytes,
+        mime_type: str,
+        model: str,
+        valves: "Pipe.Valves",
+        user_id: str,
+        chat_id: str,
+        message_id: str,
+        __request__: Request,
+        id: str,
+    ) -> str | None:
+        """Stores the image under the given file ID, see `_upload_image`."""
         image_format = mimetypes.guess_extension(mime_type) or ".png"
-        id = str(uuid.uuid4())
+        if valves.IMAGE_RECOMPRESS_FORMAT != "none":
+            image_data, mime_type = await asyncio.to_thread(
+                self._recompress_image,
+                image_data,
+                mime_type,
+                valves.IMAGE_RECOMPRESS_FORMAT,
+                valves.IMAGE_RECOMPRESS_QUALITY,
+                valves.IMAGE_MAX_DIMENSION,
+            )
+            # `mimetypes` does not know AVIF on older Python versions.
+            image_format = mimetypes.guess_extension(mime_type) or (
+                f".{mime_type.split('/')[-1]}"
+            )
+
         name = f"generated-image{image_format}"
 
         # The final filename includes the unique ID to prevent collisions.
@@ -2764,6 +5962,59 @@ class Pipe:
         log.success("Image upload finished!")
         return image_url
 
+    @staticmethod
+    def _recompress_image(
+        image_data: bytes,
+        mime_type: str,
+        target_format: Literal["webp", "avif"],
+        quality: int,
+        max_dimension: int,
+    ) -> tuple[bytes, str]:
+        """
+        Re-encodes an image into `target_format`, downscaling it to `max_dimension` if set.
+        Returns the original image if it cannot be re-encoded or the result is not smaller.
+        """
+        try:
+            # Imported lazily because Pillow is an optional dependency.
+            from PIL import Image
+        except ImportError:
+            log.warning(
+                "Re-encoding generated images requires Pillow, which is not installed. Storing the original."
+            )
+            return image_data, mime_type
+
+        try:
+            with Image.open(io.BytesIO(image_data)) as image:
+                resized = bool(max_dimension) and max(image.size) > max_dimension
+                if resized:
+                    image.thumbnail((max_dimension, max_dimension))
+                output = io.BytesIO()
+                image.save(output, format=target_format.upper(), quality=quality)
+        except Exception:
+            log.exception(
+                f"Re-encoding the generated image to {target_format} failed. Storing the original."
+            )
+            return image_data, mime_type
+
+        recompressed = output.getvalue()
+        if not resized and len(recompressed) >= len(image_data):
+            log.debug(
+                f"Re-encoded image is not smaller ({len(recompressed)} >= {len(image_data)} bytes). Storing the original."
+            )
+            return image_data, mime_type
+        log.debug(
+            f"Re-encoded generated image from {len(image_data)} to {len(recompressed)} bytes ({target_format})."
+        )
+        return recompressed, f"image/{target_format}"
+
+    def _get_image_upload_semaphore(self, valves: "Pipe.Valves") -> asyncio.Semaphore:
+        """Returns the semaphore bounding concurrent image uploads, re-created if the limit changed."""
+        limit = valves.IMAGE_UPLOAD_MAX_CONCURRENCY
+        if self._image_upload_semaphore is None or self._image_upload_limit != limit:
+            self._image_upload_semaphore = asyncio.Semaphore(limit)
+            self._image_upload_limit = limit
+        return self._image_upload_semaphore
+
     def _process_executable_code_part(
         self, executable_code_part: types.ExecutableCode | None
     ) -> str | None:
@@ -2888,11 +6139,11 @@ class Pipe:
             usage_data["completion_time"] = round(elapsed_time, 2)
             await event_emitter.emit_usage(usage_data)
 
-        self._add_grounding_data_to_state(
+        await self._add_grounding_data_to_state(
             model_response, request, chat_id, message_id, start_time
         )
 
-    def _add_grounding_data_to_state(
+    async def _add_grounding_data_to_state(
         self,
         response: types.GenerateContentResponse,
         request: Request,
@@ -2903,21 +6154,36 @@ class Pipe:
         candidate = self._get_first_candidate(response.candidates)
         grounding_metadata_obj = candidate.grounding_metadata if candidate else None
 
-        app_state: State = request.app.state
-        grounding_key = f"grounding_{chat_id}_{message_id}"
-        time_key = f"pipe_start_time_{chat_id}_{message_id}"
-
         if grounding_metadata_obj:
+            store = self._get_grounding_store()
             log.debug(
-                f"Found grounding metadata. Storing in request's app state using key {grounding_key}."
+                f"Found grounding metadata. Storing it in the grounding store for message {message_id}."
             )
-            # Using shared `request.app.state` to pass data to Filter.outlet.
+            # The store is published on the shared `request.app.state` to pass data to Filter.outlet.
             # This is necessary because the Pipe and Filter operate on different requests.
-            app_state._state[grounding_key] = grounding_metadata_obj
-            app_state._state[time_key] = pipe_start_time
+            setattr(request.app.state, GroundingStore.APP_STATE_ATTR, store)
+            await store.put(chat_id, message_id, grounding_metadata_obj, pipe_start_time)
+            log.debug("Grounding store statistics:", payload=store.snapshot)
         else:
             log.debug(f"Response {message_id} does not have grounding metadata.")
 
+    def _get_grounding_store(self) -> GroundingStore:
+        """Returns the grounding store, re-creating it only if the Redis URL changed."""
+        ttl = self.valves.GROUNDING_STORE_TTL
+        max_entries = self.valves.GROUNDING_STORE_MAX_ENTRIES
+        redis_url = self.valves.GROUNDING_STORE_REDIS_URL or None
+        if self._grounding_store and self._grounding_store.redis_url == redis_url:
+            self._grounding_store.configure(ttl, max_entries)
+            return self._grounding_store
+        try:
+            self._grounding_store = GroundingStore(ttl, max_entries, redis_url)
+        except Exception:
+            log.exception(
+                "Failed to connect the grounding store to Redis. Falling back to the in-memory store."
+            )
+            self._grounding_store = GroundingStore(ttl, max_entries)
+        return self._grounding_store
+
     @staticmethod
     def _get_usage_data(
         response: types.GenerateContentResponse,
@@ -2956,241 +6222,10 @@ class Pipe:
 
     # endregion 2.5 Post-processing
 
-    # region 2.6 Logging
-    # TODO: Move to a separate plugin that does not have any Open WebUI funcitonlity and is only imported by this plugin.
-
-    def _is_flat_dict(self, data: Any) -> bool:
-        """
-        Checks if a dictionary contains only non-dict/non-list values (is one level deep).
-        """
-        if not isinstance(data, dict):
-            return False
-        return not any(isinstance(value, (dict, list)) for value in data.values())
-
-    def _truncate_long_strings(
-        self, data: Any, max_len: int, truncation_marker: str, truncation_enabled: bool
-    ) -> Any:
-        """
-        Recursively traverses a data structure (dicts, lists) and truncates
-        long string values. Creates copies to avoid modifying original data.
-
-        Args:
-            data: The data structure (dict, list, str, int, float, bool, None) to process.
-            max_len: The maximum allowed length for string values.
-            truncation_marker: The string to append to truncated values.
-            truncation_enabled: Whether truncation is enabled.
-
-        Returns:
-            A potentially new data structure with long strings truncated.
-        """
-        if not truncation_enabled or max_len <= len(truncation_marker):
-            # If truncation is disabled or max_len is too small, return original
-            # Make a copy only if it's a mutable type we might otherwise modify
-            if isinstance(data, (dict, list)):
-                return copy.deepcopy(data)  # Ensure deep copy for nested structures
-            return data  # Primitives are immutable
-
-        if isinstance(data, str):
-            if len(data) > max_len:
-                return data[: max_len - len(truncation_marker)] + truncation_marker
-            return data  # Return original string if not truncated
-        elif isinstance(data, dict):
-            # Process dictionary items, creating a new dict
-            return {
-                k: self._truncate_long_strings(
-                    v, max_len, truncation_marker, truncation_enabled
-                )
-                for k, v in data.items()
-            }
-        elif isinstance(data, list):
-            # Process list items, creating a new list
-            return [
-                self._truncate_long_strings(
-                    item, max_len, truncation_marker, truncation_enabled
-                )
-                for item in data
-            ]
-        else:
-            # Return non-string, non-container types as is (they are immutable)
-            return data
-
-    def plugin_stdout_format(self, record: "Record") -> str:
-        """
-        Custom format function for the plugin's logs.
-        Serializes and truncates data passed under the 'payload' key in extra.
-        """
-
-        # Configuration Keys
-        LOG_OPTIONS_PREFIX = "_log_"
-        TRUNCATION_ENABLED_KEY = f"{LOG_OPTIONS_PREFIX}truncation_enabled"
-        MAX_LENGTH_KEY = f"{LOG_OPTIONS_PREFIX}max_length"
-        TRUNCATION_MARKER_KEY = f"{LOG_OPTIONS_PREFIX}truncation_marker"
-        DATA_KEY = "payload"
-
-        original_extra = record["extra"]
-        # Extract the data intended for serialization using the chosen key
-        data_to_process = original_extra.get(DATA_KEY)
-
-        serialized_data_json = ""
-        if data_to_process is not None:
-            try:
-                serializable_data = pydantic_core.to_jsonable_python(
-                    data_to_process, serialize_unknown=True
-                )
-
-                # Determine truncation settings
-                truncation_enabled = original_extra.get(TRUNCATION_ENABLED_KEY, True)
-                max_length = original_extra.get(MAX_LENGTH_KEY, 256)
-                truncation_marker = original_extra.get(TRUNCATION_MARKER_KEY, "[...]")
-
-                # If max_length was explicitly provided, force truncation enabled
-                if MAX_LENGTH_KEY in original_extra:
-                    truncation_enabled = True
-
-                # Truncate long strings
-                truncated_data = self._truncate_long_strings(
-                    serializable_data,
-                    max_length,
-                    truncation_marker,
-                    truncation_enabled,
-                )
-
-                # Serialize the (potentially truncated) data
-                if self._is_flat_dict(truncated_data) and not isinstance(
-                    truncated_data, list
-                ):
-                    json_string = json.dumps(
-                        truncated_data, separators=(",", ":"), default=str
-                    )
-                    # Add a simple prefix if it's compact
-                    serialized_data_json = " - " + json_string
-                else:
-                    json_string = json.dumps(truncated_data, indent=2, default=str)
-                    # Prepend with newline for readability
-                    serialized_data_json = "\n" + json_string
-
-            except (TypeError, ValueError) as e:  # Catch specific serialization errors
-                serialized_data_json = f" - {{Serialization Error: {e}}}"
-            except (
-                Exception
-            ) as e:  # Catch any other unexpected errors during processing
-                serialized_data_json = f" - {{Processing Error: {e}}}"
-
-        # Add the final JSON string (or error message) back into the record
-        record["extra"]["_plugin_serialized_data"] = serialized_data_json
-
-        # Base template
-        base_template = (
-            "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
-            "<level>{level: <8}</level> | "
-            "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
-            "<level>{message}</level>"
-        )
-
-        # Append the serialized data
-        base_template += "{extra[_plugin_serialized_data]}"
-        # Append the exception part
-        base_template += "\n{exception}"
-        # Return the format string template
-        return base_template.rstrip()
-
-    @cache
-    def _add_log_handler(self, log_level: str):
-        """
-        Adds or updates the loguru handler specifically for this plugin.
-        Includes logic for serializing and truncating extra data.
-        The handler is added only if the log_level has changed since the last call.
-        """
-
-        def plugin_filter(record: "Record"):
-            """Filter function to only allow logs from this plugin (based on module name)."""
-            return record["name"] == __name__
-
-        # Get the desired level name and number
-        desired_level_name = log_level
-        try:
-            # Use the public API to get level details
-            desired_level_info = log.level(desired_level_name)
-            desired_level_no = desired_level_info.no
-        except ValueError:
-            log.error(
-                f"Invalid LOG_LEVEL '{desired_level_name}' configured for plugin {__name__}. Cannot add/update handler."
-            )
-            return  # Stop processing if the level is invalid
-
-        # Access the internal state of the log
-        handlers: dict[int, "Handler"] = log._core.handlers  # type: ignore
-        handler_id_to_remove = None
-        found_correct_handler = False
-
-        for handler_id, handler in handlers.items():
-            existing_filter = handler._filter  # Access internal attribute
-
-            # Check if the filter matches our plugin_filter
-            # Comparing function objects directly can be fragile if they are recreated.
-            # Comparing by name and module is more robust for functions defined at module level.
-            is_our_filter = (
-                existing_filter is not None  # Make sure a filter is set
-                and hasattr(existing_filter, "__name__")
-                and existing_filter.__name__ == plugin_filter.__name__
-                and hasattr(existing_filter, "__module__")
-                and existing_filter.__module__ == plugin_filter.__module__
-            )
-
-            if is_our_filter:
-                existing_level_no = handler.levelno
-                log.trace(
-                    f"Found existing handler {handler_id} for {__name__} with level number {existing_level_no}."
-                )
-
-                # Check if the level matches the desired level
-                if existing_level_no == desired_level_no:
-                    log.debug(
-                        f"Handler {handler_id} for {__name__} already exists with the correct level '{desired_level_name}'."
-                    )
-                    found_correct_handler = True
-                    break  # Found the correct handler, no action needed
-                else:
-                    # Found our handler, but the level is wrong. Mark for removal.
-                    log.info(
-                        f"Handler {handler_id} for {__name__} found, but log level differs "
-                        f"(existing: {existing_level_no}, desired: {desired_level_no}). "
-                        f"Removing it to update."
-                    )
-                    handler_id_to_remove = handler_id
-                    break  # Found the handler to replace, stop searching
-
-        # Remove the old handler if marked for removal
-        if handler_id_to_remove is not None:
-            try:
-                log.remove(handler_id_to_remove)
-                log.debug(f"Removed handler {handler_id_to_remove} for {__name__}.")
-            except ValueError:
-                # This might happen if the handler was somehow removed between the check and now
-                log.warning(
-                    f"Could not remove handler {handler_id_to_remove} for {__name__}. It might have already been removed."
-                )
-                # If removal failed but we intended to remove, we should still proceed to add
-                # unless found_correct_handler is somehow True (which it shouldn't be if handler_id_to_remove was set).
-
-        # Add a new handler if no correct one was found OR if we just removed an incorrect one
-        if not found_correct_handler:
-            log.add(
-                sys.stdout,
-                level=desired_level_name,
-                format=self.plugin_stdout_format,
-                filter=plugin_filter,
-            )
-            log.debug(
-                f"Added new handler to loguru for {__name__} with level {desired_level_name}."
-            )
-
-    # endregion 2.6 Logging
-
-    # region 2.7 Utility helpers
+    # region 2.6 Utility helpers
 
-    @staticmethod
-    def _get_toggleable_feature_status(
+    async def _get_toggleable_feature_status(
+        self,
         filter_id: str,
         __metadata__: "Metadata",
     ) -> tuple[bool, bool]:
@@ -3215,7 +6250,14 @@ class Pipe:
             - is_toggled_on: True if the user has the toggle ON in the UI for this request.
         """
         # 1. Check if the filter is installed
-        f = Functions.get_function_by_id(filter_id)
+        f = (await self._get_toggle_filter_functions()).get(filter_id)
+        if (not f or not f.is_active) and filter_id in (
+            __metadata__.get("filter_ids") or []
+        ):
+            # The front-end only offers toggles of installed and active filters,
+            # so the cached state predates the filter being installed or enabled.
+            self.invalidate_toggle_filter_cache()
+            f = (await self._get_toggle_filter_functions()).get(filter_id)
         if not f:
             log.warning(
                 f"The '{filter_id}' filter is not installed. "
@@ -3262,12 +6304,77 @@ class Pipe:
 
         return (True, is_toggled_on)
 
-    @staticmethod
+    async def _get_toggle_filter_functions(self) -> dict[str, FunctionModel]:
+        """
+        Returns the installed toggle filters (`TOGGLE_FILTER_IDS`) by ID.
+
+        All toggle filters are loaded with one query in a worker thread and kept for
+        `TOGGLE_FILTER_CACHE_TTL` seconds, so assembling the request config does not
+        hit the database for every toggle of every message.
+        `_get_toggleable_feature_status` drops the cached state early with
+        `invalidate_toggle_filter_cache` when a request toggles a filter that is
+        missing or inactive in the cache.
+        """
+        if self._toggle_filters_cache and time.monotonic() < self._toggle_filters_cache[0]:
+            return self._toggle_filters_cache[1]
+
+        try:
+            filters = await asyncio.to_thread(Functions.get_functions_by_type, "filter")
+        except Exception:
+            log.exception("Loading the toggle filters from the database failed.")
+            return {}
+        functions = {f.id: f for f in filters if f.id in TOGGLE_FILTER_IDS}
+        self._toggle_filters_cache = (
+            time.monotonic() + TOGGLE_FILTER_CACHE_TTL,
+            functions,
+        )
+        return functions
+
+    def invalidate_toggle_filter_cache(self) -> None:
+        """Forgets the cached toggle filter state, e.g. after a filter was installed or toggled."""
+        self._toggle_filters_cache = None
+
     def _get_merged_valves(
+        self,
+        default_valves: "Pipe.Valves",
+        user_valves: "Pipe.UserValves | None",
+        user_email: str,
+    ) -> "Pipe.MergedValves":
+        """
+        Returns the merged configuration of `_merge_valves`, memoized per
+        (admin valves, user valves, user email) fingerprint.
+
+        The fingerprint is built from the field values, so any change of either
+        valves object leads to a new merge. The returned object is shared between
+        requests, so it is frozen; use `model_copy(update=...)` to derive a variant.
+        """
+        try:
+            key = (
+                tuple(vars(default_valves).values()),
+                tuple(vars(user_valves).values()) if user_valves is not None else None,
+                user_email,
+            )
+            hash(key)
+        except TypeError:
+            # Unhashable field values, do not cache.
+            return self._merge_valves(default_valves, user_valves, user_email)
+
+        if merged := self._merged_valves_cache.get(key):
+            self._merged_valves_cache.move_to_end(key)
+            return merged
+
+        merged = self._merge_valves(default_valves, user_valves, user_email)
+        self._merged_valves_cache[key] = merged
+        if len(self._merged_valves_cache) > MERGED_VALVES_CACHE_SIZE:
+            self._merged_valves_cache.popitem(last=False)
+        return merged
+
+    @staticmethod
+    def _merge_valves(
         default_valves: "Pipe.Valves",
         user_valves: "Pipe.UserValves | None",
         user_email: str,
-    ) -> "Pipe.Valves":
+    ) -> "Pipe.MergedValves":
         """
         Merges UserValves into a base Valves configuration.
 
@@ -3283,14 +6390,14 @@ class Pipe:
         Args:
             default_valves: The base Valves object with default configurations.
             user_valves: An optional UserValves object with user-specific overrides.
-                         If None, a copy of default_valves is returned.
+                         If None, a frozen copy of default_valves is returned.
 
         Returns:
-            A new Valves object representing the merged configuration.
+            A new, frozen MergedValves object representing the merged configuration.
         """
         if user_valves is None:
             # If no user-specific valves are provided, return a copy of the default valves.
-            return default_valves.model_copy(deep=True)
+            return Pipe.MergedValves(**default_valves.model_dump())
 
         # Start with the values from the base `Valves`
         merged_data = default_valves.model_dump()
@@ -3306,11 +6413,7 @@ class Pipe:
                 if field_name in merged_data:
                     merged_data[field_name] = user_value
 
-        user_whitelist = (
-            default_valves.AUTH_WHITELIST.split(",")
-            if default_valves.AUTH_WHITELIST
-            else []
-        )
+        user_whitelist = _parse_auth_whitelist(default_valves.AUTH_WHITELIST)
 
         # Apply special logic based on default_valves.USER_MUST_PROVIDE_AUTH_CONFIG
         if (
@@ -3326,7 +6429,7 @@ class Pipe:
 
         # Create a new Valves instance with the merged data.
         # Pydantic will validate the data against the Valves model definition during instantiation.
-        return Pipe.Valves(**merged_data)
+        return Pipe.MergedValves(**merged_data)
 
     def _get_first_candidate(
         self, candidates: list[types.Candidate] | None
@@ -3377,6 +6480,6 @@ class Pipe:
                     f"Could not parse companion version string: '{companion_version}'. Version check skipped."
                 )
 
-    # endregion 2.7 Utility helpers
+    # endregion 2.6 Utility helpers
 
     # endregion 2. Helper methods inside the Pipe class
@@ -0,0 +1,19 @@
+import importlib.util
+import pathlib
+import sys
+
+import pytest
+
+PIPE_PATH = pathlib.Path(__file__).resolve().parents[1] / "gemini_manifold.py"
+
+
+@pytest.fixture(scope="session")
+def gemini_manifold():
+    """The pipe module, loaded from its file like Open WebUI does."""
+    # The pipe imports Open WebUI's models, so it can only be loaded next to an installation.
+    pytest.importorskip("open_webui")
+    spec = importlib.util.spec_from_file_location("gemini_manifold", PIPE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
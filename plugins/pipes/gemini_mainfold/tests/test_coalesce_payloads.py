@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+
+async def timed_stream(items, closed=None):
+    """Yields `(delay, payload)` items, a payload that is an exception is raised instead."""
+    try:
+        for delay, payload in items:
+            await asyncio.sleep(delay)
+            if isinstance(payload, BaseException):
+                raise payload
+            yield payload
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+def collect(gemini_manifold, items, max_delay=0.05, max_chars=2048):
+    async def run():
+        coalesced = gemini_manifold.Pipe._coalesce_payloads(
+            timed_stream(items), max_delay, max_chars
+        )
+        return [payload async for payload in coalesced]
+
+    return asyncio.run(run())
+
+
+def test_first_payload_of_each_key_is_not_delayed(gemini_manifold):
+    items = [(0, {"reasoning": "a"}), (0, {"reasoning": "b"}), (0, {"content": "c"})]
+    assert collect(gemini_manifold, items) == [
+        {"reasoning": "a"},
+        {"reasoning": "b"},
+        {"content": "c"},
+    ]
+
+
+def test_consecutive_text_is_batched(gemini_manifold):
+    items = [(0, {"content": "a"})] + [(0, {"content": c}) for c in "bcd"]
+    assert collect(gemini_manifold, items) == [{"content": "a"}, {"content": "bcd"}]
+
+
+def test_batch_is_flushed_on_deadline_while_stream_is_quiet(gemini_manifold):
+    items = [
+        (0, {"content": "a"}),
+        (0, {"content": "b"}),
+        (0, {"content": "c"}),
+        # Longer than max_delay, the batch must not wait for this payload.
+        (0.2, {"content": "d"}),
+    ]
+    assert collect(gemini_manifold, items, max_delay=0.02) == [
+        {"content": "a"},
+        {"content": "bc"},
+        {"content": "d"},
+    ]
+
+
+def test_key_switch_flushes_the_batch(gemini_manifold):
+    items = [
+        (0, {"reasoning": "r1"}),
+        (0, {"reasoning": "r2"}),
+        (0, {"reasoning": "r3"}),
+        (0, {"content": "c1"}),
+        (0, {"content": "c2"}),
+        (0, {"reasoning": "r4"}),
+    ]
+    assert collect(gemini_manifold, items) == [
+        {"reasoning": "r1"},
+        {"reasoning": "r2r3"},
+        {"content": "c1"},
+        {"content": "c2"},
+        {"reasoning": "r4"},
+    ]
+
+
+def test_non_text_payloads_pass_through_in_order(gemini_manifold):
+    items = [
+        (0, {"content": "a"}),
+        (0, {"content": "b"}),
+        (0, {"content": "c"}),
+        (0, {"event": {"type": "status"}}),
+        (0, {"content": "d"}),
+    ]
+    assert collect(gemini_manifold, items) == [
+        {"content": "a"},
+        {"content": "bc"},
+        {"event": {"type": "status"}},
+        {"content": "d"},
+    ]
+
+
+def test_max_chars_flushes_the_batch(gemini_manifold):
+    items = [(0, {"content": "x"})] + [(0, {"content": "abc"}) for _ in range(3)]
+    assert collect(gemini_manifold, items, max_delay=10, max_chars=5) == [
+        {"content": "x"},
+        {"content": "abcabc"},
+        {"content": "abc"},
+    ]
+
+
+def test_buffer_is_flushed_before_an_exception(gemini_manifold):
+    received = []
+
+    async def run():
+        items = [
+            (0, {"content": "a"}),
+            (0, {"content": "b"}),
+            (0, {"content": "c"}),
+            (0, RuntimeError("stream failed")),
+        ]
+        coalesced = gemini_manifold.Pipe._coalesce_payloads(
+            timed_stream(items), 10, 2048
+        )
+        async for payload in coalesced:
+            received.append(payload)
+
+    with pytest.raises(RuntimeError, match="stream failed"):
+        asyncio.run(run())
+    assert received == [{"content": "a"}, {"content": "bc"}]
+
+
+def test_upstream_is_closed_when_the_consumer_stops_early(gemini_manifold):
+    async def run():
+        closed = asyncio.Event()
+        items = [(0, {"content": "a"}), (10, {"content": "b"})]
+        coalesced = gemini_manifold.Pipe._coalesce_payloads(
+            timed_stream(items, closed), 0.05, 2048
+        )
+        assert await anext(coalesced) == {"content": "a"}
+        # The next payload is pending, e.g. the client disconnected mid-stream.
+        await coalesced.aclose()
+        return closed.is_set()
+
+    assert asyncio.run(run())
@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+from google.genai import types
+
+
+class FakeCaches:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    async def create(self, model, config):
+        self.calls.append("create")
+        return types.CachedContent(name=f"cachedContents/{len(self.calls)}")
+
+    async def update(self, name, config):
+        self.calls.append(("update", name))
+
+    async def delete(self, name):
+        self.calls.append(("delete", name))
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+        self.aio = SimpleNamespace(caches=FakeCaches(self))
+
+
+def gen_content_args(chat, turns):
+    contents = [
+        types.Content(
+            role="user", parts=[types.Part.from_text(text=f"{chat} turn {i} " * 2000)]
+        )
+        for i in range(turns)
+    ]
+    return {
+        "model": "gemini-2.5-flash",
+        "contents": contents,
+        "config": types.GenerateContentConfig(),
+    }
+
+
+def test_caches_are_managed_with_the_current_client(gemini_manifold):
+    manager = gemini_manifold.ContextCacheManager(ttl=3600, max_entries=1, min_tokens=1)
+    clients = [FakeClient()]
+
+    def get_client():
+        # The registry hands out a new client after evicting and closing the old one.
+        if clients[-1].closed:
+            clients.append(FakeClient())
+        return clients[-1]
+
+    async def run():
+        manager.apply(get_client, "auth", gen_content_args("a", 2))
+        await asyncio.gather(*manager._tasks)
+        (entry,) = manager._entries.values()
+
+        clients[-1].closed = True
+        # A different chat evicts the cache above `max_entries`.
+        manager.apply(get_client, "auth", gen_content_args("b", 2))
+        while manager._tasks:
+            await asyncio.gather(*manager._tasks)
+
+        assert ("delete", entry.name) in clients[-1].aio.caches.calls
+        assert not any(
+            isinstance(call, tuple) for call in clients[0].aio.caches.calls
+        )
+
+    asyncio.run(run())
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+from google.genai import types
+
+
+class FakeFiles:
+    """`client.aio.files` whose files stay PROCESSING until `activate` is called."""
+
+    def __init__(self):
+        self.gets: list[str] = []
+        self.active: set[str] = set()
+
+    async def get(self, name):
+        self.gets.append(name)
+        state = types.FileState.ACTIVE if name in self.active else types.FileState.PROCESSING
+        return types.File(name=name, state=state)
+
+
+def make_manager(gemini_manifold):
+    files = FakeFiles()
+    client = SimpleNamespace(aio=SimpleNamespace(files=files))
+    manager = gemini_manifold.FilesAPIManager(client, None, None, None)
+    return manager, files
+
+
+def processing(name):
+    return types.File(name=name, state=types.FileState.PROCESSING)
+
+
+def test_polling_stops_when_the_last_waiter_is_cancelled(gemini_manifold):
+    manager, files = make_manager(gemini_manifold)
+
+    async def run():
+        waiters = [
+            asyncio.create_task(manager._poll_for_active_state(processing("files/a"), None))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0.5)
+        assert files.gets
+
+        # One waiter left, the file is still polled.
+        waiters[0].cancel()
+        await asyncio.sleep(0)
+        assert "files/a" in manager._pending_polls
+
+        waiters[1].cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert manager._pending_polls == {}
+        await asyncio.sleep(0)
+        polls = len(files.gets)
+        await asyncio.sleep(0.5)
+        assert len(files.gets) == polls
+
+    asyncio.run(run())
+
+
+def test_other_files_keep_polling_after_a_waiter_is_cancelled(gemini_manifold):
+    manager, files = make_manager(gemini_manifold)
+
+    async def run():
+        cancelled = asyncio.create_task(
+            manager._poll_for_active_state(processing("files/a"), None)
+        )
+        kept = asyncio.create_task(
+            manager._poll_for_active_state(processing("files/b"), None)
+        )
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert list(manager._pending_polls) == ["files/b"]
+
+        files.active.add("files/b")
+        file = await asyncio.wait_for(kept, timeout=2)
+        assert file.state == types.FileState.ACTIVE
+        assert "files/a" not in files.gets[-1:]
+
+    asyncio.run(run())
+
+
+def test_file_registered_after_the_loop_was_stopped_is_polled(gemini_manifold):
+    manager, files = make_manager(gemini_manifold)
+
+    async def run():
+        cancelled = asyncio.create_task(
+            manager._poll_for_active_state(processing("files/a"), None)
+        )
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+
+        # Registered before the stopped loop has processed its cancellation.
+        files.active.add("files/b")
+        file = await asyncio.wait_for(
+            manager._poll_for_active_state(processing("files/b"), None), timeout=2
+        )
+        assert file.state == types.FileState.ACTIVE
+
+    asyncio.run(run())
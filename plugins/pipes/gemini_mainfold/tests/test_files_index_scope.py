@@ -0,0 +1,52 @@
+import asyncio
+import datetime
+
+from aiocache import SimpleMemoryCache
+from aiocache.serializers import NullSerializer
+from google.genai import types
+
+
+def make_manager(gemini_manifold, file_cache, files_index, auth_key):
+    return gemini_manifold.FilesAPIManager(
+        client=None,
+        file_cache=file_cache,
+        id_hash_cache=SimpleMemoryCache(serializer=NullSerializer()),
+        event_emitter=None,
+        files_index=files_index,
+        auth_key=auth_key,
+    )
+
+
+def active_file():
+    expiration_time = datetime.datetime.now(
+        datetime.timezone.utc
+    ) + datetime.timedelta(hours=1)
+    return types.File(
+        name="files/abc",
+        uri="https://example.com/files/abc",
+        state=types.FileState.ACTIVE,
+        expiration_time=expiration_time,
+    )
+
+
+def test_files_are_not_shared_between_auth_keys(gemini_manifold, tmp_path):
+    async def run():
+        file_cache = SimpleMemoryCache(serializer=NullSerializer())
+        files_index = gemini_manifold.SQLiteFilesIndex(str(tmp_path / "files.db"))
+        owner = make_manager(gemini_manifold, file_cache, files_index, "key-a")
+        other = make_manager(gemini_manifold, file_cache, files_index, "key-b")
+
+        await owner._cache_file("hash", active_file())
+        other_hot = await other._get_cached_file("hash", None)
+        # A fresh hot tier, so the lookup has to go to the persistent index.
+        owner.file_cache = other.file_cache = SimpleMemoryCache(
+            serializer=NullSerializer()
+        )
+        other_warm = await other._get_cached_file("hash", None)
+        owner_warm = await owner._get_cached_file("hash", None)
+        return other_hot, other_warm, owner_warm
+
+    other_hot, other_warm, owner_warm = asyncio.run(run())
+    assert other_hot is None
+    assert other_warm is None
+    assert owner_warm is not None and owner_warm.name == "files/abc"
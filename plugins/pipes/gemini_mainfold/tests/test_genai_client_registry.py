@@ -0,0 +1,32 @@
+import asyncio
+from types import SimpleNamespace
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+        self.aclosed = False
+        self.aio = SimpleNamespace(aclose=self._aclose)
+
+    def close(self):
+        self.closed = True
+
+    async def _aclose(self):
+        self.aclosed = True
+
+
+def test_idle_clients_are_closed_without_further_lookups(gemini_manifold, monkeypatch):
+    Registry = gemini_manifold.GenaiClientRegistry
+    monkeypatch.setattr(Registry, "CLOSE_GRACE_PERIOD", 0)
+    registry = Registry(max_size=2, idle_ttl=0)
+    client = FakeClient()
+
+    async def run():
+        registry.get_or_create(("key",), lambda: client)
+        # No further lookup, the worker went quiet.
+        await asyncio.sleep(1.2)
+        assert registry.snapshot()["size"] == 0
+        assert client.closed and client.aclosed
+        assert registry._sweep_handle is None
+
+    asyncio.run(run())
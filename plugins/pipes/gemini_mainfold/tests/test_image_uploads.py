@@ -0,0 +1,73 @@
+import asyncio
+from types import SimpleNamespace
+
+from google.genai import types
+
+
+class FakeEmitter:
+    def __init__(self):
+        self.toasts = []
+
+    async def emit_status(self, *args, **kwargs):
+        pass
+
+    async def emit_error(self, *args, **kwargs):
+        pass
+
+    def emit_toast(self, msg, toastType="info"):
+        self.toasts.append((msg, toastType))
+
+
+def test_failed_background_upload_marks_the_sent_link(gemini_manifold, monkeypatch):
+    Pipe = gemini_manifold.Pipe
+    pipe = Pipe()
+    valves = pipe._get_merged_valves(pipe.valves, None, "a@example.com")
+    stored_with = []
+
+    async def store_image(self, image_data, mime_type, model, valves, *args):
+        stored_with.append(valves)
+        return None
+
+    async def do_post_processing(self, *args, **kwargs):
+        pass
+
+    monkeypatch.setattr(Pipe, "_store_image", store_image)
+    monkeypatch.setattr(Pipe, "_do_post_processing", do_post_processing)
+    request = SimpleNamespace(
+        app=SimpleNamespace(
+            url_path_for=lambda name, id: f"/api/v1/files/{id}/content"
+        )
+    )
+    image = types.Part(inline_data=types.Blob(mime_type="image/png", data=b"png"))
+
+    async def response_stream():
+        yield types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(parts=[image]))]
+        )
+
+    async def run():
+        emitter = FakeEmitter()
+        chunks = [
+            chunk
+            async for chunk in pipe._unified_response_processor(
+                response_stream(),
+                request,
+                "gemini-2.5-flash-image",
+                valves,
+                emitter,
+                "user",
+                "chat",
+                "message",
+                start_time=0,
+            )
+        ]
+        return chunks, emitter
+
+    chunks, emitter = asyncio.run(run())
+    contents = [c["choices"][0]["delta"]["content"] for c in chunks if isinstance(c, dict)]
+    link = contents[0].removeprefix("![Generated Image](").removesuffix(")")
+    assert link.startswith("/api/v1/files/")
+    assert link in contents[1] and "error" in contents[1]
+    assert chunks[-1] == "data: [DONE]"
+    assert stored_with == [valves]
+    assert emitter.toasts == [("1 generated image(s) could not be stored.", "error")]
@@ -0,0 +1,29 @@
+import pydantic
+import pytest
+
+
+def test_merged_valves_are_cached_and_frozen(gemini_manifold):
+    Pipe = gemini_manifold.Pipe
+    pipe = Pipe()
+    user_valves = Pipe.UserValves(THINKING_BUDGET=1024)
+
+    merged = pipe._get_merged_valves(pipe.valves, user_valves, "a@example.com")
+    assert merged.THINKING_BUDGET == 1024
+    assert pipe._get_merged_valves(pipe.valves, user_valves, "a@example.com") is merged
+    with pytest.raises(pydantic.ValidationError):
+        merged.THINKING_BUDGET = 0
+
+    variant = merged.model_copy(update={"THINKING_BUDGET": 0})
+    assert variant.THINKING_BUDGET == 0
+    assert merged.THINKING_BUDGET == 1024
+
+
+def test_merged_valves_without_user_valves_are_frozen(gemini_manifold):
+    Pipe = gemini_manifold.Pipe
+    pipe = Pipe()
+
+    merged = pipe._get_merged_valves(pipe.valves, None, "a@example.com")
+    assert isinstance(merged, Pipe.MergedValves)
+    assert merged.model_dump() == pipe.valves.model_dump()
+    with pytest.raises(pydantic.ValidationError):
+        merged.GEMINI_API_KEY = "key"
@@ -0,0 +1,18 @@
+def test_lookups_with_user_patterns_are_bounded(gemini_manifold):
+    registry = gemini_manifold.ModelCapabilityRegistry("thinking", "image")
+    registry.MAX_ENTRIES = 4
+    registry.get("gemini-2.5-flash")
+    for i in range(10):
+        registry.get("gemini-2.5-flash", thinking_pattern=f"pattern-{i}")
+        # Recently used flags are kept.
+        registry.get("gemini-2.5-flash")
+    assert len(registry._capabilities) == 4
+    assert ("gemini-2.5-flash", "thinking", "image") in registry._capabilities
+
+
+def test_user_patterns_are_classified_separately(gemini_manifold):
+    registry = gemini_manifold.ModelCapabilityRegistry("thinking", "image")
+    image_output = gemini_manifold.ModelCapability.IMAGE_OUTPUT
+    assert not registry.get("my-model") & image_output
+    assert registry.get("my-model", image_pattern="my-") & image_output
+    assert not registry.get("my-model") & image_output
@@ -0,0 +1,82 @@
+import asyncio
+import random
+
+from google.genai import types
+
+FRAGMENTS = [
+    "Plain text",
+    " ",
+    "\n",
+    "日本語 🙂",
+    "<",
+    "<think>",
+    "</think>",
+    "<details>",
+    "a < b",
+    "![",
+    "![alt](data:image/png;base64,aGVsbG8=)",
+    "![broken link",
+    "youtube.com/",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ",
+    "youtu.be",
+    "(",
+    ")",
+]
+
+
+def corpus(gemini_manifold, size=500):
+    rng = random.Random(0)
+    texts = ["", "   ", "no links here"]
+    for _ in range(size):
+        texts.append("".join(rng.choices(FRAGMENTS, k=rng.randint(1, 8))))
+    # History messages contain tags disabled by `_disable_special_tags`.
+    texts += [gemini_manifold.Pipe._disable_special_tags(text)[0] for text in texts]
+    return texts
+
+
+def test_special_tag_fast_paths_match_the_regexes(gemini_manifold):
+    tag_regex, reverse_tag_regex = gemini_manifold._get_special_tag_regexes(
+        tuple(gemini_manifold.SPECIAL_TAGS_TO_DISABLE)
+    )
+    zws = gemini_manifold.ZWS
+    for text in corpus(gemini_manifold):
+        assert gemini_manifold.Pipe._disable_special_tags(text) == tag_regex.subn(
+            rf"<{zws}\1", text
+        )
+        enable_special_tags = gemini_manifold.GeminiContentBuilder._enable_special_tags
+        assert enable_special_tags(text) == reverse_tag_regex.sub(r"<\1", text)
+
+
+def test_media_link_fast_path_matches_the_regex_path(gemini_manifold, monkeypatch):
+    builder = object.__new__(gemini_manifold.GeminiContentBuilder)
+
+    async def genai_part_from_uri(uri, status_queue, priority):
+        return types.Part.from_text(text=f"media: {uri}")
+
+    builder._genai_part_from_uri = genai_part_from_uri
+
+    async def convert(texts):
+        return [
+            await builder._genai_parts_from_text(text, asyncio.Queue())
+            for text in texts
+        ]
+
+    texts = corpus(gemini_manifold)
+    for parse_youtube_urls in (True, False):
+        builder.valves = gemini_manifold.Pipe.Valves(
+            PARSE_YOUTUBE_URLS=parse_youtube_urls
+        )
+        for text in texts:
+            if not gemini_manifold._may_contain_media_link(text, parse_youtube_urls):
+                regex = gemini_manifold._get_media_link_regex(parse_youtube_urls)
+                assert regex.search(text) is None
+
+        fast = asyncio.run(convert(texts))
+        with monkeypatch.context() as patch:
+            # Forces every text through the regex scan.
+            patch.setattr(
+                gemini_manifold, "_may_contain_media_link", lambda *args: True
+            )
+            slow = asyncio.run(convert(texts))
+        assert fast == slow
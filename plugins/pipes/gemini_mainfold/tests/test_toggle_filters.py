@@ -0,0 +1,45 @@
+import asyncio
+from types import SimpleNamespace
+
+
+def make_filter(filter_id, is_active=True):
+    return SimpleNamespace(id=filter_id, is_active=is_active, is_global=True)
+
+
+def test_toggled_filter_missing_from_cache_reloads_filters(gemini_manifold, monkeypatch):
+    filter_id = next(iter(gemini_manifold.TOGGLE_FILTER_IDS))
+    installed = []
+    loads = []
+
+    def get_functions_by_type(type):
+        loads.append(type)
+        return list(installed)
+
+    monkeypatch.setattr(
+        gemini_manifold.Functions, "get_functions_by_type", get_functions_by_type
+    )
+    pipe = gemini_manifold.Pipe()
+
+    async def run():
+        # Not installed yet, the (empty) state is cached.
+        assert await pipe._get_toggleable_feature_status(filter_id, {}) == (False, False)
+        assert await pipe._get_toggleable_feature_status(filter_id, {}) == (False, False)
+        assert len(loads) == 1
+
+        # Installed afterwards and toggled on by the user.
+        installed.append(make_filter(filter_id))
+        metadata = {"filter_ids": [filter_id]}
+        assert await pipe._get_toggleable_feature_status(filter_id, metadata) == (
+            True,
+            True,
+        )
+        assert len(loads) == 2
+
+        # A fresh cache hit does not reload.
+        assert await pipe._get_toggleable_feature_status(filter_id, metadata) == (
+            True,
+            True,
+        )
+        assert len(loads) == 2
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+import asyncio
+
+
+def test_waiter_cancelled_while_queued_does_not_leak_the_slot(gemini_manifold):
+    scheduler = gemini_manifold.UploadScheduler(max_in_flight=1)
+
+    async def run():
+        await scheduler._acquire("a", scheduler.PRIORITY_HISTORY)
+        waiter = asyncio.create_task(
+            scheduler._acquire("b", scheduler.PRIORITY_HISTORY)
+        )
+        await asyncio.sleep(0)
+        assert scheduler.queued == 1
+
+        # The release happens before the cancelled waiter gets to run.
+        waiter.cancel()
+        scheduler._release()
+        assert scheduler.in_flight == 0
+        assert scheduler.queued == 0
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert waiter.cancelled()
+
+        await asyncio.wait_for(
+            scheduler._acquire("c", scheduler.PRIORITY_HISTORY), timeout=1
+        )
+        assert scheduler.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_next_waiter_is_served_after_a_cancelled_one(gemini_manifold):
+    scheduler = gemini_manifold.UploadScheduler(max_in_flight=1)
+
+    async def run():
+        async with scheduler.slot("a", scheduler.PRIORITY_HISTORY):
+            cancelled = asyncio.create_task(
+                scheduler._acquire("b", scheduler.PRIORITY_NEWEST_TURN)
+            )
+            served = asyncio.create_task(
+                scheduler._acquire("c", scheduler.PRIORITY_HISTORY)
+            )
+            await asyncio.sleep(0)
+            cancelled.cancel()
+        # Leaving the slot skipped the cancelled waiter and granted the next one.
+        await asyncio.wait_for(served, timeout=1)
+        assert scheduler.in_flight == 1
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert scheduler.queued == 0
+
+    asyncio.run(run())